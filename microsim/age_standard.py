@@ -0,0 +1,188 @@
+import mmap
+import os
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+from microsim.data_loader import get_absolute_datafile_path, get_cache_path
+
+# the SEER file, see https://seer.cancer.gov/popdata/popdic.html
+seerPopulationFilename = "us.1969_2017.19ages.adjusted.txt"
+# the SEER file reduced to one population per (year, ageGroup, female), see
+# build_standard_population_table
+standardPopulationFilename = "standardPopulation.npz"
+
+# (start, end) of the fields of a record in the SEER file
+_seerFields = {
+    'year': (0, 4),
+    'state': (4, 6),
+    'race': (13, 14),
+    'hispanic': (14, 15),
+    'sex': (15, 16),
+    'ageGroup': (16, 18),
+    'standardPopulation': (18, 26),
+}
+
+# the format of the SEER file changes in 1990...so, we'll go forward from there...
+firstStandardPopulationYear = 1990
+
+# the 19 age groups of the SEER file, times two sexes
+_numberOfGroups = 19 * 2
+
+
+class SEERPopulationReader:
+    """
+    Reads standard populations out of the SEER file without parsing all of it.
+
+    The file is memory mapped and viewed as a (records x record length) array of bytes, so
+    fields are read straight out of the mapped file. Records are sorted by year, so an index
+    of the records for each year is built once and a query only reads the records of its year.
+    """
+
+    def __init__(self, path=None):
+        path = get_absolute_datafile_path(seerPopulationFilename) if path is None else path
+        with open(path, "rb") as seerFile:
+            self._map = mmap.mmap(seerFile.fileno(), 0, access=mmap.ACCESS_READ)
+        recordLength = self._map.find(b"\n") + 1
+        if recordLength == 0 or len(self._map) % recordLength != 0:
+            raise ValueError(f"{path} doesn't have fixed width records")
+        self._records = np.frombuffer(self._map, dtype=np.uint8).reshape(-1, recordLength)
+        self._yearIndex = self._build_year_index()
+
+    @staticmethod
+    def _parse_numbers(records, field):
+        start, end = _seerFields[field]
+        numbers = np.zeros(len(records), dtype=np.int64)
+        for column in range(start, end):
+            numbers = numbers * 10 + (records[:, column] - ord("0"))
+        return numbers
+
+    def _build_year_index(self, blockSize=1000000):
+        """Returns {year: (first record, last record + 1)}."""
+        starts = []
+        years = []
+        previousYear = -1
+        # read the years a block at a time, so the index doesn't need a copy of the whole column
+        for blockStart in range(0, len(self._records), blockSize):
+            blockYears = SEERPopulationReader._parse_numbers(
+                self._records[blockStart:blockStart + blockSize], 'year')
+            changes = np.diff(blockYears, prepend=previousYear)
+            if np.any(changes < 0):
+                raise ValueError("SEER records aren't sorted by year")
+            firstRecords = np.flatnonzero(changes)
+            starts += (blockStart + firstRecords).tolist()
+            years += blockYears[firstRecords].tolist()
+            previousYear = blockYears[-1]
+        ends = starts[1:] + [len(self._records)]
+        return {year: (start, end) for year, start, end in zip(years, starts, ends)}
+
+    def years(self):
+        return sorted(self._yearIndex)
+
+    def standard_population(self, year, state=None, race=None, hispanic=None):
+        """
+        Returns the population for each age group and sex in a year, optionally limited to a
+        state (e.g. "MI"), a race (1 = white, 2 = black, 3 = american indian/alaskan,
+        4 = asian/pacific islander) and hispanic origin (0 = non-hispanic, 1 = hispanic), as a
+        table like the one from build_standard_population_table.
+        """
+        start, end = self._yearIndex.get(year, (0, 0))
+        records = self._records[start:end]
+        selected = np.ones(len(records), dtype=bool)
+        if state is not None:
+            stateStart, stateEnd = _seerFields['state']
+            selected &= np.all(records[:, stateStart:stateEnd] ==
+                               np.frombuffer(state.encode("ascii"), dtype=np.uint8), axis=1)
+        for field, value in [('race', race), ('hispanic', hispanic)]:
+            if value is not None:
+                selected &= SEERPopulationReader._parse_numbers(records, field) == value
+        records = records[selected]
+
+        # 1 = male, 2 = female
+        female = SEERPopulationReader._parse_numbers(records, 'sex') == 2
+        group = SEERPopulationReader._parse_numbers(records, 'ageGroup') * 2 + female
+        populations = np.bincount(group, minlength=_numberOfGroups,
+                                  weights=SEERPopulationReader._parse_numbers(
+                                      records, 'standardPopulation'))
+        present = np.flatnonzero(np.bincount(group, minlength=_numberOfGroups))
+        return {'year': np.full(len(present), year, dtype=np.int16),
+                'ageGroup': (present // 2).astype(np.int8),
+                'female': (present % 2).astype(np.int8),
+                'standardPopulation': populations[present].astype(np.int64)}
+
+    def close(self):
+        self._records = None
+        self._map.close()
+
+
+@lru_cache(maxsize=None)
+def get_seer_population_reader(path=None):
+    return SEERPopulationReader(path)
+
+
+def build_standard_population_table(seerPath=None):
+    """
+    Reduces the (400 MB) SEER file to the total population for each year, 19 age group and sex
+    combination.
+    """
+    reader = SEERPopulationReader(seerPath)
+    try:
+        tables = [reader.standard_population(year) for year in reader.years()
+                  if year >= firstStandardPopulationYear]
+    finally:
+        reader.close()
+    return {name: np.concatenate([table[name] for table in tables]) for name in tables[0]}
+
+
+def save_standard_population_table(table, path=None):
+    path = get_cache_path(standardPopulationFilename) if path is None else path
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    np.savez_compressed(path, **table)
+
+
+@lru_cache(maxsize=None)
+def load_standard_population_table(path=None):
+    """
+    Loads the table written by save_standard_population_table. If it hasn't been built yet, it
+    is built from the SEER file and saved for next time.
+    """
+    path = get_cache_path(standardPopulationFilename) if path is None else path
+    if not os.path.exists(path):
+        table = build_standard_population_table()
+        save_standard_population_table(table, path)
+        return table
+    with np.load(path) as stored:
+        return {name: stored[name] for name in stored.files}
+
+
+def get_age_standard(yearOfStandardizedPopulation, state=None, race=None, hispanic=None,
+                     standardPopulationPath=None, seerPath=None):
+    """
+    Returns the standard population for a year, one row per (ageGroup, female), along with the
+    ages in each group and empty columns for the simulated events.
+
+    Standard populations for the whole US come from the precomputed table. Standard
+    populations for a state, race or hispanic origin are read out of the SEER file.
+    """
+    if state is None and race is None and hispanic is None:
+        table = load_standard_population_table(standardPopulationPath)
+    else:
+        table = get_seer_population_reader(seerPath).standard_population(
+            yearOfStandardizedPopulation, state, race, hispanic)
+    inYear = table['year'] == yearOfStandardizedPopulation
+    ageGroup = table['ageGroup'][inYear].astype(np.int64)
+    female = table['female'][inYear].astype(np.int64)
+    # group 0 is ages 0 to 0, group 1 is ages 1 to 4, groups 2 to 17 are five years wide and
+    # group 18 is 85 and older
+    lowerAgeBound = np.where(ageGroup == 1, 1, np.maximum((ageGroup - 1) * 5, 0))
+    upperAgeBound = np.where(ageGroup == 18, 150, np.maximum(ageGroup * 5 - 1, 0))
+    return pd.DataFrame({'lowerAgeBound': lowerAgeBound,
+                         'upperAgeBound': upperAgeBound,
+                         'female': female,
+                         'standardPopulation': table['standardPopulation'][inYear],
+                         'outcomeCount': 0,
+                         'simPersonYears': 0,
+                         'simPeople': 0},
+                        index=pd.MultiIndex.from_arrays([ageGroup, female],
+                                                        names=['ageGroup', 'female']))
@@ -12,3 +12,12 @@ class AlcoholCategory(IntEnum):
     @staticmethod
     def get_category_for_consumption(drinks_per_week):
         return AlcoholCategory(pd.cut([drinks_per_week], [-1, 0, 6, 13, np.Infinity]).codes[0])
+
+    @staticmethod
+    def get_categories_for_consumption(drinks_per_week):
+        """get_category_for_consumption for an array, returns the category codes."""
+        codes = pd.cut(np.asarray(drinks_per_week), [-1, 0, 6, 13, np.Infinity]).codes
+        if np.any(codes < 0):
+            raise ValueError(f"{np.asarray(drinks_per_week)[codes < 0][0]} is not a valid "
+                             "consumption")
+        return codes.astype(np.int64)
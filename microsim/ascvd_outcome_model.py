@@ -6,6 +6,15 @@ from microsim.statsmodel_linear_risk_factor_model import StatsModelLinearRiskFac
 # https://annals.org/aim/fullarticle/2683613/[XSLTImagePath]
 
 
+# batch versions of the manual parameters, for the people in rows of a state
+def tot_chol_hdl_ratio_batch(state, rows):
+    return state.current('totChol', rows) / state.current('hdl', rows)
+
+
+def black_race_x_tot_chol_hdl_ratio_batch(state, rows):
+    return tot_chol_hdl_ratio_batch(state, rows) * state.model_argument('black', rows)
+
+
 class ASCVDOutcomeModel(StatsModelLinearRiskFactorModel):
 
     def __init__(self, regression_model, tot_chol_hdl_ratio, black_race_x_tot_chol_hdl_ratio):
@@ -18,9 +27,18 @@ class ASCVDOutcomeModel(StatsModelLinearRiskFactorModel):
         return {'tot_chol_hdl_ratio': (self._tot_chol_hdl_ratio, lambda person : person._totChol[-1] / person._hdl[-1]),
             'black_race_x_tot_chol_hdl_ratio': (self._black_race_x_tot_chol_hdl_ratio, lambda person : person._totChol[-1] / person._hdl[-1] * int(person._black))}
 
+    def get_manual_parameters_batch(self):
+        return {'tot_chol_hdl_ratio': (self._tot_chol_hdl_ratio, tot_chol_hdl_ratio_batch),
+                'black_race_x_tot_chol_hdl_ratio': (self._black_race_x_tot_chol_hdl_ratio,
+                                                    black_race_x_tot_chol_hdl_ratio_batch)}
+
 
     # TODO : need to figure out how to account fo rtime...which may be trikcy
     def get_risk_for_person(self, person, years):
         linearRisk = super(ASCVDOutcomeModel, self).estimate_next_risk(person)
 
         return (1 / (1 + np.exp(-1 * linearRisk))) * years / 10
+
+    def get_risk_batch(self, state, rows, years):
+        linearRisk = self.estimate_next_risk_batch(state, rows)
+        return (1 / (1 + np.exp(-1 * linearRisk))) * years / 10
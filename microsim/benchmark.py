@@ -0,0 +1,285 @@
+import contextlib
+import io
+import json
+import os
+import platform
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from microsim.age_standard import (build_standard_population_table, get_age_standard,
+                                   save_standard_population_table)
+from microsim.cohort_risk_model_repository import CohortRiskModelRepository
+from microsim.outcome import OutcomeType
+from microsim.outcome_model_repository import OutcomeModelRepository
+from microsim.population import Population, build_people_using_nhanes_for_sampling
+
+
+def fixture_nhanes(n, seed):
+    """
+    A synthetic sample with the columns of the NHANES dataset that populations are built from.
+    It only depends on n and seed, so benchmarks don't change when the dataset does.
+    """
+    random = np.random.RandomState(seed)
+    return pd.DataFrame({
+        'age': random.randint(18, 85, n).astype(float),
+        'gender': random.randint(1, 3, n).astype(float),
+        'raceEthnicity': random.randint(1, 6, n).astype(float),
+        'meanSBP': random.normal(125, 18, n),
+        'meanDBP': random.normal(72, 11, n),
+        'a1c': random.normal(5.7, 0.8, n),
+        'hdl': random.normal(52, 14, n),
+        'ldl': random.normal(115, 35, n),
+        'trig': random.normal(130, 60, n).clip(30),
+        'tot_chol': random.normal(195, 40, n),
+        'bmi': random.normal(28, 6, n),
+        'waist': random.normal(98, 15, n),
+        'anyPhysicalActivity': random.randint(0, 2, n).astype(float),
+        'smokingStatus': random.randint(0, 3, n).astype(float),
+        'alcoholPerWeek': random.choice([0, 0, 2, 5, 8, 15], n).astype(float),
+        'education': random.randint(1, 6, n).astype(float),
+        'antiHypertensive': random.choice([0, 0, 1, 2], n).astype(float),
+        'statin': random.randint(0, 2, n).astype(float),
+        'otherLipidLowering': np.zeros(n),
+        'selfReportStrokeAge': np.where(random.rand(n) < 0.05, 50.0, np.nan),
+        'selfReportMIAge': np.where(random.rand(n) < 0.05, 55.0, np.nan),
+        'diedBy2015': np.zeros(n),
+        'WTINT2YR': random.uniform(1000, 50000, n),
+        'index': np.arange(n)})
+
+
+def write_fixture_seer_file(path, seed):
+    """Writes a synthetic SEER file (see age_standard.py) for 2000 to 2017."""
+    random = np.random.RandomState(seed)
+    with open(path, "w") as seerFile:
+        for year in range(2000, 2018):
+            for state in ["AL", "AK", "MI"]:
+                for race in range(1, 5):
+                    for hispanic in range(2):
+                        for sex in range(1, 3):
+                            for ageGroup in range(19):
+                                # year, state, state fips, county fips, registry, race, origin,
+                                # sex, age group, population
+                                seerFile.write(f"{year}{state}0100199{race}{hispanic}{sex}"
+                                               f"{ageGroup:02d}{random.randint(1, 10**6):08d}\n")
+
+
+class FixturePopulation(Population):
+    """A population of fixture people, standardized with the fixture standard populations."""
+
+    def __init__(self, people, standardPopulationPath, seerPath):
+        super().__init__(people)
+        self._risk_model_repository = CohortRiskModelRepository()
+        self._outcome_model_repository = OutcomeModelRepository()
+        self._standardPopulationPath = standardPopulationPath
+        self._seerPath = seerPath
+
+    def build_age_standard(self, yearOfStandardizedPopulation, state=None, race=None,
+                           hispanic=None):
+        return get_age_standard(yearOfStandardizedPopulation, state, race, hispanic,
+                                standardPopulationPath=self._standardPopulationPath,
+                                seerPath=self._seerPath)
+
+
+class BenchmarkFixtures:
+    """
+    The inputs of the benchmarks: a synthetic NHANES sample, SEER file and standard population
+    table, written to directory. Everything is a function of the settings, so results from
+    runs with the same settings can be compared.
+    """
+
+    def __init__(self, directory, numberOfPeople=1000, years=3, processes=4, seed=11):
+        self.settings = {'numberOfPeople': numberOfPeople, 'years': years,
+                         'processes': processes, 'seed': seed}
+        self.numberOfPeople = numberOfPeople
+        self.years = years
+        self.processes = processes
+        self.seed = seed
+        self.nhanes = fixture_nhanes(max(numberOfPeople, 1000), seed)
+        self.seerPath = os.path.join(directory, "seer.txt")
+        write_fixture_seer_file(self.seerPath, seed)
+        self.standardPopulationPath = os.path.join(directory, "standardPopulation.npz")
+        save_standard_population_table(build_standard_population_table(self.seerPath),
+                                       self.standardPopulationPath)
+
+    def population(self):
+        """A fresh population of the fixture people, with a random seed."""
+        population = FixturePopulation(
+            build_people_using_nhanes_for_sampling(self.nhanes, self.numberOfPeople,
+                                                   random_seed=self.seed),
+            self.standardPopulationPath, self.seerPath)
+        population.num_of_processes = self.processes
+        population.set_random_seed(self.seed)
+        return population
+
+    def advanced_population(self):
+        population = self.population()
+        with contextlib.redirect_stdout(io.StringIO()):
+            population.advance_vectorized(self.years)
+        return population
+
+
+def person_years(population):
+    """Years that have been simulated, summed over the people."""
+    return int((population._state.lengths('age') - 1).sum())
+
+
+class BenchmarkCase:
+    """
+    One thing to time. setup() builds the input of run (untimed) and run(input) does the timed
+    work, calling the benchmarked function calls times. For simulations, personYears(input) is
+    the number of person years that a run simulated. With setupEachRepeat=False the input is
+    built once and reused, for runs that don't change it.
+    """
+
+    def __init__(self, name, setup, run, calls=1, personYears=None, setupEachRepeat=True):
+        self.name = name
+        self.setup = setup
+        self.run = run
+        self.calls = calls
+        self.personYears = personYears
+        self.setupEachRepeat = setupEachRepeat
+
+
+def advance_case(name, fixtures, advance):
+    def run(population):
+        advance(population, fixtures.years)
+        population.close_worker_pool()
+    return BenchmarkCase(name, fixtures.population, run, personYears=person_years)
+
+
+def benchmark_cases(fixtures):
+    """The benchmarks of the simulation's hot paths."""
+    n = fixtures.numberOfPeople
+
+    def estimate_next_risk(population):
+        model = population._risk_model_repository.get_model('sbp')
+        for person in population._people:
+            model.estimate_next_risk(person)
+
+    def estimate_next_risk_batch(population):
+        population._risk_model_repository.get_model('sbp').estimate_next_risk_batch(
+            population._state)
+
+    return [
+        # Person.advance_year, one person at a time
+        advance_case("advance.serial", fixtures,
+                     lambda population, years: population.advance(years)),
+        advance_case("advance.vectorized", fixtures,
+                     lambda population, years: population.advance_vectorized(years)),
+        advance_case("advance.multiprocess", fixtures,
+                     lambda population, years: population.advance_multi_process(
+                         years, vectorized=True)),
+        advance_case("advance.multiprocessPeople", fixtures,
+                     lambda population, years: population.advance_multi_process(years)),
+        BenchmarkCase("estimateNextRisk", fixtures.advanced_population, estimate_next_risk,
+                      calls=n, setupEachRepeat=False),
+        BenchmarkCase("estimateNextRisk.batch", fixtures.advanced_population,
+                      estimate_next_risk_batch, setupEachRepeat=False),
+        BenchmarkCase("buildAgeStandard", fixtures.population,
+                      lambda population: population.build_age_standard(2016),
+                      setupEachRepeat=False),
+        BenchmarkCase("buildAgeStandard.subset", fixtures.population,
+                      lambda population: population.build_age_standard(2016, race=2),
+                      setupEachRepeat=False),
+        BenchmarkCase("buildPeopleUsingNhanesForSampling", lambda: fixtures.nhanes,
+                      lambda nhanes: build_people_using_nhanes_for_sampling(
+                          nhanes, n, random_seed=fixtures.seed), setupEachRepeat=False),
+        BenchmarkCase("calculateMeanAgeSexStandardizedIncidence", fixtures.advanced_population,
+                      lambda population: population.calculate_mean_age_sex_standardized_incidence(
+                          OutcomeType.STROKE, 2016), setupEachRepeat=False),
+    ]
+
+
+def time_case(case, repeats):
+    """
+    Returns the results of a case: the median and fastest time per call over repeats, the
+    person years simulated per second and the peak memory that one run allocates.
+
+    Peak memory is traced with tracemalloc in a separate, untimed run, so it covers the
+    allocations of this process (numpy arrays included) but not those of worker processes.
+    """
+    timings = []
+    caseInput = case.setup()
+    with contextlib.redirect_stdout(io.StringIO()):
+        for repeat in range(repeats):
+            if case.setupEachRepeat and repeat > 0:
+                caseInput = case.setup()
+            start = time.perf_counter()
+            case.run(caseInput)
+            timings.append(time.perf_counter() - start)
+        simulated = None if case.personYears is None else case.personYears(caseInput)
+
+        if case.setupEachRepeat:
+            caseInput = case.setup()
+        tracemalloc.start()
+        try:
+            case.run(caseInput)
+            peakMemory = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    median = float(np.median(timings))
+    return {'latency': median / case.calls,
+            'fastestLatency': min(timings) / case.calls,
+            'personYearsPerSecond': None if simulated is None else simulated / median,
+            'peakMemory': peakMemory,
+            'repeats': repeats}
+
+
+def run_benchmarks(fixtures, repeats=3, names=None):
+    """
+    Times the benchmark cases (or the ones whose names start with one of names) and returns
+    the results along with the settings and environment they were run in.
+    """
+    results = {}
+    for case in benchmark_cases(fixtures):
+        if names is None or any(case.name.startswith(name) for name in names):
+            results[case.name] = time_case(case, repeats)
+    return {'settings': fixtures.settings,
+            'environment': {'python': platform.python_version(),
+                            'numpy': np.__version__,
+                            'pandas': pd.__version__,
+                            'machine': platform.machine(),
+                            'processors': os.cpu_count()},
+            'cases': results}
+
+
+def save_results(results, path):
+    with open(path, "w") as resultsFile:
+        json.dump(results, resultsFile, indent=2, sort_keys=True)
+
+
+def load_results(path):
+    with open(path, "r") as resultsFile:
+        return json.load(resultsFile)
+
+
+def compare_results(results, baseline, tolerance=0.2):
+    """
+    Compares the latency and peak memory of the cases in both results with the baseline's, as
+    a data frame with a row per case. A case regressed if either is more than tolerance (a
+    fraction) above the baseline.
+    """
+    if results['settings'] != baseline['settings']:
+        raise ValueError(f"Results for {results['settings']} can't be compared with a baseline "
+                         f"for {baseline['settings']}")
+    names = [name for name in results['cases'] if name in baseline['cases']]
+    comparison = pd.DataFrame({
+        'baselineLatency': [baseline['cases'][name]['latency'] for name in names],
+        'latency': [results['cases'][name]['latency'] for name in names],
+        'baselinePeakMemory': [baseline['cases'][name]['peakMemory'] for name in names],
+        'peakMemory': [results['cases'][name]['peakMemory'] for name in names]},
+        index=pd.Index(names, name='case'))
+    comparison['latencyRatio'] = comparison.latency / comparison.baselineLatency
+    comparison['peakMemoryRatio'] = comparison.peakMemory / comparison.baselinePeakMemory
+    comparison['regressed'] = (comparison.latencyRatio > 1 + tolerance) | \
+        (comparison.peakMemoryRatio > 1 + tolerance)
+    return comparison
+
+
+def format_results(results):
+    table = pd.DataFrame(results['cases']).T
+    table.index.name = 'case'
+    return table.to_string()
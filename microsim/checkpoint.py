@@ -0,0 +1,147 @@
+import hashlib
+import json
+import marshal
+import os
+import pickle
+import shutil
+import tempfile
+
+import numpy as np
+
+from microsim.event_log import EventLog
+from microsim.population_state import PopulationState
+
+# a checkpoint is a directory of generations, each a complete copy of the population. the
+# current generation is named by a pointer file that is replaced in one step once a generation is
+# fully written, so a crash while a checkpoint is being written leaves the previous one in place.
+_currentFilename = "CURRENT"
+_manifestFilename = "manifest.json"
+_payloadFilename = "payload.pickle"
+
+# the groups of per-person arrays in a state and how they're nested, see PopulationState
+_arrayGroups = ['_lengths', '_static', '_outcomeCounts', '_randomEffects', '_maxima']
+
+
+def _write_file(path, write):
+    # flushed to disk before the generation is made current
+    with open(path, "wb") as outputFile:
+        write(outputFile)
+        outputFile.flush()
+        os.fsync(outputFile.fileno())
+
+
+def _state_arrays(state):
+    """Yields (key, array) for every array that makes up a state."""
+    for name in state._history:
+        # only the populated columns are saved, in one array even if some of them are frozen
+        width = max(int(state._lengths[name].max(initial=0)), 1)
+        yield ('_history', name), state._columns(name, slice(None), width)
+    for group in _arrayGroups:
+        for name, values in getattr(state, group).items():
+            yield (group, name), values
+    for name, sumsByFunction in state._sums.items():
+        for function, sums in sumsByFunction.items():
+            yield ('_sums', name, function), sums
+    for name in EventLog.columns:
+        yield ('events', name), state.events.column(name)
+
+
+def save_state(state, directory):
+    """Writes the arrays of a state to a directory, one .npy file per array."""
+    arrays = []
+    for key, values in _state_arrays(state):
+        filename = f"{len(arrays)}.npy"
+        _write_file(os.path.join(directory, filename),
+                    lambda outputFile: np.save(outputFile, np.ascontiguousarray(values)))
+        arrays.append([list(key), filename])
+    return {'n': state.n, 'arrays': arrays}
+
+
+def load_state(directory, manifest, mmapMode='c'):
+    """
+    Opens a state written by save_state. By default the arrays are memory mapped copy on write,
+    so opening a large state is cheap and changes to it never reach the files.
+    """
+    state = PopulationState.__new__(PopulationState)
+    state.n = manifest['n']
+    state._history = {}
+    state._frozen = {name: [] for name in PopulationState.historyAttributes}
+    for group in _arrayGroups:
+        setattr(state, group, {})
+    state._sums = {name: {} for name in PopulationState.historyAttributes}
+    events = {}
+    for key, filename in manifest['arrays']:
+        values = np.load(os.path.join(directory, filename), mmap_mode=mmapMode)
+        if key[0] == '_sums':
+            state._sums[key[1]][key[2]] = values
+        elif key[0] == 'events':
+            events[key[1]] = values
+        else:
+            getattr(state, key[0])[key[1]] = values
+    state.events = EventLog()
+    state.events.n = len(events['row'])
+    state.events._columns = events
+    state.randomStreams = None
+    return state
+
+
+def write_checkpoint(path, state, payload):
+    """
+    Writes a state and a (picklable) payload as a new generation of the checkpoint at path, makes
+    it the current one and removes the older generations.
+    """
+    os.makedirs(path, exist_ok=True)
+    generationPath = tempfile.mkdtemp(prefix="generation-", dir=path)
+    try:
+        manifest = save_state(state, generationPath)
+        _write_file(os.path.join(generationPath, _payloadFilename),
+                    lambda outputFile: pickle.dump(payload, outputFile, pickle.HIGHEST_PROTOCOL))
+        _write_file(os.path.join(generationPath, _manifestFilename),
+                    lambda outputFile: outputFile.write(json.dumps(manifest).encode("utf-8")))
+        currentPath = os.path.join(path, _currentFilename)
+        _write_file(currentPath + ".tmp", lambda outputFile: outputFile.write(
+            os.path.basename(generationPath).encode("utf-8")))
+        os.replace(currentPath + ".tmp", currentPath)
+    except BaseException:
+        shutil.rmtree(generationPath, ignore_errors=True)
+        raise
+    # populations that were loaded from an older generation keep their memory maps of it, the
+    # files only go away once they are closed
+    for entry in os.scandir(path):
+        if entry.is_dir() and entry.path != generationPath:
+            shutil.rmtree(entry.path, ignore_errors=True)
+
+
+def has_checkpoint(path):
+    return os.path.isfile(os.path.join(path, _currentFilename))
+
+
+def read_checkpoint(path, mmapMode='c'):
+    """Returns the state and the payload of the current generation of a checkpoint."""
+    with open(os.path.join(path, _currentFilename), "r") as currentFile:
+        generationPath = os.path.join(path, currentFile.read().strip())
+    with open(os.path.join(generationPath, _manifestFilename), "r") as manifestFile:
+        manifest = json.load(manifestFile)
+    state = load_state(generationPath, manifest, mmapMode)
+    with open(os.path.join(generationPath, _payloadFilename), "rb") as payloadFile:
+        payload = pickle.load(payloadFile)
+    return state, payload
+
+
+def cache_key(values):
+    """A file name friendly key for a json-able description of something that is cached."""
+    description = json.dumps(values, sort_keys=True, default=str)
+    return hashlib.sha256(description.encode("utf-8")).hexdigest()[:32]
+
+
+def function_key(function):
+    """
+    Describes a function (e.g. a population filter) for a cache key, by its name, its code and
+    the values it closes over. Globals that the function reads aren't part of the key.
+    """
+    if function is None:
+        return None
+    closure = [cell.cell_contents for cell in function.__closure__ or []]
+    return [f"{function.__module__}.{function.__qualname__}",
+            hashlib.sha256(marshal.dumps(function.__code__)).hexdigest(),
+            repr(closure), repr(function.__defaults__)]
@@ -2,11 +2,11 @@ from microsim.outcome import OutcomeType
 from microsim.outcome_model_type import OutcomeModelType
 from microsim.outcome import Outcome
 from microsim.statsmodel_linear_risk_factor_model import StatsModelLinearRiskFactorModel
-from microsim.regression_model import RegressionModel
-from microsim.data_loader import load_model_spec
+from microsim.data_loader import load_model
+from microsim.random_streams import draw_uniform, draw_uniform_batch
 
 
-import numpy.random as npRand
+import numpy as np
 import scipy.special as scipySpecial
 
 
@@ -30,39 +30,61 @@ class CVOutcomeDetermination:
                  stroke_case_fatality=default_stroke_case_fatality,
                  mi_secondary_case_fatality=default_secondary_mi_case_fatality,
                  stroke_secondary_case_fatality=default_secondary_stroke_case_fatality,
-                 secondary_prevention_multiplier=default_secondary_prevention_multiplier):
+                 secondary_prevention_multiplier=default_secondary_prevention_multiplier,
+                 stroke_partition_model=None):
         self.mi_case_fatality = mi_case_fatality
-        self.mi_secondary_case_fatality = mi_secondary_case_fatality,
+        self.mi_secondary_case_fatality = mi_secondary_case_fatality
         self.stroke_case_fatality = stroke_case_fatality
         self.stroke_secondary_case_fatality = stroke_secondary_case_fatality
         self.secondary_prevention_multiplier = secondary_prevention_multiplier
+        # splits CV events into strokes and MIs, the published model unless one is given
+        self.stroke_partition_model = stroke_partition_model
 
-    def _will_have_cvd_event(self, ascvdProb):
-        return npRand.uniform(size=1) < ascvdProb
+    def _will_have_cvd_event(self, ascvdProb, person):
+        return draw_uniform(person, "cvEvent") < ascvdProb
 
     def _will_have_mi(self, person, outcome_model_repository, manualMIProb=None):
         if manualMIProb is not None:
-            return npRand.uniform(size=1) < manualMIProb
+            return draw_uniform(person, "cvEventType") < manualMIProb
         # if no manual MI probablity, estimate it from oru partitioned model
         strokeProbability = self.get_stroke_probability(person)
 
-        return npRand.uniform(size=1) < (1 - strokeProbability)
+        return draw_uniform(person, "cvEventType") < (1 - strokeProbability)
+
+    def get_stroke_partition_model(self):
+        if self.stroke_partition_model is not None:
+            return self.stroke_partition_model
+        return load_model("StrokeMIPartitionModel", StatsModelLinearRiskFactorModel)
 
     def get_stroke_probability(self, person):
-        model_spec = load_model_spec("StrokeMIPartitionModel")
-        strokePartitionModel = StatsModelLinearRiskFactorModel(RegressionModel(**model_spec))
+        strokePartitionModel = self.get_stroke_partition_model()
         strokeProbability = scipySpecial.expit(strokePartitionModel.estimate_next_risk(person))
         return strokeProbability
 
+    def get_stroke_probability_batch(self, state, rows):
+        strokePartitionModel = self.get_stroke_partition_model()
+        return scipySpecial.expit(strokePartitionModel.estimate_next_risk_batch(state, rows))
+
     def _will_have_fatal_mi(self, person, overrideMIProb=None):
         fatalMIProb = overrideMIProb if overrideMIProb is not None else self.mi_case_fatality
         fatalProb = self.mi_secondary_case_fatality if person._mi else fatalMIProb
-        return npRand.uniform(size=1) < fatalProb
+        return draw_uniform(person, "cvEventFatality") < fatalProb
 
     def _will_have_fatal_stroke(self, person, overrideStrokeProb=None):
         fatalStrokeProb = overrideStrokeProb if overrideStrokeProb is not None else self.stroke_case_fatality
         fatalProb = self.stroke_secondary_case_fatality if person._stroke else fatalStrokeProb
-        return npRand.uniform(size=1) < fatalProb
+        return draw_uniform(person, "cvEventFatality") < fatalProb
+
+    # batch versions of _will_have_fatal_mi and _will_have_fatal_stroke for rows of a state
+    def will_have_fatal_mi_batch(self, state, rows):
+        fatalProb = np.where(state.outcome_count('mi')[rows] > 0, self.mi_secondary_case_fatality,
+                             self.mi_case_fatality)
+        return draw_uniform_batch(state, rows, "cvEventFatality") < fatalProb
+
+    def will_have_fatal_stroke_batch(self, state, rows):
+        fatalProb = np.where(state.outcome_count('stroke')[rows] > 0,
+                             self.stroke_secondary_case_fatality, self.stroke_case_fatality)
+        return draw_uniform_batch(state, rows, "cvEventFatality") < fatalProb
 
     def assign_outcome_for_person(
             self,
@@ -78,7 +100,7 @@ class CVOutcomeDetermination:
         if person._stroke or person._mi:
             cvRisk = cvRisk * self.secondary_prevention_multiplier
 
-        if self._will_have_cvd_event(cvRisk):
+        if self._will_have_cvd_event(cvRisk, person):
             if self._will_have_mi(person, outcome_model_repository, manualStrokeMIProbability):
                 if self._will_have_fatal_mi(person):
                     return Outcome(OutcomeType.MI, True)
@@ -89,3 +111,44 @@ class CVOutcomeDetermination:
                     return Outcome(OutcomeType.STROKE, True)
                 else:
                     return Outcome(OutcomeType.STROKE, False)
+
+    def assign_outcomes_batch(
+            self,
+            outcome_model_repository,
+            state,
+            rows,
+            years=1,
+            manualStrokeMIProbability=None):
+        """
+        Batch version of assign_outcome_for_person for the people in `rows` of a PopulationState.
+
+        Returns three boolean arrays with one entry per row: whether the person had a CV event,
+        whether that event was an MI (otherwise a stroke) and whether it was fatal. Random draws
+        are made as one block per step (event, type, fatality) rather than per person.
+        """
+        rows = np.asarray(rows)
+        cvRisk = outcome_model_repository.get_cv_risk_batch(state, rows, years=1)
+        priorEvent = state.model_argument('mi', rows) | state.model_argument('stroke', rows)
+        cvRisk = np.where(priorEvent, cvRisk * self.secondary_prevention_multiplier, cvRisk)
+
+        hadEvent = draw_uniform_batch(state, rows, "cvEvent") < cvRisk
+        eventRows = rows[hadEvent]
+
+        if manualStrokeMIProbability is not None:
+            miProbability = manualStrokeMIProbability
+        else:
+            miProbability = 1 - self.get_stroke_probability_batch(state, eventRows)
+        eventIsMI = draw_uniform_batch(state, eventRows, "cvEventType") < miProbability
+
+        miFatality = np.where(state.model_argument('mi', eventRows),
+                              self.mi_secondary_case_fatality, self.mi_case_fatality)
+        strokeFatality = np.where(state.model_argument('stroke', eventRows),
+                                  self.stroke_secondary_case_fatality, self.stroke_case_fatality)
+        eventIsFatal = draw_uniform_batch(state, eventRows, "cvEventFatality") < \
+            np.where(eventIsMI, miFatality, strokeFatality)
+
+        isMI = np.zeros(len(rows), dtype=bool)
+        isMI[hadEvent] = eventIsMI
+        fatal = np.zeros(len(rows), dtype=bool)
+        fatal[hadEvent] = eventIsFatal
+        return hadEvent, isMI, fatal
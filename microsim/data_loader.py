@@ -1,3 +1,4 @@
+import copy
 import json
 import re
 import os.path
@@ -10,21 +11,110 @@ def get_absolute_datafile_path(filename):
     return abs_datafile_path
 
 
+def get_cache_path(name):
+    """
+    Returns the path of a file or directory that microsim generates and keeps between runs.
+
+    Caches live outside of the package, which may be installed read only, in $MICROSIM_CACHE_DIR
+    if it is set, or else in the user's cache directory ($XDG_CACHE_HOME or ~/.cache).
+    """
+    cacheDirectory = os.environ.get("MICROSIM_CACHE_DIR")
+    if not cacheDirectory:
+        userCacheDirectory = os.environ.get("XDG_CACHE_HOME") or \
+            os.path.join(os.path.expanduser("~"), ".cache")
+        cacheDirectory = os.path.join(userCacheDirectory, "microsim")
+    return os.path.join(os.path.abspath(cacheDirectory), name)
+
+
 def load_datafile(filename):
     datafile_path = get_absolute_datafile_path(filename)
     with open(datafile_path, 'r') as datafile:
         return datafile.read()
 
 
+class ModelRegistry:
+    """
+    Per-process cache of parsed model specs and of the models built from them.
+
+    Specs are read and parsed once per process, and models are built once per spec and
+    model type, so code that needs a model for every person (or every event) can ask the
+    registry for it instead of rebuilding it. Spec files are checked for changes (by
+    modification time) each time they are used, unless check_modified_times is False; an
+    entry can also be dropped explicitly with invalidate.
+    """
+
+    def __init__(self, data_directory=None, check_modified_times=True):
+        self._data_directory = data_directory
+        self.check_modified_times = check_modified_times
+        # modelname -> (modification time, spec)
+        self._specs = {}
+        # (modelname, model class, regression model class, model kwargs) ->
+        # (modification time, model)
+        self._models = {}
+
+    def get_spec_path(self, modelname):
+        modelspecnamepattern = r'^[A-Za-z0-9\-]+$'
+        if not re.match(modelspecnamepattern, modelname):
+            raise ValueError(f"Potentially unsafe model name: {modelname}")
+        if self._data_directory is None:
+            return get_absolute_datafile_path(f"{modelname}Spec.json")
+        return os.path.join(self._data_directory, f"{modelname}Spec.json")
+
+    def _get_cached_spec(self, modelname):
+        cached = self._specs.get(modelname)
+        if cached is not None and not self.check_modified_times:
+            return cached
+        path = self.get_spec_path(modelname)
+        modifiedTime = os.path.getmtime(path)
+        if cached is None or cached[0] != modifiedTime:
+            with open(path, 'r') as specfile:
+                cached = (modifiedTime, json.loads(specfile.read()))
+            self._specs[modelname] = cached
+        return cached
+
+    def get_model_spec(self, modelname):
+        # callers are free to modify the spec they get back, so they get their own copy
+        return copy.deepcopy(self._get_cached_spec(modelname)[1])
+
+    def get_model(self, modelname, model_class, regression_model_class=RegressionModel,
+                  **model_kwargs):
+        """
+        Returns the model built by model_class(regression_model_class(**spec), **model_kwargs).
+        The same object is returned to every caller, so it shouldn't be modified.
+        """
+        key = (modelname, model_class, regression_model_class,
+               tuple(sorted(model_kwargs.items())))
+        modifiedTime = self._get_cached_spec(modelname)[0]
+        cached = self._models.get(key)
+        if cached is None or cached[0] != modifiedTime:
+            regressionModel = regression_model_class(**self.get_model_spec(modelname))
+            cached = (modifiedTime, model_class(regressionModel, **model_kwargs))
+            self._models[key] = cached
+        return cached[1]
+
+    def invalidate(self, modelname=None):
+        """Drops the cached spec and models for modelname, or everything if no name is given."""
+        if modelname is None:
+            self._specs.clear()
+            self._models.clear()
+            return
+        self._specs.pop(modelname, None)
+        for key in [key for key in self._models if key[0] == modelname]:
+            del self._models[key]
+
+
+model_registry = ModelRegistry()
+
+
 def load_model_spec(modelname):
-    modelspecnamepattern = r'^[A-Za-z0-9\-]+$'
-    if not re.match(modelspecnamepattern, modelname):
-        raise ValueError(f"Potentially unsafe model name: {modelname}")
-    data = load_datafile(f"{modelname}Spec.json")
-    model_spec = json.loads(data)
-    return model_spec
+    return model_registry.get_model_spec(modelname)
 
 
 def load_regression_model(modelname):
     model_spec = load_model_spec(modelname)
     return RegressionModel(**model_spec)
+
+
+def load_model(modelname, model_class, regression_model_class=RegressionModel, **model_kwargs):
+    return model_registry.get_model(modelname, model_class, regression_model_class,
+                                    **model_kwargs)
@@ -0,0 +1,262 @@
+from collections.abc import MutableMapping
+
+import numpy as np
+
+from microsim.outcome import Outcome, OutcomeType
+
+
+class EventLog:
+    """
+    Columnar log of the outcome events of the people in a PopulationState.
+
+    Every event is a row of (row, wave, age, type, fatal), where row is the person's row in the
+    state and wave is the wave the event happened in (the event's age is the person's age at the
+    start of that wave). Events that happened before the simulation have an age of -1. Events
+    are kept in the order they were added, so each person's events are in chronological order.
+
+    Indexes of the events by person and by wave are built when they are first needed after the
+    log changes, so that population-wide queries are array operations rather than scans of
+    per-person lists.
+    """
+
+    outcomeTypes = [OutcomeType.MI, OutcomeType.STROKE]
+
+    columns = {
+        'row': np.int64,
+        'wave': np.int64,
+        # ages are whole numbers unless people were given fractional ages, see add
+        'age': np.int64,
+        'type': np.int8,
+        'fatal': np.bool_,
+    }
+
+    def __init__(self, capacity=16):
+        self.n = 0
+        self._columns = {name: np.zeros(capacity, dtype=dtype)
+                         for name, dtype in EventLog.columns.items()}
+        self._indexes = {}
+
+    def __len__(self):
+        return self.n
+
+    @staticmethod
+    def type_code(outcomeType):
+        return EventLog.outcomeTypes.index(outcomeType)
+
+    def column(self, name):
+        return self._columns[name][:self.n]
+
+    def add(self, rows, waves, ages, outcomeTypes, fatal):
+        """
+        Adds events, given as one value per event for each column. outcomeTypes is either an
+        OutcomeType for all of the events or an array of type codes (see type_code).
+        """
+        rows = np.atleast_1d(np.asarray(rows, dtype=np.int64))
+        if isinstance(outcomeTypes, OutcomeType):
+            outcomeTypes = EventLog.type_code(outcomeTypes)
+        count = len(rows)
+        ages = np.asarray(ages)
+        if self._columns['age'].dtype.kind == "i" and ages.dtype.kind not in "biu" and \
+                not np.all(np.mod(ages, 1) == 0):
+            self._columns['age'] = self._columns['age'].astype(np.float64)
+        if self.n + count > len(self._columns['row']):
+            capacity = max(self.n + count, 2 * len(self._columns['row']))
+            for name, values in self._columns.items():
+                grown = np.zeros(capacity, dtype=values.dtype)
+                grown[:self.n] = values[:self.n]
+                self._columns[name] = grown
+        for name, values in [('row', rows), ('wave', waves), ('age', ages), ('type', outcomeTypes),
+                             ('fatal', fatal)]:
+            self._columns[name][self.n:self.n + count] = values
+        self.n += count
+        self._indexes = {}
+
+    def remove(self, eventIds):
+        keep = np.ones(self.n, dtype=bool)
+        keep[eventIds] = False
+        for name, values in self._columns.items():
+            values[:keep.sum()] = values[:self.n][keep]
+        self.n = int(keep.sum())
+        self._indexes = {}
+
+    def events_since(self, start):
+        """Returns the columns of the events added after the first `start` events."""
+        return {name: values[start:self.n].copy() for name, values in self._columns.items()}
+
+    def _index(self, name):
+        if name not in self._indexes:
+            values = self.column(name)
+            order = np.argsort(values, kind='stable')
+            self._indexes[name] = (order, values[order])
+        return self._indexes[name]
+
+    def _lookup(self, name, value):
+        order, sortedValues = self._index(name)
+        return order[np.searchsorted(sortedValues, value, 'left'):
+                     np.searchsorted(sortedValues, value, 'right')]
+
+    def events_for_row(self, row, outcomeType=None):
+        """Ids of a person's events (of a type), in the order they happened."""
+        eventIds = self._lookup('row', row)
+        if outcomeType is None:
+            return eventIds
+        return eventIds[self.column('type')[eventIds] == EventLog.type_code(outcomeType)]
+
+    def last_events(self, rows, outcomeType=None):
+        """The id of each row's most recent event (of a type), -1 for rows without one."""
+        rows = np.asarray(rows)
+        lastEvents = np.full(len(rows), -1, dtype=np.int64)
+        eventIds = np.flatnonzero(self.selected(outcomeType))
+        eventRows = self.column('row')[eventIds]
+        order = np.argsort(rows)
+        positions = np.searchsorted(rows[order], eventRows)
+        found = positions < len(rows)
+        found[found] = rows[order][positions[found]] == eventRows[found]
+        # ids are in the order the events were added, so the largest one is the most recent
+        np.maximum.at(lastEvents, order[positions[found]], eventIds[found])
+        return lastEvents
+
+    def events_in_wave(self, wave, outcomeType=None):
+        eventIds = self._lookup('wave', wave)
+        if outcomeType is None:
+            return eventIds
+        return eventIds[self.column('type')[eventIds] == EventLog.type_code(outcomeType)]
+
+    def selected(self, outcomeType=None, duringSimulation=None):
+        """A mask over the events of a type, that happened during (or before) the simulation."""
+        mask = np.ones(self.n, dtype=bool)
+        if outcomeType is not None:
+            mask &= self.column('type') == EventLog.type_code(outcomeType)
+        if duringSimulation is not None:
+            mask &= (self.column('age') >= 0) == duringSimulation
+        return mask
+
+    def count_by_row(self, numberOfRows, outcomeType=None, duringSimulation=None):
+        return np.bincount(self.column('row')[self.selected(outcomeType, duringSimulation)],
+                           minlength=numberOfRows)
+
+    def count_by_wave(self, numberOfWaves, outcomeType=None):
+        """Number of events (of a type) in each wave, for waves 0 to numberOfWaves - 1."""
+        duringSimulation = None if outcomeType is None else True
+        return np.bincount(self.column('wave')[self.selected(outcomeType, duringSimulation)],
+                           minlength=numberOfWaves)
+
+    def first_event_ages(self, numberOfRows, outcomeType):
+        """The age at each person's first event of a type, NaN for people without one."""
+        eventIds = np.flatnonzero(self.selected(outcomeType))
+        ages = np.full(numberOfRows, np.nan)
+        # assign in reverse, so the first event is the one that sticks
+        ages[self.column('row')[eventIds[::-1]]] = self.column('age')[eventIds[::-1]]
+        return ages
+
+    def copy(self):
+        log = EventLog(max(self.n, 1))
+        log.add(self.column('row'), self.column('wave'), self.column('age'), self.column('type'),
+                self.column('fatal'))
+        return log
+
+    def take(self, rows):
+        """Returns a log of the events of `rows`, renumbered to their position in `rows`."""
+        subset = EventLog()
+        subset.copy_rows_from(self, np.arange(len(rows)), np.asarray(rows))
+        return subset
+
+    def copy_rows_from(self, source, targetRows, sourceRows):
+        """Replaces the events of targetRows with the events of sourceRows in another log."""
+        if self.n > 0:
+            self.remove(np.flatnonzero(np.isin(self.column('row'), targetRows)))
+        if source.n == 0:
+            return
+        sourceRows = np.asarray(sourceRows)
+        sourceEvents = np.flatnonzero(np.isin(source.column('row'), sourceRows))
+        order = np.argsort(sourceRows)
+        positions = order[np.searchsorted(sourceRows[order], source.column('row')[sourceEvents])]
+        self.add(np.asarray(targetRows)[positions], source.column('wave')[sourceEvents],
+                 source.column('age')[sourceEvents],
+                 source.column('type')[sourceEvents], source.column('fatal')[sourceEvents])
+
+
+class PersonEvents:
+    """List-like view of one person's events of one type, as (age, Outcome) tuples."""
+
+    def __init__(self, state, row, outcomeType):
+        self._state = state
+        self._row = row
+        self._outcomeType = outcomeType
+
+    def _event_ids(self):
+        return self._state.events.events_for_row(self._row, self._outcomeType)
+
+    def ages(self):
+        return self._state.events.column('age')[self._event_ids()]
+
+    def fatal(self):
+        return self._state.events.column('fatal')[self._event_ids()]
+
+    def __len__(self):
+        return len(self._event_ids())
+
+    def __getitem__(self, index):
+        return list(self)[index]
+
+    def __iter__(self):
+        events = self._state.events
+        for eventId in self._event_ids():
+            yield (events.column('age')[eventId].item(),
+                   Outcome(self._outcomeType, bool(events.column('fatal')[eventId])))
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def __repr__(self):
+        return repr(list(self))
+
+    def append(self, event):
+        age, outcome = event
+        # an age history (like person._age) stands for the person's current age
+        if np.ndim(age) > 0:
+            age = age[-1]
+        # events prior to the simulation (at age -1) are kept in wave 0
+        wave = 0 if age < 0 else self._state.get_length('age', self._row)
+        self._state.add_events(self._row, wave, age, self._outcomeType, outcome.fatal)
+
+    def pop(self):
+        eventIds = self._event_ids()
+        if len(eventIds) == 0:
+            raise IndexError("pop from empty list")
+        event = self[-1]
+        self._state.remove_events(eventIds[-1:])
+        return event
+
+
+class PersonOutcomes(MutableMapping):
+    """Dictionary-like view of a person's events by OutcomeType, stored in the event log."""
+
+    def __init__(self, state, row):
+        self._state = state
+        self._row = row
+
+    def __getitem__(self, outcomeType):
+        if outcomeType not in EventLog.outcomeTypes:
+            raise KeyError(outcomeType)
+        return PersonEvents(self._state, self._row, outcomeType)
+
+    def __setitem__(self, outcomeType, events):
+        # a single (age, Outcome) event can be stored in place of a list of them
+        if isinstance(events, tuple) and len(events) == 2 and isinstance(events[1], Outcome):
+            events = [events]
+        del self[outcomeType]
+        for event in events:
+            self[outcomeType].append(event)
+
+    def __delitem__(self, outcomeType):
+        self._state.remove_events(self._state.events.events_for_row(self._row, outcomeType))
+
+    def __iter__(self):
+        return iter(EventLog.outcomeTypes)
+
+    def __len__(self):
+        return len(EventLog.outcomeTypes)
+
+    def __repr__(self):
+        return repr({outcomeType: list(self[outcomeType]) for outcomeType in self})
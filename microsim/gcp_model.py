@@ -42,8 +42,8 @@ class GCPModel:
         xb += person._bmi[-1] * 0.1309
         xb += person._waist[-1] * -0.05754
         xb += person._totChol[-1]/10 * 0.002690
-        xb += (np.array(person._sbp).mean()-120) * -0.2663
-        xb += (np.array(person._sbp).mean()-120) * person.years_in_simulation() * -0.01953
+        xb += (person._sbp.mean()-120) * -0.2663
+        xb += (person._sbp.mean()-120) * person.years_in_simulation() * -0.01953
 
         # need to figure otu what to do with glucose
         # gluc10 - 0.09362
@@ -53,7 +53,49 @@ class GCPModel:
             xb += -1.6579
         return xb
 
+    # batch version of calc_linear_predictor for the people in rows of a PopulationState. the
+    # terms are added in the same order as calc_linear_predictor (terms that don't apply add
+    # zero), so both give identical results
+    def calc_linear_predictor_batch(self, state, rows):
+        yearsInSim = state.lengths('age')[rows] - 1
+        black = state.static('raceEthnicity')[rows] == NHANESRaceEthnicity.NON_HISPANIC_BLACK
+        female = state.static('gender')[rows] == NHANESGender.FEMALE
+        baseAge = state.baseline('age', rows)
+        meanSbp = state.running_mean('sbp', rows)
+
+        xb = np.full(len(rows), 55.6090)
+        xb += yearsInSim * -0.2031
+        xb += np.where(black, -5.6818, 0.0)
+        xb += np.where(black, yearsInSim * -0.00870, 0.0)
+        xb += np.where(female, 2.0863, 0.0)
+        xb += np.where(female, yearsInSim * -0.06184, 0.0)
+        xb += -2.0109 * baseAge/10
+        xb += -0.1266 * yearsInSim * baseAge/10
+        xb += GCPModel.get_education_effects_batch(state.static('education')[rows])
+        xb += np.where(state.static('smokingStatus')[rows] == SmokingStatus.CURRENT, -1.1678, 0.0)
+        xb += state.current('bmi', rows) * 0.1309
+        xb += state.current('waist', rows) * -0.05754
+        xb += state.current('totChol', rows)/10 * 0.002690
+        xb += (meanSbp-120) * -0.2663
+        xb += (meanSbp-120) * yearsInSim * -0.01953
+        xb += np.where(state.current('anyPhysicalActivity', rows) != 0, 0.6065, 0.0)
+        xb += np.where(state.current('afib', rows), -1.6579, 0.0)
+        return xb
+
+    @staticmethod
+    def get_education_effects_batch(education):
+        effects = np.zeros(len(education))
+        for level, effect in [(Education.LESSTHANHIGHSCHOOL, -9.5559),
+                              (Education.SOMEHIGHSCHOOL, -6.6495),
+                              (Education.HIGHSCHOOLGRADUATE, -3.1954),
+                              (Education.SOMECOLLEGE, -2.3795)]:
+            effects[education == level] = effect
+        return effects
+
     # TODO : need to add some tests cases to make sure this syncs up
     # TODO : need to account for uyncertainty...random draws from residual distrribution +/- accounting for coefficient variation
     def get_risk_for_person(self, person, years=1):
         return self.calc_linear_predictor(person)
+
+    def get_risk_batch(self, state, rows, years=1):
+        return self.calc_linear_predictor_batch(state, rows)
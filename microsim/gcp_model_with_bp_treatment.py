@@ -3,6 +3,8 @@ from microsim.smoking_status import SmokingStatus
 from microsim.race_ethnicity import NHANESRaceEthnicity
 from microsim.education import Education
 from microsim.gender import NHANESGender
+from microsim.person import Person
+from microsim.random_streams import draw_normal, draw_normal_batch
 
 
 class GCPModel:
@@ -43,8 +45,8 @@ class GCPModel:
         xb += (person._waist[-1]-94) * -0.05754
         # note...not 100% sure if this should be LDL vs. tot chol...
         xb += (person._totChol[-1]-127)/10 * 0.002690
-        xb += (np.array(person._sbp).mean()-120)/10 * -0.2663
-        xb += (np.array(person._sbp).mean()-120)/10 * person.years_in_simulation() * -0.01953
+        xb += (person._sbp.mean()-120)/10 * -0.2663
+        xb += (person._sbp.mean()-120)/10 * person.years_in_simulation() * -0.01953
 
         xb += (person._antiHypertensiveCount[-1] > 0) * 0.04410
         xb += (person._antiHypertensiveCount[-1] > 0) * person.years_in_simulation() * 0.01984
@@ -57,7 +59,65 @@ class GCPModel:
             xb += -1.6579
         return xb
 
+    # batch version of calc_linear_predictor for the people in rows of a PopulationState. the
+    # residual of the fasting glucose is drawn for everybody at once. the terms are added in the
+    # same order as calc_linear_predictor (terms that don't apply add zero), so both give
+    # identical results
+    def calc_linear_predictor_batch(self, state, rows, test=False):
+        yearsInSim = state.lengths('age')[rows] - 1
+        black = state.static('raceEthnicity')[rows] == NHANESRaceEthnicity.NON_HISPANIC_BLACK
+        female = state.static('gender')[rows] == NHANESGender.FEMALE
+        baseAge = state.baseline('age', rows)
+        meanSbp = state.running_mean('sbp', rows)
+        bpTreatment = state.current('antiHypertensiveCount', rows) > 0
+
+        xb = np.full(len(rows), 55.6090)
+        xb += yearsInSim * -0.2031
+        xb += np.where(black, -5.6818, 0.0)
+        xb += np.where(black, yearsInSim * -0.00870, 0.0)
+        xb += np.where(female, 2.0863, 0.0)
+        xb += np.where(female, yearsInSim * -0.06184, 0.0)
+        xb += -2.0109 * (baseAge-65)/10
+        xb += -0.1266 * yearsInSim * (baseAge-65)/10
+        xb += GCPModel.get_education_effects_batch(state.static('education')[rows])
+
+        alcCoeffs = np.array([0, 0.8071, 0.6943, 0.7706])
+        xb += alcCoeffs[state.current('alcoholPerWeek', rows).astype(int)]
+
+        xb += np.where(state.static('smokingStatus')[rows] == SmokingStatus.CURRENT, -1.1678, 0.0)
+        xb += (state.current('bmi', rows)-26.6) * 0.1309
+        xb += (state.current('waist', rows)-94) * -0.05754
+        xb += (state.current('totChol', rows)-127)/10 * 0.002690
+        xb += (meanSbp-120)/10 * -0.2663
+        xb += (meanSbp-120)/10 * yearsInSim * -0.01953
+
+        xb += bpTreatment * 0.04410
+        xb += bpTreatment * yearsInSim * 0.01984
+
+        glucose = Person.convert_a1c_to_fasting_glucose(state.current('a1c', rows))
+        if not test:
+            glucose += draw_normal_batch(state, rows, "fastingGlucoseResidual", 0, 21)
+        xb += (glucose-100)/10 * - 0.09362
+        xb += np.where(state.current('anyPhysicalActivity', rows) != 0, 0.6065, 0.0)
+        xb += np.where(state.current('afib', rows), -1.6579, 0.0)
+        return xb
+
+    @staticmethod
+    def get_education_effects_batch(education):
+        effects = np.zeros(len(education))
+        for level, effect in [(Education.LESSTHANHIGHSCHOOL, -9.5559),
+                              (Education.SOMEHIGHSCHOOL, -6.6495),
+                              (Education.HIGHSCHOOLGRADUATE, -3.1954),
+                              (Education.SOMECOLLEGE, -2.3795)]:
+            effects[education == level] = effect
+        return effects
+
+    def get_risk_batch(self, state, rows, years=1, test=False):
+        randomEffect = np.nan_to_num(state.random_effect('gcp', rows))
+        residual = 0 if test else draw_normal_batch(state, rows, "gcpResidual", 0.38, 6.99)
+        return self.calc_linear_predictor_batch(state, rows, test) + randomEffect + residual
+
     def get_risk_for_person(self, person, years=1, test=False):
         random_effect = person._randomEffects['gcp'] if 'gcp' in person._randomEffects else 0  
-        residual = 0 if test else np.random.normal(0.38, 6.99)
+        residual = 0 if test else draw_normal(person, "gcpResidual", 0.38, 6.99)
         return self.calc_linear_predictor(person, test) + random_effect + residual
@@ -5,17 +5,41 @@ import re
 
 import numpy as np
 
+from microsim.population_state import PersonHistory
+
 
 categorical_param_name_pattern = r"^(?P<propname>[^\[]+)\[T\.(?P<matchingval>[^\]]+)\]"
 categorical_param_name_regex = re.compile(categorical_param_name_pattern)
 
 
 class AbstractBaseTransform(metaclass=ABCMeta):
-    """Interface definition for model argument transforms."""
+    """
+    Interface definition for model argument transforms.
+
+    `apply` transforms the value for a single person. `apply_batch` transforms the values for many
+    people at once: either a 1D array (one value per person) or a masked 2D array of histories
+    (one row per person, one column per wave). `source` returns python source that applies the
+    transform to the given expression, which is used to generate specialized predictors;
+    `is_vector` says whether the expression evaluates to a whole history or a single value.
+    """
+    # transforms that turn a history into a single value
+    reducesHistory = False
+    # name of the PopulationState aggregate function for elementwise transforms whose means can
+    # be kept as running sums
+    aggregateFunction = None
+
     @abstractmethod
     def apply(self, value):
         raise NotImplementedError()
 
+    @abstractmethod
+    def apply_batch(self, values):
+        raise NotImplementedError()
+
+    @abstractmethod
+    def source(self, expression, is_vector):
+        raise NotImplementedError()
+
 
 class IndicatorTransform(AbstractBaseTransform):
     """
@@ -33,6 +57,14 @@ class IndicatorTransform(AbstractBaseTransform):
     def apply(self, value):
         return 1 if value == self._matching_value else 0
 
+    def apply_batch(self, values):
+        return (values == self._matching_value).astype(np.float64)
+
+    def source(self, expression, is_vector):
+        if is_vector:
+            raise NotImplementedError("Indicators are only generated for single values")
+        return f"(1 if {expression} == {self._matching_value!r} else 0)"
+
     def __eq__(self, other):
         if issubclass(type(other), IndicatorTransform):
             return self._matching_value == other.matching_value
@@ -41,27 +73,62 @@ class IndicatorTransform(AbstractBaseTransform):
 
 class LogTransform(AbstractBaseTransform):
     """Returns the log (one or many) of the given value."""
+    aggregateFunction = 'log'
+
     def apply(self, value):
         return np.log(value)
 
+    def apply_batch(self, values):
+        # padding beyond the end of shorter histories is masked, don't take its log
+        return np.ma.log(values) if np.ma.isMaskedArray(values) else np.log(values)
+
+    def source(self, expression, is_vector):
+        return f"np.log({expression})"
+
 
 class MeanTransform(AbstractBaseTransform):
     """Returns the mean of the given value."""
+    reducesHistory = True
+
     def apply(self, value):
+        if isinstance(value, PersonHistory):
+            return value.mean()
         return np.array(value).mean()
 
+    def apply_batch(self, values):
+        return values.mean(axis=1) if np.ndim(values) == 2 else values
+
+    def source(self, expression, is_vector):
+        return f"{expression}.mean()" if is_vector else expression
+
 
 class SquareTransform(AbstractBaseTransform):
     """Returns the square (one or many) of the given value."""
+    aggregateFunction = 'square'
+
     def apply(self, value):
         return value ** 2
 
+    def apply_batch(self, values):
+        return values ** 2
+
+    def source(self, expression, is_vector):
+        return f"({expression}) ** 2"
+
 
 class FirstElementTransform(AbstractBaseTransform):
     """Returns the first element of the given value."""
+    reducesHistory = True
+
     def apply(self, value):
         return value[0]
 
+    def apply_batch(self, values):
+        return values[:, 0] if np.ndim(values) == 2 else values
+
+    def source(self, expression, is_vector):
+        return f"{expression}[0]"
+
 
 Transform = AbstractBaseTransform
 
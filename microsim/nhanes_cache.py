@@ -0,0 +1,145 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from microsim.data_loader import get_absolute_datafile_path, get_cache_path
+
+# the imputed NHANES dataset that populations are sampled from
+nhanesFilename = "fullyImputedDataset.dta"
+# a copy of the columns of the dataset that the simulation uses, one directory per year with one
+# .npy file per column, see build_nhanes_cache. it's kept in the user's cache directory, see
+# get_cache_path
+nhanesCacheDirectory = "nhanesCache"
+_manifestFilename = "manifest.json"
+# holds the row labels of the dataset, so that samples from the cache match samples from it
+_rowLabelsFilename = "rowLabels.npy"
+
+# the columns of the dataset that are used to build people (see build_person) and to sample them
+nhanesColumns = [
+    'age', 'gender', 'raceEthnicity', 'meanSBP', 'meanDBP', 'a1c', 'hdl', 'ldl', 'trig',
+    'tot_chol', 'bmi', 'waist', 'anyPhysicalActivity', 'smokingStatus', 'alcoholPerWeek',
+    'education', 'antiHypertensive', 'statin', 'otherLipidLowering', 'selfReportStrokeAge',
+    'selfReportMIAge', 'index', 'diedBy2015', 'WTINT2YR', 'year',
+]
+
+
+def hash_file(path, blockSize=1 << 20):
+    sha = hashlib.sha256()
+    with open(path, "rb") as sourceFile:
+        for block in iter(lambda: sourceFile.read(blockSize), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def _file_stamp(path):
+    stat = os.stat(path)
+    return {'size': stat.st_size, 'modifiedTime': stat.st_mtime_ns}
+
+
+def _read_manifest(cachePath):
+    try:
+        with open(os.path.join(cachePath, _manifestFilename), "r") as manifestFile:
+            return json.load(manifestFile)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_manifest(cachePath, manifest):
+    manifestPath = os.path.join(cachePath, _manifestFilename)
+    with open(manifestPath + ".tmp", "w") as manifestFile:
+        json.dump(manifest, manifestFile)
+    os.replace(manifestPath + ".tmp", manifestPath)
+
+
+def build_nhanes_cache(sourcePath=None, cachePath=None, columns=None):
+    """
+    Parses the Stata file once and writes the columns that the simulation uses, split by year.
+
+    The cache is written next to where it belongs and then moved into place, so a cache that is
+    being built is never read.
+    """
+    sourcePath = get_absolute_datafile_path(nhanesFilename) if sourcePath is None else sourcePath
+    cachePath = get_cache_path(nhanesCacheDirectory) if cachePath is None else cachePath
+    columns = nhanesColumns if columns is None else columns
+    stamp = _file_stamp(sourcePath)
+    # labelled columns (e.g. gender) are kept as their numeric codes, which is what the models use
+    nhanes = pd.read_stata(sourcePath, columns=columns, convert_categoricals=False)
+    for name in columns:
+        if not np.issubdtype(nhanes[name].dtype, np.number):
+            raise ValueError(f"NHANES column {name} isn't numeric ({nhanes[name].dtype})")
+
+    parentPath = os.path.dirname(os.path.abspath(cachePath))
+    os.makedirs(parentPath, exist_ok=True)
+    buildPath = tempfile.mkdtemp(dir=parentPath)
+    try:
+        years = np.unique(nhanes.year.to_numpy())
+        for year in years:
+            inYear = (nhanes.year == year).to_numpy()
+            yearPath = os.path.join(buildPath, str(int(year)))
+            os.mkdir(yearPath)
+            np.save(os.path.join(yearPath, _rowLabelsFilename), nhanes.index.to_numpy()[inYear])
+            for name in columns:
+                np.save(os.path.join(yearPath, f"{name}.npy"), nhanes[name].to_numpy()[inYear])
+        _write_manifest(buildPath, {'source': {**stamp, 'sha256': hash_file(sourcePath)},
+                                    'columns': list(columns),
+                                    'years': [int(year) for year in years]})
+        shutil.rmtree(cachePath, ignore_errors=True)
+        os.replace(buildPath, cachePath)
+    except BaseException:
+        shutil.rmtree(buildPath, ignore_errors=True)
+        raise
+
+
+def is_nhanes_cache_current(sourcePath=None, cachePath=None, columns=None):
+    """
+    Checks that the cache was built from the current source file, with all of the columns.
+
+    The source is only hashed when its size or modification time changed since the cache was
+    built, so the check is cheap when nothing changed.
+    """
+    sourcePath = get_absolute_datafile_path(nhanesFilename) if sourcePath is None else sourcePath
+    cachePath = get_cache_path(nhanesCacheDirectory) if cachePath is None else cachePath
+    columns = nhanesColumns if columns is None else columns
+    manifest = _read_manifest(cachePath)
+    if manifest is None or not set(columns) <= set(manifest['columns']):
+        return False
+    stamp = _file_stamp(sourcePath)
+    if all(manifest['source'][key] == value for key, value in stamp.items()):
+        return True
+    if hash_file(sourcePath) != manifest['source']['sha256']:
+        return False
+    # the file was touched but not changed, no need to hash it again next time
+    manifest['source'].update(stamp)
+    _write_manifest(cachePath, manifest)
+    return True
+
+
+def nhanes_source_hash(sourcePath=None, cachePath=None):
+    """The hash of the NHANES dataset that load_nhanes_year reads from, e.g. to key caches by."""
+    cachePath = get_cache_path(nhanesCacheDirectory) if cachePath is None else cachePath
+    if not is_nhanes_cache_current(sourcePath, cachePath):
+        build_nhanes_cache(sourcePath, cachePath)
+    return _read_manifest(cachePath)['source']['sha256']
+
+
+def load_nhanes_year(year, columns=None, sourcePath=None, cachePath=None):
+    """
+    Returns the rows of the NHANES dataset for a year, like
+    `nhanes.loc[nhanes.year == year, columns]` on the full dataset, read from the memory mapped
+    cache. The cache is built (or rebuilt, if the source file changed) when it's needed.
+    """
+    cachePath = get_cache_path(nhanesCacheDirectory) if cachePath is None else cachePath
+    columns = nhanesColumns if columns is None else columns
+    if not is_nhanes_cache_current(sourcePath, cachePath, columns):
+        build_nhanes_cache(sourcePath, cachePath, sorted(set(nhanesColumns) | set(columns)))
+    yearPath = os.path.join(cachePath, str(int(year)))
+    if not os.path.isdir(yearPath):
+        return pd.DataFrame({name: [] for name in columns})
+    return pd.DataFrame(
+        {name: np.load(os.path.join(yearPath, f"{name}.npy"), mmap_mode='r') for name in columns},
+        index=np.load(os.path.join(yearPath, _rowLabelsFilename)))
@@ -8,8 +8,12 @@ from microsim.data_loader import load_model_spec
 from microsim.statsmodel_linear_risk_factor_model import StatsModelLinearRiskFactorModel
 from microsim.regression_model import RegressionModel
 from microsim.gcp_model import GCPModel
+from microsim.outcome import OutcomeType
+from microsim.person import Person
 
+import numpy as np
 import numpy.random as npRand
+from microsim.random_streams import draw_uniform, draw_normal, draw_normal_batch
 
 
 # This object is currently serving two purposes.
@@ -29,6 +33,8 @@ class OutcomeModelRepository:
 
         # variable used in testing to control whether a patient will have a stroke or mi
         self.manualStrokeMIProbability = None
+        # model that splits CV events into strokes and MIs, None for the published one
+        self.stroke_partition_model = None
 
         self._models = {}
         femaleCVCoefficients = {'lagAge': 0.106501, 'black': 0.432440, 'lagSbp#lagSbp': 0.000056, 'lagSbp': 0.017666,
@@ -66,12 +72,49 @@ class OutcomeModelRepository:
     def get_random_effects(self):
         return {'gcp': npRand.normal(0, 4.84)}
 
+    # random effects for a person, drawn from their random streams. repositories that override
+    # get_random_effects keep getting theirs from it
+    def get_random_effects_for_person(self, person):
+        if self.overrides('get_random_effects'):
+            return self.get_random_effects()
+        return {'gcp': draw_normal(person, "gcpRandomEffect", 0, 4.84)}
+
+    # random effects for the people in rows of a population state, as a dictionary of arrays
+    def get_random_effects_batch(self, state, rows):
+        if self.overrides('get_random_effects', 'get_random_effects_for_person'):
+            effects = [self.get_random_effects_for_person(person)
+                       for person in self.people(state, rows)]
+            names = effects[0].keys() if len(effects) > 0 else ['gcp']
+            return {name: np.array([effect[name] for effect in effects], dtype=np.float64)
+                    for name in names}
+        return {'gcp': draw_normal_batch(state, rows, "gcpRandomEffect", 0, 4.84)}
+
+    def overrides(self, *methodNames):
+        """
+        True if any of methodNames has been replaced, by a subclass or on this repository. The
+        batch methods fall back to those per person methods so that they behave the same.
+        """
+        return any(name in self.__dict__ or
+                   getattr(type(self), name) is not getattr(OutcomeModelRepository, name)
+                   for name in methodNames)
+
+    @staticmethod
+    def people(state, rows):
+        return [Person.view(state, row) for row in rows]
+
     def get_risk_for_person(self, person, outcome, years=1):
         return self.select_model_for_person(person, outcome).get_risk_for_person(person, years)
 
     def get_gcp(self, person):
         return self.get_risk_for_person(person, OutcomeModelType.GLOBAL_COGNITIVE_PERFORMANCE)
 
+    def get_gcp_batch(self, state, rows):
+        if self.overrides('get_gcp', 'get_risk_for_person', 'select_model_for_person'):
+            return np.array([self.get_gcp(person) for person in self.people(state, rows)],
+                            dtype=np.float64)
+        return self._models[OutcomeModelType.GLOBAL_COGNITIVE_PERFORMANCE].get_risk_batch(
+            state, rows)
+
     def select_model_for_person(self, person, outcome):
         models_for_outcome = self._models[outcome]
         if outcome == OutcomeModelType.NON_CV_MORTALITY or outcome == OutcomeModelType.GLOBAL_COGNITIVE_PERFORMANCE:
@@ -84,17 +127,57 @@ class OutcomeModelRepository:
         model_spec = load_model_spec(modelName)
         return StatsModelCoxModel(CoxRegressionModel(**model_spec))
 
+    def get_cv_risk_batch(self, state, rows, years=1):
+        """CV risk for the people in `rows`, using the sex-specific model for each person."""
+        rows = np.asarray(rows)
+        if self.overrides('get_risk_for_person', 'select_model_for_person'):
+            return np.array([self.get_risk_for_person(person, OutcomeModelType.CARDIOVASCULAR,
+                                                      years)
+                             for person in self.people(state, rows)], dtype=np.float64)
+        male = state.static('gender')[rows] == NHANESGender.MALE
+        risks = np.empty(len(rows))
+        for gender_stem, mask in [("male", male), ("female", ~male)]:
+            model = self._models[OutcomeModelType.CARDIOVASCULAR][gender_stem]
+            risks[mask] = model.get_risk_batch(state, rows[mask], years)
+        return risks
+
+    def get_cv_outcome_determination(self):
+        return CVOutcomeDetermination(self.mi_case_fatality,
+                                      self.stroke_case_fatality,
+                                      self.secondary_mi_case_fatality,
+                                      self.secondary_stroke_case_fatality,
+                                      self.secondary_prevention_multiplier,
+                                      self.stroke_partition_model)
+
     def assign_cv_outcome(self, person, years=1, manualStrokeMIProbability=None):
-        outcomeDet = CVOutcomeDetermination(self.mi_case_fatality,
-                                            self.stroke_case_fatality,
-                                            self.secondary_mi_case_fatality,
-                                            self.secondary_stroke_case_fatality,
-                                            self.secondary_prevention_multiplier)
+        outcomeDet = self.get_cv_outcome_determination()
         return outcomeDet.assign_outcome_for_person(
             self, person, years, self.manualStrokeMIProbability)
 
+    # batch version of assign_cv_outcome, see CVOutcomeDetermination.assign_outcomes_batch
+    def assign_cv_outcome_batch(self, state, rows, years=1):
+        if self.overrides('assign_cv_outcome'):
+            outcomes = [self.assign_cv_outcome(person, years)
+                        for person in self.people(state, rows)]
+            hadEvent = np.array([outcome is not None for outcome in outcomes], dtype=bool)
+            isMI = np.array([outcome is not None and outcome.type == OutcomeType.MI
+                             for outcome in outcomes], dtype=bool)
+            fatal = np.array([outcome is not None and bool(outcome.fatal)
+                              for outcome in outcomes], dtype=bool)
+            return hadEvent, isMI, fatal
+        return self.get_cv_outcome_determination().assign_outcomes_batch(
+            self, state, rows, years, self.manualStrokeMIProbability)
+
+    # batch version of assign_non_cv_mortality, returns a death indicator for each of rows
+    def assign_non_cv_mortality_batch(self, state, rows):
+        if self.overrides('assign_non_cv_mortality', 'get_risk_for_person',
+                          'select_model_for_person'):
+            return np.array([bool(self.assign_non_cv_mortality(person))
+                             for person in self.people(state, rows)], dtype=bool)
+        return self._models[OutcomeModelType.NON_CV_MORTALITY].assign_death_batch(state, rows)
+
     # Returns True if the model-based logic vs. the random comparison suggests death
     def assign_non_cv_mortality(self, person, years=1):
         riskForPerson = self.get_risk_for_person(person, OutcomeModelType.NON_CV_MORTALITY)
-        if (npRand.uniform(size=1) < riskForPerson):
+        if (draw_uniform(person, "nonCVMortality") < riskForPerson):
             return True
@@ -1,5 +1,6 @@
 import math
 import copy
+import numpy as np
 import numpy.random as npRand
 
 from typing import Callable
@@ -10,6 +11,10 @@ from microsim.outcome import Outcome, OutcomeType
 from microsim.race_ethnicity import NHANESRaceEthnicity
 from microsim.smoking_status import SmokingStatus
 from microsim.alcohol_category import AlcoholCategory
+from microsim.random_streams import draw_normal
+from microsim.event_log import PersonOutcomes
+from microsim.population_state import PopulationState, HistoryAttribute, StaticAttribute, \
+    PersonRandomEffects
 
 # luciana-tag...lne thing that tripped me up was probable non clear communication regarding "waves"
 # so, i'm going to spell it out here and try to make the code consistent.
@@ -27,6 +32,45 @@ from microsim.alcohol_category import AlcoholCategory
 class Person:
     """Person is using risk factors and demographics based off NHANES"""
 
+    # a person is a view over one row of a PopulationState. the history attributes behave like
+    # lists (one element per wave), but the values live in the columns of the state.
+    _alive = HistoryAttribute("alive")
+    _age = HistoryAttribute("age")
+    _sbp = HistoryAttribute("sbp")
+    _dbp = HistoryAttribute("dbp")
+    _a1c = HistoryAttribute("a1c")
+    _hdl = HistoryAttribute("hdl")
+    _ldl = HistoryAttribute("ldl")
+    _trig = HistoryAttribute("trig")
+    _totChol = HistoryAttribute("totChol")
+    _bmi = HistoryAttribute("bmi")
+    _waist = HistoryAttribute("waist")
+    _anyPhysicalActivity = HistoryAttribute("anyPhysicalActivity")
+    _alcoholPerWeek = HistoryAttribute("alcoholPerWeek")
+    _antiHypertensiveCount = HistoryAttribute("antiHypertensiveCount")
+    _statin = HistoryAttribute("statin")
+    _otherLipidLoweringMedicationCount = HistoryAttribute("otherLipidLoweringMedicationCount")
+    _afib = HistoryAttribute("afib")
+    _gcp = HistoryAttribute("gcp")
+
+    _gender = StaticAttribute("gender", NHANESGender)
+    _raceEthnicity = StaticAttribute("raceEthnicity", NHANESRaceEthnicity)
+    _education = StaticAttribute("education", Education)
+    _smokingStatus = StaticAttribute("smokingStatus", SmokingStatus)
+    _personId = StaticAttribute("personId")
+    _selfReportStrokePriorToSim = StaticAttribute("selfReportStrokePriorToSim")
+    _selfReportMIPriorToSim = StaticAttribute("selfReportMIPriorToSim")
+
+    # building in manual bounds on extreme values
+    _lowerBounds = {"sbp": 60, "dbp": 20}
+    _upperBounds = {"sbp": 300, "dbp": 180}
+
+    # risk factors that are re-estimated every wave, in the order that they're estimated.
+    # the order matters: models for later risk factors see the new values for earlier ones.
+    riskFactorsAdvancedEachWave = ["sbp", "dbp", "a1c", "hdl", "totChol", "bmi", "ldl", "trig",
+                                   "waist", "anyPhysicalActivity", "afib", "statin",
+                                   "alcoholPerWeek"]
+
     def __init__(
         self,
         age: int,
@@ -54,9 +98,10 @@ class Person:
         **kwargs,
     ) -> None:
 
-        # building in manual bounds on extreme values
-        self._lowerBounds = {"sbp": 60, "dbp": 20}
-        self._upperBounds = {"sbp": 300, "dbp": 180}
+        # a person that is built on their own owns a single-row state. when they are added to a
+        # population, the population moves their row into its shared state.
+        self._state = PopulationState(1)
+        self._row = 0
 
         self._gender = gender
         self._raceEthnicity = raceEthnicity
@@ -86,8 +131,8 @@ class Person:
         # a differnet outcome type each element in the array is a tuple representting
         # the age of the patient at the time of an event (element zero). and the outcome
         # (element one).multiple events can be accounted for by having multiple
-        # elements in the array.
-        self._outcomes = {OutcomeType.MI: [], OutcomeType.STROKE: []}
+        # elements in the array. the events are stored in the event log of the person's state,
+        # _outcomes is a view on this person's part of it.
         self._selfReportStrokePriorToSim = 0
         self._selfReportMIPriorToSim = 0
 
@@ -111,30 +156,60 @@ class Person:
 
         self._bpTreatmentStrategy = None
 
+    @staticmethod
+    def view(state, row, **kwargs):
+        """
+        A person for a row of a state that already holds their baseline (e.g. one built by
+        build_state_from_nhanes), with kwargs set as attributes like the constructor does.
+        """
+        person = Person.__new__(Person)
+        person._state = state
+        person._row = row
+        person._bpTreatmentStrategy = None
+        for k, v in kwargs.items():
+            setattr(person, k, v)
+        return person
+
     def reset_to_baseline(self):
-        self._alive = [True]
-        self._age = [self._age[0]]
-        self._sbp = [self._sbp[0]]
-        self._dbp = [self._dbp[0]]
-        self._a1c = [self._a1c[0]]
-        self._hdl = [self._hdl[0]]
-        self._ldl = [self._ldl[0]]
-        self._trig = [self._trig[0]]
-        self._totChol = [self._totChol[0]]
-        self._bmi = [self._bmi[0]]
-        self._waist = [self._waist[0]]
-        self._anyPhysicalActivity = [self._anyPhysicalActivity[0]]
-        self._antiHypertensiveCount = [self._antiHypertensiveCount[0]]
-        self._alcoholPerWeek = [self._alcoholPerWeek[0]]
-        self._statin = [self._statin[0]]
-        self._otherLipidLoweringMedicationCount = [self._otherLipidLoweringMedicationCount[0]]
+        for name in PopulationState.historyAttributes:
+            self._state.truncate(name, self._row, 1)
+        self._state.truncate("gcp", self._row, 0)
+        self._alive[0] = True
         self._bpTreatmentStrategy = None
-        self._gcp = []
 
-        # iterate through outcomes and remove those that occured after the simulation started
-        for type, outcomes_for_type in self._outcomes.items():
-            self._outcomes[type] = list(
-                filter(lambda outcome: outcome[0] < self._age[0], outcomes_for_type))
+        # remove the outcomes that occured after the simulation started
+        eventIds = self._state.events.events_for_row(self._row)
+        self._state.remove_events(
+            eventIds[self._state.events.column('age')[eventIds] >= self._age[0]])
+
+    @property
+    def _outcomes(self):
+        return PersonOutcomes(self._state, self._row)
+
+    @_outcomes.setter
+    def _outcomes(self, outcomes):
+        outcomes = {outcomeType: list(events) for outcomeType, events in outcomes.items()}
+        self._outcomes.clear()
+        self._outcomes.update(outcomes)
+
+    # the population state keeps a count of events per outcome type so that models can be
+    # evaluated for many people at once. the counts are kept up to date as events are added to
+    # and removed from the log, this recounts them from the log.
+    def _update_outcome_counts(self):
+        for outcomeType in self._outcomes:
+            self._state.set_outcome_count(outcomeType.value, self._row,
+                                          len(self._outcomes[outcomeType]))
+
+    # random effects are stored in the population state, this is a dictionary-like view on them
+    @property
+    def _randomEffects(self):
+        return PersonRandomEffects(self._state, self._row)
+
+    @_randomEffects.setter
+    def _randomEffects(self, randomEffects):
+        randomEffects = dict(randomEffects)
+        self._randomEffects.clear()
+        self._randomEffects.update(randomEffects)
 
     @property
     def _current_smoker(self):
@@ -150,11 +225,11 @@ class Person:
     
     @property
     def _mi(self):
-        return len(self._outcomes[OutcomeType.MI]) > 0
+        return self._state.outcome_count("mi")[self._row] > 0
 
     @property
     def _stroke(self):
-        return len(self._outcomes[OutcomeType.STROKE]) > 0
+        return self._state.outcome_count("stroke")[self._row] > 0
 
     @property
     def _black(self):
@@ -173,7 +248,7 @@ class Person:
              self._hdl[end_of_wave_num] < 35)
 
     def has_diabetes(self):
-        return sorted(self._a1c)[-1] >= 6.5
+        return self._a1c.max() >= 6.5
 
     def years_in_simulation(self):
         return len(self._age) - 1
@@ -182,6 +257,17 @@ class Person:
         model = risk_model_repository.get_model(riskFactor)
         return model.estimate_next_risk(self)
 
+    @staticmethod
+    def apply_bounds_batch(varName, values):
+        """apply_bounds for an array of values (comparisons with NaN behave the same way)."""
+        if varName in Person._upperBounds:
+            values = np.where(values < Person._upperBounds[varName], values,
+                              Person._upperBounds[varName])
+        if varName in Person._lowerBounds:
+            values = np.where(values > Person._lowerBounds[varName], values,
+                              Person._lowerBounds[varName])
+        return values
+
     def apply_bounds(self, varName, varValue):
         """
         Ensures that risk factor are within static prespecified bounds.
@@ -202,10 +288,7 @@ class Person:
         if self.is_dead():
             raise RuntimeError("Person is dead. Can not advance year")
 
-        # initialize random effects if they haven't already been initialized and this is our first year
-        if self.years_in_simulation() == 0 and len(self._randomEffects) == 0:
-            self._randomEffects = outcome_model_repository.get_random_effects()
-
+        self.initialize_random_effects(outcome_model_repository)
         self.advance_risk_factors(risk_model_repository)
         self.advance_treatment(risk_model_repository)
         self.advance_outcomes(outcome_model_repository)
@@ -213,6 +296,11 @@ class Person:
             self._age.append(self._age[-1] + 1)
             self._alive.append(True)
 
+    def initialize_random_effects(self, outcome_model_repository):
+        # initialize random effects if they haven't already been initialized and this is our first year
+        if self.years_in_simulation() == 0 and len(self._randomEffects) == 0:
+            self._randomEffects = outcome_model_repository.get_random_effects_for_person(self)
+
     def is_dead(self):
         return not self._alive[-1]
 
@@ -235,10 +323,10 @@ class Person:
             return self._alive[start_wave_num-1]
 
     def has_outcome_prior_to_simulation(self, outcomeType):
-        return any([ageAtEvent < 0 for ageAtEvent, _ in self._outcomes[outcomeType]])
+        return bool(np.any(self._outcomes[outcomeType].ages() < 0))
 
     def has_outcome_during_simulation(self, outcomeType):
-        return any([ageAtEvent >= 0 for ageAtEvent, _ in self._outcomes[outcomeType]])
+        return bool(np.any(self._outcomes[outcomeType].ages() >= 0))
 
     def has_outcome_at_any_time(self, outcomeType):
         return len(self._outcomes[outcomeType]) > 0
@@ -265,16 +353,13 @@ class Person:
                 self.has_outcome_at_age(outcomeType, self._age[wave-1]))
 
     def has_outcome_at_age(self, type, age):
-        for outcome_tuple in self._outcomes[type]:
-            if outcome_tuple[0] == age:
-                return True
-        return False
+        return bool(np.any(self._outcomes[type].ages() == age))
 
     def has_fatal_stroke(self):
-        return any([stroke.fatal for _, stroke in self._outcomes[OutcomeType.STROKE]])
+        return bool(np.any(self._outcomes[OutcomeType.STROKE].fatal()))
 
     def has_fatal_mi(self):
-        return any([mi.fatal for _, mi in self._outcomes[OutcomeType.MI]])
+        return bool(np.any(self._outcomes[OutcomeType.MI].fatal()))
 
     def has_mi_prior_to_simulation(self):
         return self.has_outcome_prior_to_simulation(OutcomeType.MI)
@@ -306,7 +391,9 @@ class Person:
                 risk_model_repository
             )
             self._antiHypertensiveCount.append(new_antihypertensive_count)
+        self.apply_bp_treatment_strategy()
 
+    def apply_bp_treatment_strategy(self):
         if self._bpTreatmentStrategy is not None:
             treatment_modifications, risk_factor_modifications, recalibration_standards = self._bpTreatmentStrategy(
                 self)
@@ -325,26 +412,9 @@ class Person:
         if self.is_dead():
             raise RuntimeError("Person is dead. Can not advance risk factors")
 
-        self._sbp.append(self.apply_bounds(
-            "sbp", self.get_next_risk_factor("sbp", risk_model_repository)))
-
-        self._dbp.append(self.apply_bounds(
-            "dbp", self.get_next_risk_factor("dbp", risk_model_repository)))
-        self._a1c.append(self.get_next_risk_factor("a1c", risk_model_repository))
-        self._hdl.append(self.get_next_risk_factor("hdl", risk_model_repository))
-        self._totChol.append(self.get_next_risk_factor("totChol", risk_model_repository))
-        self._bmi.append(self.get_next_risk_factor("bmi", risk_model_repository))
-        self._ldl.append(self.get_next_risk_factor("ldl", risk_model_repository))
-        self._trig.append(self.get_next_risk_factor("trig", risk_model_repository))
-        self._waist.append(self.get_next_risk_factor("waist", risk_model_repository))
-        self._anyPhysicalActivity.append(
-            self.get_next_risk_factor(
-                "anyPhysicalActivity",
-                risk_model_repository))
-        self._afib.append(self.get_next_risk_factor("afib", risk_model_repository))
-        self._statin.append(self.get_next_risk_factor("statin", risk_model_repository))
-        self._alcoholPerWeek.append(self.get_next_risk_factor(
-            "alcoholPerWeek", risk_model_repository))
+        for riskFactor in Person.riskFactorsAdvancedEachWave:
+            getattr(self, f"_{riskFactor}").append(self.apply_bounds(
+                riskFactor, self.get_next_risk_factor(riskFactor, risk_model_repository)))
 
     # redraw from models to pick new risk factors for person
 
@@ -389,13 +459,19 @@ class Person:
             self.add_outcome_event(cv_event)
 
         # then assign gcp
-        self._gcp.append(outcome_model_repository.get_gcp(self))
+        self.advance_gcp(outcome_model_repository)
 
         # if not dead from the CV event...assess non CV mortality
         if (not self.is_dead()):
-            non_cv_death = outcome_model_repository.assign_non_cv_mortality(self)
-            if (non_cv_death):
-                self._alive.append(False)
+            self.advance_non_cv_mortality(outcome_model_repository)
+
+    def advance_gcp(self, outcome_model_repository):
+        self._gcp.append(outcome_model_repository.get_gcp(self))
+
+    def advance_non_cv_mortality(self, outcome_model_repository):
+        non_cv_death = outcome_model_repository.assign_non_cv_mortality(self)
+        if (non_cv_death):
+            self._alive.append(False)
 
     def add_outcome_event(self, cv_event):
         self._outcomes[cv_event.type].append((self._age[-1], cv_event))
@@ -417,7 +493,7 @@ class Person:
     def get_fasting_glucose(self, use_residual=True):
         glucose = Person.convert_a1c_to_fasting_glucose(self._a1c[-1])
         if use_residual:
-            glucose += npRand.normal(0, 21)
+            glucose += draw_normal(self, "fastingGlucoseResidual", 0, 21)
         return glucose
 
     def __repr__(self):
@@ -498,41 +574,20 @@ class Person:
             return False
         return other._outcomes == self._outcomes
 
-    # luciana tag...there is almost definitely a better way to do this..
     def __deepcopy__(self, memo):
-        selfCopy = Person(age=0, gender=None, raceEthnicity=None, sbp=0, dbp=0, a1c=0, hdl=0, totChol=0,
-                          bmi=0, ldl=0, trig=0, waist=0, anyPhysicalActivity=0, education=None,
-                          smokingStatus=None, alcohol=None, antiHypertensiveCount=0, statin=0, otherLipidLoweringMedicationCount=0,
-                          initializeAfib=None)
-        selfCopy._lowerBounds = self._lowerBounds
-        selfCopy._upperBounds = self._upperBounds
-        selfCopy._gender = copy.deepcopy(self._gender)
-        selfCopy._raceEthnicity = copy.deepcopy(self._raceEthnicity)
-        selfCopy._alive = copy.deepcopy(self._alive)
-        selfCopy._age = copy.deepcopy(self._age)
-        selfCopy._sbp = copy.deepcopy(self._sbp)
-        selfCopy._dbp = copy.deepcopy(self._dbp)
-        selfCopy._a1c = copy.deepcopy(self._a1c)
-        selfCopy._hdl = copy.deepcopy(self._hdl)
-        selfCopy._ldl = copy.deepcopy(self._ldl)
-        selfCopy._trig = copy.deepcopy(self._trig)
-        selfCopy._totChol = copy.deepcopy(self._totChol)
-        selfCopy._waist = copy.deepcopy(self._waist)
-        selfCopy._bmi = copy.deepcopy(self._bmi)
-        selfCopy._anyPhysicalActivity = copy.deepcopy(self._anyPhysicalActivity)
-        selfCopy._education = copy.deepcopy(self._education)
-        selfCopy._smokingStatus = copy.deepcopy(self._smokingStatus)
-        selfCopy._alcoholPerWeek = copy.deepcopy(self._alcoholPerWeek)
-        selfCopy._antiHypertensiveCount = copy.deepcopy(self._antiHypertensiveCount)
-        selfCopy._statin = copy.deepcopy(self._statin)
-        selfCopy._otherLipidLoweringMedicationCount = copy.deepcopy(
-            self._otherLipidLoweringMedicationCount)
-        selfCopy._outcomes = copy.deepcopy(self._outcomes)
-        selfCopy._selfReportStrokePriorToSim = copy.deepcopy(self._selfReportStrokePriorToSim)
-        selfCopy._selfReportMIPriorToSim = copy.deepcopy(self._selfReportMIPriorToSim)
-        selfCopy._afib = self._afib
+        selfCopy = Person.__new__(Person)
+        for key, value in self.__dict__.items():
+            if key not in ("_state", "_row"):
+                setattr(selfCopy, key, copy.deepcopy(value, memo))
+        # the treatment strategy is a function — share it rather than copying it
         selfCopy._bpTreatmentStrategy = self._bpTreatmentStrategy
-        selfCopy._gcp = copy.deepcopy(self._gcp)
-        selfCopy._randomEffects = copy.deepcopy(self._randomEffects)
-
+        selfCopy._state = self._state.take([self._row])
+        selfCopy._row = 0
         return selfCopy
+
+    # when a person is pickled (e.g. to send to another process), only their own row goes along
+    def __getstate__(self):
+        personState = self.__dict__.copy()
+        personState["_state"] = self._state.take([self._row])
+        personState["_row"] = 0
+        return personState
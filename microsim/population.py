@@ -8,16 +8,32 @@ from microsim.cohort_risk_model_repository import CohortRiskModelRepository
 from microsim.nhanes_risk_model_repository import NHANESRiskModelRepository
 from microsim.outcome_model_repository import OutcomeModelRepository
 from microsim.statsmodel_logistic_risk_factor_model import StatsModelLogisticRiskFactorModel
-from microsim.data_loader import load_regression_model, get_absolute_datafile_path
+from microsim.data_loader import load_model, get_cache_path
+from microsim.age_standard import get_age_standard
+from microsim.nhanes_cache import load_nhanes_year, nhanes_source_hash
+from microsim.checkpoint import (write_checkpoint, read_checkpoint, has_checkpoint, cache_key,
+                                 function_key)
 from microsim.outcome_model_type import OutcomeModelType
 from microsim.cv_outcome_determination import CVOutcomeDetermination
-from microsim.outcome import Outcome, OutcomeType
+from microsim.outcome import OutcomeType
+from microsim.population_state import PopulationState, CounterfactualState
+from microsim.event_log import EventLog
+from microsim.random_streams import (RandomStreams, sample_without_replacement_batch,
+                                     worker_random_streams)
+from microsim.scenarios import ScenarioSet
+from microsim.shared_memory_state import (share_state, attach_state, unshare_state, detach_state,
+                                          create_shared_array, describe_shared_array,
+                                          attach_shared_array, close_blocks)
 
 import pandas as pd
 import copy
+import os
 import multiprocessing as mp
+import threading
+import weakref
 import numpy as np
-from functools import partial
+from collections.abc import Sequence
+from itertools import compress
 
 
 class Population:
@@ -31,13 +47,10 @@ class Population:
     turn into an abstract class...
     """
 
-    _ageStandards = {}
-
     def __init__(self, people):
         self._people = people
         self._risk_model_repository = None
         self._outcome_model_repository = None
-        self._ageStandards = {}
         # luciana tag: discuss with luciana...want to keep track of the sim wave htat is currently running, while running
         # and also the total number of years advanced...need to think about how to do this is a way that will be safe
         # this approach has major risks if you forget to update one of these variables
@@ -45,8 +58,164 @@ class Population:
         self._currentWave = 0
         self._bpTreatmentStrategy = None
         self.num_of_processes = 8
+        self._workerPool = None
+        self._checkpointWaves = None
+        self._checkpointPath = None
+
+    # worker processes can't be copied or pickled along with the population
+    def __getstate__(self):
+        populationState = self.__dict__.copy()
+        populationState["_workerPool"] = None
+        return populationState
+
+    # people are stored in a single columnar PopulationState. assigning people to a population
+    # moves each person's row into the shared state and re-points the person at it.
+    # people that were built as columns (see PersonViews) only become Person objects when
+    # somebody asks for them
+    @property
+    def _people(self):
+        if self._peopleContainer is None:
+            self._peopleContainer = pd.Series(list(self._peopleByRow),
+                                              index=self._peopleByRow.index)
+        return self._peopleContainer
+
+    @_people.setter
+    def _people(self, people):
+        self.close_worker_pool()
+        # keep the random streams when people are reassigned (e.g. after a multi process wave)
+        randomStreams = getattr(getattr(self, '_state', None), 'randomStreams', None)
+        if isinstance(people, PersonViews):
+            # the people's rows are already together in a state of their own
+            self._peopleContainer = None
+            self._peopleByRow = people
+            self._state = people.state
+        else:
+            self._peopleContainer = people
+            self._peopleByRow = list(people)
+            if randomStreams is None and len(self._peopleByRow) > 0:
+                randomStreams = self._peopleByRow[0]._state.randomStreams
+            self._state = PopulationState.from_rows(
+                [(person._state, person._row) for person in people])
+            for row, person in enumerate(self._peopleByRow):
+                person._state = self._state
+                person._row = row
+        if randomStreams is not None:
+            self._state.randomStreams = randomStreams
+        self.assign_person_ids()
+
+    # every person gets a stable id that keys their random streams. people keep their ids when
+    # they are copied or moved between populations.
+    def assign_person_ids(self):
+        personIds = self._state.static('personId')
+        missing = personIds == self._state.missingStaticValue
+        if not np.any(missing):
+            return
+        nextId = personIds[~missing].max() + 1 if np.any(~missing) else 0
+        self._state.set_static('personId', np.flatnonzero(missing),
+                               np.arange(nextId, nextId + missing.sum()))
+
+    def clone(self):
+        """
+        Returns a copy of the population that can be simulated independently, e.g. under another
+        treatment strategy.
+
+        The copy shares the histories simulated so far with the original rather than copying
+        them (see PopulationState.fork), so cloning at any wave is cheap and each branch only
+        pays for the waves it simulates after the clone. The copy isn't checkpointed (see
+        checkpoint_every), so that branches don't overwrite the original's checkpoints.
+        """
+        self.close_worker_pool()
+        branch = copy.copy(self)
+        branch._workerPool = None
+        branch._checkpointWaves = None
+        branch._checkpointPath = None
+        branch._people = PersonViews.restore(self._state.fork(), *self._describe_people())
+        return branch
+
+    def build_scenarios(self, scenarios):
+        """
+        Returns a ScenarioSet that advances clones of the population under each of scenarios
+        (see Scenario) in lockstep, with common random numbers.
+        """
+        return ScenarioSet(self, scenarios)
+
+    def _describe_people(self):
+        """
+        Returns what it takes to rebuild the people over a copy of the state (see
+        PersonViews.restore): the index of the people, the attributes of people that weren't
+        built yet and the attributes of every person that was, by row.
+        """
+        if isinstance(self._peopleByRow, PersonViews):
+            index, attributes = self._peopleByRow.index, self._peopleByRow._attributes
+            built = [(row, person) for row, person in enumerate(self._peopleByRow._people)
+                     if person is not None]
+        else:
+            index = self._people.index if isinstance(self._people, pd.Series) else None
+            attributes = {}
+            built = list(enumerate(self._peopleByRow))
+        # people that were already built keep their attributes, e.g. their treatment strategy
+        return index, attributes, {
+            row: {name: value for name, value in person.__dict__.items()
+                  if name not in ("_state", "_row")} for row, person in built}
+
+    def save_checkpoint(self, path):
+        """
+        Saves everything needed to continue the simulation later (see load_checkpoint): the
+        people's histories, events and random effects, the waves advanced so far, the random
+        streams and numpy's global random state.
+
+        The arrays are written one .npy file each, so that a loaded checkpoint is memory mapped
+        rather than read, and the checkpoint only replaces the previous one at path once it is
+        completely written. Risk models and treatment strategies are pickled along with the
+        population, so they need to be picklable (as for advance_multi_process).
+        """
+        skeleton = copy.copy(self)
+        for name in ("_state", "_peopleByRow", "_peopleContainer", "_workerPool"):
+            skeleton.__dict__.pop(name, None)
+        write_checkpoint(path, self._state, {
+            'population': skeleton,
+            'people': self._describe_people(),
+            'randomStreams': self._state.randomStreams,
+            'numpyRandomState': np.random.get_state()})
+
+    @staticmethod
+    def load_checkpoint(path, restoreRandomState=True):
+        """
+        Loads a population saved by save_checkpoint, at the wave it was saved at. Advancing it
+        gives the same results as advancing the population that was saved would have.
+        """
+        state, payload = read_checkpoint(path)
+        state.randomStreams = payload['randomStreams']
+        population = payload['population']
+        population._workerPool = None
+        population._people = PersonViews.restore(state, *payload['people'])
+        if restoreRandomState:
+            np.random.set_state(payload['numpyRandomState'])
+        return population
+
+    def checkpoint_every(self, waves, path):
+        """
+        Saves a checkpoint to path after every `waves` waves that the population is advanced
+        by (counting from the start of the simulation). Pass waves=None to stop.
+        """
+        self._checkpointWaves = waves
+        self._checkpointPath = path
+
+    def _wave_advanced(self):
+        self._totalWavesAdvanced += 1
+        if self._checkpointWaves is not None and \
+                self._totalWavesAdvanced % self._checkpointWaves == 0:
+            self.save_checkpoint(self._checkpointPath)
+
+    def set_random_seed(self, seed):
+        """
+        Makes every random draw in the simulation a function of (seed, person, wave, stage), so
+        that advance, advance_multi_process and advance_vectorized give the same trajectories.
+        """
+        self._state.randomStreams = RandomStreams(seed)
 
     def reset_to_baseline(self):
+        self.close_worker_pool()
         self._totalWavesAdvanced = 0
         self._currentWave = 0
         self._bpTreatmentStrategy = None
@@ -54,13 +223,15 @@ class Population:
             person.reset_to_baseline()
 
     def advance(self, years):
+        self.close_worker_pool()
+        self._state.reserve(self._totalWavesAdvanced + years + 1)
         for yearIndex in range(years):
             print(f"processing year: {yearIndex}")
             self._currentWave += 1
             for person in self._people:
                 self.advance_person(person)
             self.apply_recalibration_standards()
-            self._totalWavesAdvanced += 1
+            self._wave_advanced()
 
     def advance_person(self, person):
         if not person.is_dead():
@@ -71,20 +242,123 @@ class Population:
     def advance_people(self, people):
         return people.apply(self.advance_person)
 
-    def advance_multi_process(self, years):
+    def advance_vectorized(self, years):
+        """
+        Advances the population by evaluating the risk factor models over whole columns.
+
+        Risk factors and treatment are estimated for everybody who is alive in a single pass per
+        risk factor. Outcomes are still assigned person by person.
+        """
+        self.close_worker_pool()
+        self._state.reserve(self._totalWavesAdvanced + years + 1)
+        for yearIndex in range(years):
+            print(f"processing year: {yearIndex}")
+            self._currentWave += 1
+            self.advance_wave_vectorized()
+            self.apply_recalibration_standards()
+            self._wave_advanced()
+
+    def advance_wave_vectorized(self, rows=None):
+        """Advances everybody that is alive (or everybody alive in `rows`) by one wave."""
+        rows = np.arange(self._state.n) if rows is None else np.asarray(rows)
+        alive = rows[self._state.current('alive', rows)]
+        if len(alive) == 0:
+            return
+        # people that haven't been built yet can't have a treatment strategy of their own
+        alivePeople = self.built_people(alive)
+        self.initialize_random_effects_vectorized(alive)
+
+        self.advance_risk_factors_vectorized(alive)
+        for person in alivePeople:
+            person.apply_bp_treatment_strategy()
+
+        hadEvent, isMI, fatal = self._outcome_model_repository.assign_cv_outcome_batch(
+            self._state, alive)
+        self.add_outcome_events(alive[hadEvent], isMI[hadEvent], fatal[hadEvent])
+        self._state.append('gcp', self._outcome_model_repository.get_gcp_batch(self._state, alive),
+                           alive)
+
+        # people that didn't die from a CV event are at risk of non CV mortality
+        atRisk = alive[self._state.current('alive', alive)]
+        died = self._outcome_model_repository.assign_non_cv_mortality_batch(self._state, atRisk)
+        self._state.append('alive', np.zeros(died.sum(), dtype=bool), atRisk[died])
+
+        survivors = alive[self._state.current('alive', alive)]
+        self._state.append('age', self._state.current('age', survivors) + 1, survivors)
+        self._state.append('alive', True, survivors)
+
+    def built_people(self, rows):
+        """The people in rows that already exist as Person objects (see PersonViews)."""
+        if isinstance(self._peopleByRow, PersonViews):
+            return self._peopleByRow.built(rows)
+        return [self._peopleByRow[row] for row in rows]
+
+    def initialize_random_effects_vectorized(self, rows):
+        # same rule as Person.initialize_random_effects: drawn in the first year for people
+        # that don't have any yet
+        needEffects = rows[(self._state.lengths('age')[rows] == 1)
+                           & ~self._state.has_random_effects(rows)]
+        if len(needEffects) > 0:
+            self._state.set_random_effects_batch(
+                self._outcome_model_repository.get_random_effects_batch(self._state, needEffects),
+                needEffects)
+
+    def add_outcome_events(self, rows, isMI, fatal):
+        """Records one CV event for each of `rows`, as returned by assign_cv_outcome_batch."""
+        # as in Person.add_outcome_event, the event is at the age at the start of the wave
+        types = np.where(isMI, EventLog.type_code(OutcomeType.MI),
+                         EventLog.type_code(OutcomeType.STROKE))
+        self._state.add_events(rows, self._state.lengths('age')[rows],
+                               self._state.current('age', rows), types, fatal)
+        self._state.append('alive', np.zeros(fatal.sum(), dtype=bool), rows[fatal])
+
+    def advance_risk_factors_vectorized(self, rows):
+        # same order as Person.advance_risk_factors followed by Person.advance_treatment
+        for riskFactor in Person.riskFactorsAdvancedEachWave + ["antiHypertensiveCount"]:
+            nextRisk = self.estimate_next_risk_vectorized(riskFactor, rows)
+            if riskFactor in Person._upperBounds:
+                nextRisk = np.minimum(nextRisk, Person._upperBounds[riskFactor])
+            if riskFactor in Person._lowerBounds:
+                nextRisk = np.maximum(nextRisk, Person._lowerBounds[riskFactor])
+            self._state.append(riskFactor, nextRisk, rows)
+
+    def estimate_next_risk_vectorized(self, riskFactor, rows):
+        model = self._risk_model_repository.get_model(riskFactor)
+        if hasattr(model, "estimate_next_risk_batch"):
+            return model.estimate_next_risk_batch(self._state, rows)
+        # models without a batch implementation are evaluated person by person
+        return np.array([model.estimate_next_risk(self._peopleByRow[row]) for row in rows])
+
+    def advance_multi_process(self, years, vectorized=False):
+        """
+        Advances the population in num_of_processes worker processes that each advance a fixed
+        slice of the people. By default each worker keeps its own people and advances them one
+        at a time (see PeopleWorkerPool), as advance does. With vectorized=True the workers
+        advance the slices in place in shared memory (see SharedMemoryWorkerPool), as
+        advance_vectorized does. The workers are kept between calls until the population is
+        changed from outside of them.
+        """
+        waves = self._totalWavesAdvanced + years + 1
+        poolClass = SharedMemoryWorkerPool if vectorized else PeopleWorkerPool
+        if (not isinstance(self._workerPool, poolClass) or self._workerPool.capacity < waves or
+                self._workerPool.numberOfProcesses != self.num_of_processes):
+            self.close_worker_pool()
+            self._workerPool = poolClass(self, self.num_of_processes, waves)
         for i in range(years):
             self._currentWave += 1
             print(f"processing year: {i}")
-            data_split = np.array_split(self._people, self.num_of_processes)
-            pool = mp.Pool(self.num_of_processes)
-            self._people = pd.concat(pool.map(self.advance_people, data_split))
-            pool.close()
-            pool.join()
+            self._workerPool.advance_wave()
+            self._workerPool.apply_recalibration_standards()
+            self._wave_advanced()
 
-            self.apply_recalibration_standards()
-            self._totalWavesAdvanced += 1
+    def close_worker_pool(self):
+        """Stops the workers used by advance_multi_process, if there are any."""
+        if getattr(self, '_workerPool', None) is not None:
+            self._workerPool.close()
+        self._workerPool = None
 
     def set_bp_treatment_strategy(self, bpTreatmentStrategy):
+        self.close_worker_pool()
         self._bpTreatmentStrategy = bpTreatmentStrategy
         for person in self._people:
             person._bpTreatmentStrategy = bpTreatmentStrategy
@@ -107,71 +381,110 @@ class Population:
     def recalibrate_bp_treatment(self):
         treatment_change_standard, effect_of_treatment_standard, treatment_outcome_standard = self._bpTreatmentStrategy(
             self)
-        # estimate risk for the people alive at the start of the wave
-        recalibration_pop = self.get_people_alive_at_the_start_of_the_current_wave()
-        treatedStrokeRisks, treatedMIRisks = self.estimate_risks(recalibration_pop)
-
-        # rollback the treatment effect.
-        # redtag: would like to apply to this to a deeply cloned population, but i can't get that to work
-        # so, for now, applying it to the actual population and then rolling the effect back later.
-        for _, person in recalibration_pop.iteritems():
-            person._sbp[-1] = person._sbp[-1] - effect_of_treatment_standard['_sbp']
-            person._dbp[-1] = person._dbp[-1] - effect_of_treatment_standard['_dbp']
-            person._antiHypertensiveCount[-1] = person._antiHypertensiveCount[-1] - \
-                treatment_change_standard['_antiHypertensiveCount']
-
-        # estimate risk after applying the treamtent effect
-        untreatedStrokeRisks, untreatedMIRisks = self.estimate_risks(recalibration_pop)
-
-        # hacktag related to above — roll back the treatment effect...
-        for _, person in recalibration_pop.iteritems():
-            person._sbp[-1] = person._sbp[-1] + effect_of_treatment_standard['_sbp']
-            person._dbp[-1] = person._dbp[-1] + effect_of_treatment_standard['_dbp']
-            person._antiHypertensiveCount[-1] = person._antiHypertensiveCount[-1] + \
-                treatment_change_standard['_antiHypertensiveCount']
-
+        # estimate risk for the people alive at the start of the wave, with the treatment and
+        # with its effect taken back out
+        rows = np.flatnonzero(self._state.alive_at_start_of_wave(self._currentWave))
+        untreatedShifts = {'sbp': -effect_of_treatment_standard['_sbp'],
+                           'dbp': -effect_of_treatment_standard['_dbp'],
+                           'antiHypertensiveCount':
+                               -treatment_change_standard['_antiHypertensiveCount']}
+        (treatedStrokeRisks, treatedMIRisks), (untreatedStrokeRisks, untreatedMIRisks) = \
+            self.estimate_counterfactual_risks(untreatedShifts, rows)
+
+        outcomeDetermination = CVOutcomeDetermination()
         # recalibrate stroke
-        self.create_or_rollback_events_to_correct_calibration(treatment_outcome_standard,
-                                                              treatedStrokeRisks,
-                                                              untreatedStrokeRisks,
-                                                              OutcomeType.STROKE,
-                                                              CVOutcomeDetermination()._will_have_fatal_stroke,
-                                                              recalibration_pop)
+        self.create_or_rollback_events_to_correct_calibration(
+            treatment_outcome_standard, treatedStrokeRisks, untreatedStrokeRisks,
+            OutcomeType.STROKE, outcomeDetermination.will_have_fatal_stroke_batch, rows)
 
         # recalibrate MI
-        self.create_or_rollback_events_to_correct_calibration(treatment_outcome_standard,
-                                                              treatedMIRisks,
-                                                              untreatedMIRisks,
-                                                              OutcomeType.MI,
-                                                              CVOutcomeDetermination()._will_have_fatal_mi,
-                                                              recalibration_pop)
+        self.create_or_rollback_events_to_correct_calibration(
+            treatment_outcome_standard, treatedMIRisks, untreatedMIRisks,
+            OutcomeType.MI, outcomeDetermination.will_have_fatal_mi_batch, rows)
+
+    def estimate_counterfactual_risks(self, shifts, rows=None):
+        """
+        Returns the stroke and MI risks of people (rows, or everybody) as they are and as they
+        would be if the most recent values of some risk factors were shifted, e.g.
+        {'sbp': -5} for people with a 5 mmHg higher blood pressure.
+
+        Both sets of risks are estimated by the batch models in one pass over a
+        CounterfactualState, so nobody is changed and the estimate can run alongside other
+        readers of the state. Each set is a pair of pd.Series (strokeRisks, miRisks), indexed
+        like the people returned by get_people_alive_at_the_start_of_wave.
+        """
+        rows = np.arange(self._state.n) if rows is None else np.asarray(rows)
+        state = CounterfactualState(self._state, shifts)
+        bothRows = np.concatenate([rows, state.counterfactual_rows(rows)])
+        repository = self._outcome_model_repository
+        if repository.overrides('get_risk_for_person', 'select_model_for_person'):
+            combinedRisks = np.concatenate([self.estimate_cv_risks_per_person(rows),
+                                            self.estimate_shifted_cv_risks_per_person(shifts,
+                                                                                      rows)])
+        else:
+            combinedRisks = repository.get_cv_risk_batch(state, bothRows, 1)
+        outcomeDetermination = repository.get_cv_outcome_determination()
+        strokeProbabilities = outcomeDetermination.get_stroke_probability_batch(state, bothRows)
+        strokeRisks = combinedRisks * strokeProbabilities
+        miRisks = combinedRisks * (1 - strokeProbabilities)
+        return ((pd.Series(strokeRisks[:len(rows)]), pd.Series(miRisks[:len(rows)])),
+                (pd.Series(strokeRisks[len(rows):]), pd.Series(miRisks[len(rows):])))
 
     def estimate_risks(self, recalibration_pop):
-        combinedRisks = pd.Series([self._outcome_model_repository.get_risk_for_person(
-            person, OutcomeModelType.CARDIOVASCULAR, 1) for _, person in recalibration_pop.iteritems()])
+        """
+        Returns the stroke and MI risks of the people in recalibration_pop (a pd.Series of people
+        of the population), estimated one person at a time, as a pair of pd.Series.
+        """
+        people = list(recalibration_pop)
+        combinedRisks = pd.Series(
+            self.estimate_cv_risks_per_person([person._row for person in people]))
+        outcomeDetermination = self._outcome_model_repository.get_cv_outcome_determination()
         strokeProbabilities = pd.Series(
-            [CVOutcomeDetermination().get_stroke_probability(person) for _, person in recalibration_pop.iteritems()])
+            [outcomeDetermination.get_stroke_probability(person) for person in people])
 
         strokeRisks = combinedRisks * strokeProbabilities
-        miRisks = combinedRisks * (1-strokeProbabilities)
+        miRisks = combinedRisks * (1 - strokeProbabilities)
         return strokeRisks, miRisks
 
+    # risks of repositories that override the per person risk, which the batch models can't
+    # evaluate, are estimated one person at a time
+    def estimate_cv_risks_per_person(self, rows):
+        return np.array([self._outcome_model_repository.get_risk_for_person(
+            self._peopleByRow[row], OutcomeModelType.CARDIOVASCULAR, 1) for row in rows],
+            dtype=np.float64)
+
+    def estimate_shifted_cv_risks_per_person(self, shifts, rows):
+        # the people are shifted for the estimate and put back exactly as they were afterwards
+        originals = {name: self._state.current(name, rows).copy() for name in shifts}
+        try:
+            for name, shift in shifts.items():
+                self._state.set_current(name, originals[name] + shift, rows)
+            return self.estimate_cv_risks_per_person(rows)
+        finally:
+            for name, values in originals.items():
+                self._state.set_current(name, values, rows)
+
     def create_or_rollback_events_to_correct_calibration(self,
                                                          treatment_outcome_standard,
                                                          treatedRisks,
                                                          untreatedRisks,
                                                          outcomeType,
                                                          fatalityDetermination,
-                                                         recalibration_pop):
+                                                         rows):
+        """
+        Adds or rolls back events of outcomeType among rows (the people that were alive at the
+        start of the wave) so that the model's treatment effect matches the standard. The
+        risks are given in the order of rows and fatalityDetermination(state, rows) decides
+        which of the new events are fatal.
+        """
         modelEstimatedRR = treatedRisks.mean()/untreatedRisks.mean()
         # use the delta between that effect and the calibration standard to recalibrate the pop.
         delta = modelEstimatedRR - treatment_outcome_standard[outcomeType]
-        eventsForPeople = [person.has_outcome_during_wave(
-            self._currentWave, outcomeType) for _, person in recalibration_pop.iteritems()]
+        eventsForPeople = self.has_outcome_during_wave_batch(self._currentWave, outcomeType, rows)
 
         numberOfEventStatusesToChange = abs(
-            int(round(delta * pd.Series(eventsForPeople).sum()/modelEstimatedRR)))
-        nonEventsForPeople = [not item for item in eventsForPeople]
+            int(round(delta * eventsForPeople.sum()/modelEstimatedRR)))
+        untreatedRisks = np.asarray(untreatedRisks)
         # key assumption: "treatment" is applied to a population as opposed to individuals within a population
         # analyses can be setup either way...build two populations and then set different treatments
         # or build a ur-population adn then set different treamtents within them
@@ -181,47 +494,90 @@ class Population:
         # if negative, the model estimated too few events, if positive, too mnany
         if delta < 0:
             if numberOfEventStatusesToChange > 0:
-                new_events = recalibration_pop.loc[nonEventsForPeople].sample(n=numberOfEventStatusesToChange,
-                                                                              replace=False,
-                                                                              weights=pd.Series(untreatedRisks).loc[nonEventsForPeople].values)
-                for i, event in new_events.iteritems():
-                    event.add_outcome_event(Outcome(outcomeType, fatalityDetermination(event)))
+                newEvents = sample_without_replacement_batch(
+                    self._state, rows[~eventsForPeople], untreatedRisks[~eventsForPeople],
+                    numberOfEventStatusesToChange, f"recalibrationNew{outcomeType.value}")
+                self.add_outcome_events(newEvents,
+                                        np.full(len(newEvents), outcomeType == OutcomeType.MI),
+                                        fatalityDetermination(self._state, newEvents))
 
         # redtag - two problems here...1. rolling back events in people that may not have events
         # 2. probably usign the wrong weights...need to roll back inversely proportionately to the likeliood of an event, riht?
 
         elif delta > 0:
-            if numberOfEventStatusesToChange > pd.Series(eventsForPeople).sum():
-                numberOfEventStatusesToChange = pd.Series(eventsForPeople).sum()
+            if numberOfEventStatusesToChange > eventsForPeople.sum():
+                numberOfEventStatusesToChange = eventsForPeople.sum()
             if numberOfEventStatusesToChange > 0:
-                events_to_rollback = recalibration_pop.loc[eventsForPeople].sample(n=numberOfEventStatusesToChange,
-                                                                                   replace=False,
-                                                                                   weights=pd.Series(1-untreatedRisks).loc[eventsForPeople].values)
-                for i, event in events_to_rollback.iteritems():
-                    event.rollback_most_recent_event(outcomeType)
+                eventsToRollback = sample_without_replacement_batch(
+                    self._state, rows[eventsForPeople], 1 - untreatedRisks[eventsForPeople],
+                    numberOfEventStatusesToChange, f"recalibrationRollback{outcomeType.value}")
+                self.rollback_most_recent_events(eventsToRollback, outcomeType)
+
+    def has_outcome_during_wave_batch(self, wave, outcomeType, rows):
+        """Person.has_outcome_during_wave for each of rows, from the event log."""
+        lengths = self._state.lengths('age')[rows]
+        ageAtStart = self._state.value_at('age', np.minimum(wave - 1, lengths - 1), rows)
+        events = self._state.events
+        eventIds = np.flatnonzero(events.selected(outcomeType))
+        eventRows = events.column('row')[eventIds]
+        startAges = np.full(self._state.n, np.nan)
+        startAges[rows] = ageAtStart
+        hasOutcome = np.zeros(self._state.n, dtype=bool)
+        hasOutcome[eventRows[events.column('age')[eventIds] == startAges[eventRows]]] = True
+        # people that died before the wave can't have had an event in it
+        died = ~self._state.current('alive', rows) & (wave > lengths)
+        return hasOutcome[rows] & ~died
+
+    def rollback_most_recent_events(self, rows, outcomeType):
+        """Person.rollback_most_recent_event for each of rows, applied to the event log at once."""
+        rows = np.asarray(rows)
+        eventIds = self._state.events.last_events(rows, outcomeType)
+        if np.any(eventIds < 0):
+            raise IndexError("pop from empty list")
+        # if the patient died during the wave, then their age didn't advance and their event
+        # would be at their age at the start of the wave.
+        alive = self._state.current('alive', rows)
+        rollbackAges = np.where(alive, self._state.current('age', rows) - 1,
+                                self._state.current('age', rows))
+        eventAges = self._state.events.column('age')[eventIds]
+        if np.any(rollbackAges != eventAges):
+            raise Exception(
+                f'trying to rollback events at ages {eventAges[rollbackAges != eventAges]}, but '
+                f'current ages are {rollbackAges[rollbackAges != eventAges]} - can not roll back '
+                f'if age has changed')
+        fatal = rows[self._state.events.column('fatal')[eventIds]]
+        self._state.remove_events(eventIds)
+        # and, if it was fatal, reset the person to being alive.
+        if len(fatal) > 0:
+            self._state.set_current('alive', True, fatal)
+            self._state.append('age', self._state.current('age', fatal) + 1, fatal)
 
     def get_people_alive_at_the_start_of_the_current_wave(self):
         return self.get_people_alive_at_the_start_of_wave(self._currentWave)
 
-    def get_people_alive_at_the_start_of_wave(self, save):
-        peopleAlive = []
-        for person in self._people:
-            if person.alive_at_start_of_wave(self._currentWave):
-                peopleAlive.append(person)
-        return pd.Series(peopleAlive)
+    def get_people_alive_at_the_start_of_wave(self, wave):
+        return pd.Series(list(compress(self._people, self._state.alive_at_start_of_wave(wave))))
 
     def get_people_that_are_currently_alive(self):
-        return pd.Series([not person.is_dead() for _, person in self._people.iteritems()])
+        return pd.Series(self._state.current('alive'))
 
     def get_number_of_patients_currently_alive(self):
-        self.get_people_that_are_currently_alive.sum()
+        return self._state.current('alive').sum()
 
     def get_events_in_most_recent_wave(self, eventType):
-        peopleWithEvents = []
-        for _, person in self._people.iteritems():
-            if person.has_outcome_at_age(eventType, person._age[-1]):
-                peopleWithEvents.append(person)
-        return peopleWithEvents
+        events = self._state.events
+        # an event in the most recent wave is at the person's current age
+        inWave = events.selected(eventType) & \
+            (events.column('age') == self._state.current('age')[events.column('row')])
+        return [self._peopleByRow[row] for row in np.unique(events.column('row')[inWave])]
+
+    def get_event_counts_by_wave(self, eventType=None):
+        """Number of events (of a type) in each wave, from wave 1 to the most recent wave."""
+        return self._state.events.count_by_wave(self._totalWavesAdvanced + 1, eventType)[1:]
+
+    def get_first_event_ages(self, eventType):
+        """Each person's age at their first event of a type (-1 if prior to the simulation)."""
+        return self._state.events.first_event_ages(self._state.n, eventType)
 
     def generate_starting_mean_patient(self):
         df = self.get_people_initial_state_as_dataframe()
@@ -250,54 +606,12 @@ class Population:
 
     # refactorrtag: we should probably build a specific class that loads data files...
 
-    def build_age_standard(self, yearOfStandardizedPopulation):
-        if yearOfStandardizedPopulation in Population._ageStandards:
-            return copy.deepcopy(Population._ageStandards[yearOfStandardizedPopulation])
-
-        datafile_path = get_absolute_datafile_path("us.1969_2017.19ages.adjusted.txt")
-        ageStandard = pd.read_csv(datafile_path, header=0, names=['raw'])
-        # https://seer.cancer.gov/popdata/popdic.html
-        ageStandard['year'] = ageStandard['raw'].str[0:4]
-        ageStandard['year'] = ageStandard.year.astype(int)
-        # format changes in 1990...so, we'll go forward from there...
-        ageStandard = ageStandard.loc[ageStandard.year >= 1990]
-        ageStandard['state'] = ageStandard['raw'].str[4:6]
-        ageStandard['state'] = ageStandard['raw'].str[4:6]
-        # 1 = white, 2 = black, 3 = american indian/alaskan, 4 = asian/pacific islander
-        ageStandard['race'] = ageStandard['raw'].str[13:14]
-        ageStandard['hispanic'] = ageStandard['raw'].str[14:15]
-        ageStandard['female'] = ageStandard['raw'].str[15:16]
-        ageStandard['female'] = ageStandard['female'].astype(int)
-        ageStandard['female'] = ageStandard['female'].replace({1: 0, 2: 1})
-        ageStandard['ageGroup'] = ageStandard['raw'].str[16:18]
-        ageStandard['ageGroup'] = ageStandard['ageGroup'].astype(int)
-        ageStandard['standardPopulation'] = ageStandard['raw'].str[18:26]
-        ageStandard['standardPopulation'] = ageStandard['standardPopulation'].astype(int)
-        ageStandard['lowerAgeBound'] = (ageStandard.ageGroup - 1) * 5
-        ageStandard['upperAgeBound'] = (ageStandard.ageGroup * 5) - 1
-        ageStandard['lowerAgeBound'] = ageStandard['lowerAgeBound'].replace({-5: 0, 0: 1})
-        ageStandard['upperAgeBound'] = ageStandard['upperAgeBound'].replace({-1: 0, 89: 150})
-        ageStandardYear = ageStandard.loc[ageStandard.year == yearOfStandardizedPopulation]
-        ageStandardGroupby = ageStandardYear[['female',
-                                              'standardPopulation',
-                                              'lowerAgeBound',
-                                              'upperAgeBound',
-                                              'ageGroup']].groupby(['ageGroup',
-                                                                    'female'])
-        ageStandardHeaders = ageStandardGroupby.first()[['lowerAgeBound', 'upperAgeBound']]
-        ageStandardHeaders['female'] = ageStandardHeaders.index.get_level_values(1)
-        ageStandardPopulation = ageStandardYear[['female', 'standardPopulation', 'ageGroup']]
-        ageStandardPopulation = ageStandardPopulation.groupby(['ageGroup', 'female']).sum()
-        ageStandardPopulation = ageStandardHeaders.join(ageStandardPopulation, how='inner')
-        # cache the age standard populations...they're not that big and it takes a while
-        # to build one
-        ageStandardPopulation['outcomeCount'] = 0
-        ageStandardPopulation['simPersonYears'] = 0
-        ageStandardPopulation['simPeople'] = 0
-        Population._ageStandards[yearOfStandardizedPopulation] = copy.deepcopy(
-            ageStandardPopulation)
-
-        return ageStandardPopulation
+    def build_age_standard(self, yearOfStandardizedPopulation, state=None, race=None,
+                           hispanic=None):
+        # the standard populations come from a small table that is precomputed from the SEER
+        # file (see age_standard.py), so a fresh copy is cheap to build. standard populations
+        # for a state, race or hispanic origin are read from the SEER file.
+        return get_age_standard(yearOfStandardizedPopulation, state, race, hispanic)
 
     def tabulate_age_specific_rates(self, ageStandard):
         ageStandard['percentStandardPopInGroup'] = ageStandard['standardPopulation'] / \
@@ -313,54 +627,108 @@ class Population:
             self, outcomeType, yearOfStandardizedPopulation=2016,
             subPopulationSelector=None, subPopulationDFSelector=None):
 
-        # the age selector picks the first outcome (_outcomes(outcomeTYpe)[0]) and the age is the
-        # first element within the returned tuple (the second [0])
-        events = self.calculate_mean_age_sex_standardized_event(
-            lambda x: x.has_outcome_during_simulation(outcomeType),
-            lambda x: x._outcomes[outcomeType][0][0] - x._age[0] + 1,
-            yearOfStandardizedPopulation,
-            subPopulationSelector,
-            subPopulationDFSelector)
+        # the event year is the year of the first outcome, for people with an outcome during
+        # the simulation
+        hasEvent = self._state.events.count_by_row(self._state.n, outcomeType,
+                                                   duringSimulation=True) > 0
+        eventYears = np.where(hasEvent, self.get_first_event_ages(outcomeType) -
+                              self._state.baseline('age') + 1, np.nan)
+        events = self.calculate_standardized_events(eventYears, yearOfStandardizedPopulation,
+                                                    subPopulationSelector,
+                                                    subPopulationDFSelector)
         return (pd.Series([event[0] for event in events]).mean(),
                 pd.Series([event[1] for event in events]).sum())
 
     def calculate_mean_age_sex_standardized_mortality(self, yearOfStandardizedPopulation=2016):
-        events = self.calculate_mean_age_sex_standardized_event(lambda x: x.is_dead(),
-                                                                lambda x: x.years_in_simulation(),
-                                                                yearOfStandardizedPopulation)
-        return pd.Series([event[0] for event in events]).mean()
+        state = self._state
+        # people that died, died in the last year they were in the simulation
+        deathYears = np.where(state.current('alive'), np.nan, state.lengths('age') - 1)
+        rates = self.calculate_age_sex_standardized_rates(deathYears, yearOfStandardizedPopulation)
+        return rates.standardizedRate.mean()
 
     def calculate_mean_age_sex_standardized_event(self, eventSelector, eventAgeIdentifier,
                                                   yearOfStandardizedPopulation=2016,
                                                   subPopulationSelector=None,
                                                   subPopulationDFSelector=None):
-        # build a dataframe to represent the population
-        popDF = self.get_people_current_state_as_dataframe()
-        popDF['female'] = popDF['gender'] - 1
-
-        eventsPerYear = []
-        # calculated standardized event rate for each year
-        for year in range(1, self._totalWavesAdvanced + 1):
-            eventVarName = 'event' + str(year)
-            ageVarName = 'age' + str(year)
-            popDF[ageVarName] = popDF['baseAge'] + year
-            if subPopulationDFSelector is not None:
-                popDF['subpopFilter'] = popDF.apply(subPopulationDFSelector, axis='columns')
-                popDF = popDF.loc[popDF.subpopFilter == 1]
-            popDF[eventVarName] = [eventSelector(person) and eventAgeIdentifier(
-                person) == year for person in filter(subPopulationSelector, self._people)]
-            dfForAnnualEventCalc = popDF[[ageVarName, 'female', eventVarName]]
-            dfForAnnualEventCalc.rename(
-                columns={
-                    ageVarName: 'age',
-                    eventVarName: 'event'},
-                inplace=True)
-            eventsPerYear.append(
-                self.get_standardized_events_for_year(
-                    dfForAnnualEventCalc,
-                    yearOfStandardizedPopulation))
-
-        return eventsPerYear
+        # the selectors are evaluated once per person, the standardization is done for all of the
+        # years at once
+        eventYears = np.array([eventAgeIdentifier(person) if eventSelector(person) else np.nan
+                               for person in self._people], dtype=np.float64)
+        return self.calculate_standardized_events(eventYears, yearOfStandardizedPopulation,
+                                                  subPopulationSelector, subPopulationDFSelector)
+
+    def calculate_standardized_events(self, eventYears, yearOfStandardizedPopulation=2016,
+                                      subPopulationSelector=None, subPopulationDFSelector=None):
+        included = np.ones(self._state.n, dtype=bool)
+        if subPopulationDFSelector is not None:
+            popDF = self.get_people_current_state_as_dataframe()
+            included &= (popDF.apply(subPopulationDFSelector, axis='columns') == 1).to_numpy()
+        if subPopulationSelector is not None:
+            included &= np.array([bool(subPopulationSelector(person)) for person in self._people])
+        rates = self.calculate_age_sex_standardized_rates(
+            eventYears, yearOfStandardizedPopulation, groups=np.where(included, 0, np.nan))
+        return list(zip(rates.standardizedRate, rates.outcomeCount))
+
+    def calculate_age_sex_standardized_rates(self, eventYears, yearOfStandardizedPopulation=2016,
+                                             groups=None):
+        """
+        Returns the age-sex standardized rate of an event (per 100,000 person years) and the
+        number of events for every year of the simulation, computed for all years in one pass.
+
+        eventYears has the year of the simulation that each person had the event in (NaN for
+        people without the event). Every person counts a person year in every year. If groups
+        are given (one label per person, None/NaN for people to leave out), rates are returned
+        for each group, indexed by (group, year), otherwise they are indexed by year.
+        """
+        state = self._state
+        codes, labels = pd.factorize(np.zeros(state.n) if groups is None else groups)
+        rows = np.flatnonzero(codes >= 0)
+        codes = codes[rows]
+        years = np.arange(1, self._totalWavesAdvanced + 1)
+        baseAge = state.baseline('age', rows)
+        female = state.static('gender')[rows] - NHANESGender.MALE.value
+
+        # a (person x year) table of the age group each person is in, max age is 85 in the age
+        # standard
+        ages = baseAge[:, None] + years[None, :]
+        ageGroups = (np.minimum(ages, 85) // 5 + 1).astype(np.int64)
+        cells = ((codes[:, None] * len(years) + years - 1) * 19 + ageGroups) * 2 + female[:, None]
+        shape = (len(labels), len(years), 19, 2)
+        personYears = np.bincount(cells.ravel(), minlength=np.prod(shape)).reshape(shape)
+        events = np.bincount(cells.ravel(), weights=(eventYears[rows][:, None] == years).ravel(),
+                             minlength=np.prod(shape)).reshape(shape)
+
+        ageStandard = self.build_age_standard(yearOfStandardizedPopulation)
+        standardPopulation = np.zeros((19, 2))
+        inAgeStandard = np.zeros((19, 2), dtype=bool)
+        lowerAgeBound = np.full(19, -np.inf)
+        standardAgeGroups = ageStandard.index.get_level_values('ageGroup')
+        standardFemale = ageStandard.index.get_level_values('female')
+        standardPopulation[standardAgeGroups, standardFemale] = ageStandard.standardPopulation
+        inAgeStandard[standardAgeGroups, standardFemale] = True
+        lowerAgeBound[standardAgeGroups] = ageStandard.lowerAgeBound
+        # limit to the age groups where there are people, if the simulation runs for 50 years
+        # there will be empty cells in all of the young person categories
+        youngestAge = np.full(len(labels), np.inf)
+        np.minimum.at(youngestAge, codes, baseAge)
+        youngestAge = youngestAge[:, None] + years[None, :]
+        inStandard = inAgeStandard[None, None] & \
+            (lowerAgeBound[None, None, :, None] >= youngestAge[:, :, None, None])
+        standardWeights = np.where(inStandard, standardPopulation, 0)
+        percentStandardPopInGroup = standardWeights / \
+            standardWeights.sum(axis=(2, 3), keepdims=True)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ageSpecificRate = events * 100000 / personYears
+        ageSpecificContribution = np.where(inStandard, ageSpecificRate * percentStandardPopInGroup,
+                                           np.nan)
+
+        rates = pd.DataFrame({
+            'standardizedRate': np.nansum(ageSpecificContribution, axis=(2, 3)).ravel(),
+            'outcomeCount': np.where(inStandard, events, 0).sum(axis=(2, 3)).ravel()},
+            index=pd.MultiIndex.from_arrays([np.repeat(labels, len(years)),
+                                             np.tile(years, len(labels))],
+                                            names=['group', 'year']))
+        return rates.loc[labels[0]] if groups is None else rates
 
     def get_standardized_events_for_year(self, peopleDF, yearOfStandardizedPopulation):
         ageStandard = self.build_age_standard(yearOfStandardizedPopulation)
@@ -385,63 +753,428 @@ class Population:
         return((ageStandard.ageSpecificContribution.sum(), ageStandard.outcomeCount.sum()))
 
     def get_people_current_state_as_dataframe(self):
-        return pd.DataFrame({'age': [person._age[-1] for person in self._people],
-                             'baseAge': [person._age[0] for person in self._people],
-                             'gender': [person._gender for person in self._people],
-                             'raceEthnicity': [person._raceEthnicity for person in self._people],
-                             'sbp': [person._sbp[-1] for person in self._people],
-                             'dbp': [person._dbp[-1] for person in self._people],
-                             'a1c': [person._a1c[-1] for person in self._people],
-                             'hdl': [person._hdl[-1] for person in self._people],
-                             'ldl': [person._ldl[-1] for person in self._people],
-                             'trig': [person._trig[-1] for person in self._people],
-                             'totChol': [person._totChol[-1] for person in self._people],
-                             'bmi': [person._bmi[-1] for person in self._people],
-                             'anyPhysicalActivity': [person._anyPhysicalActivity[-1] for person in self._people],
-                             'education': [person._education.value for person in self._people],
-                             'aFib': [person._afib[-1] for person in self._people],
-                             'antiHypertensive': [person._antiHypertensiveCount[-1] for person in self._people],
-                             'statin': [person._statin[-1] for person in self._people],
-                             'otherLipidLoweringMedicationCount': [person._otherLipidLoweringMedicationCount[-1] for person in self._people],
-                             'waist': [person._waist[-1] for person in self._people],
-                             'smokingStatus': [person._smokingStatus for person in self._people],
-                             'dead': [person.is_dead() for person in self._people],
-                             'miPriorToSim': [person._selfReportMIPriorToSim for person in self._people],
-                             'miInSim': [person.has_mi_during_simulation() for person in self._people],
-                             'strokePriorToSim': [person._selfReportStrokePriorToSim for person in self._people],
-                             'strokeInSim': [person.has_stroke_during_simulation() for person in self._people],
-                             'totalYearsInSim': [person.years_in_simulation() for person in self._people]})
+        state = self._state
+        return pd.DataFrame({'age': state.current('age'),
+                             'baseAge': state.baseline('age'),
+                             'gender': state.static('gender'),
+                             'raceEthnicity': state.static('raceEthnicity'),
+                             'sbp': state.current('sbp'),
+                             'dbp': state.current('dbp'),
+                             'a1c': state.current('a1c'),
+                             'hdl': state.current('hdl'),
+                             'ldl': state.current('ldl'),
+                             'trig': state.current('trig'),
+                             'totChol': state.current('totChol'),
+                             'bmi': state.current('bmi'),
+                             'anyPhysicalActivity': state.current('anyPhysicalActivity'),
+                             'education': state.static('education'),
+                             'aFib': state.current('afib'),
+                             'antiHypertensive': state.current('antiHypertensiveCount'),
+                             'statin': state.current('statin'),
+                             'otherLipidLoweringMedicationCount':
+                                 state.current('otherLipidLoweringMedicationCount'),
+                             'waist': state.current('waist'),
+                             'smokingStatus': state.static('smokingStatus'),
+                             'dead': ~state.current('alive'),
+                             'miPriorToSim': state.static('selfReportMIPriorToSim'),
+                             'miInSim': state.events.count_by_row(
+                                 state.n, OutcomeType.MI, duringSimulation=True) > 0,
+                             'strokePriorToSim': state.static('selfReportStrokePriorToSim'),
+                             'strokeInSim': state.events.count_by_row(
+                                 state.n, OutcomeType.STROKE, duringSimulation=True) > 0,
+                             'totalYearsInSim': state.lengths('age') - 1})
 
     def get_people_initial_state_as_dataframe(self):
-        return pd.DataFrame({'age': [person._age[0] for person in self._people],
-                             'gender': [person._gender for person in self._people],
-                             'raceEthnicity': [person._raceEthnicity for person in self._people],
-                             'sbp': [person._sbp[0] for person in self._people],
-                             'dbp': [person._dbp[0] for person in self._people],
-                             'a1c': [person._a1c[0] for person in self._people],
-                             'hdl': [person._hdl[0] for person in self._people],
-                             'ldl': [person._ldl[0] for person in self._people],
-                             'trig': [person._trig[0] for person in self._people],
-                             'totChol': [person._totChol[0] for person in self._people],
-                             'bmi': [person._bmi[0] for person in self._people],
-                             'anyPhysicalActivity': [person._anyPhysicalActivity[0] for person in self._people],
-                             'education': [person._education.value for person in self._people],
-                             'aFib': [person._afib[0] for person in self._people],
-                             'antiHypertensive': [person._antiHypertensiveCount[0] for person in self._people],
-                             'statin': [person._statin[0] for person in self._people],
-                             'otherLipidLoweringMedicationCount': [person._otherLipidLoweringMedicationCount[0] for person in self._people],
-                             'waist': [person._waist[0] for person in self._people],
-                             'smokingStatus': [person._smokingStatus for person in self._people],
-                             'miPriorToSim': [person._selfReportMIPriorToSim for person in self._people],
-                             'strokePriorToSim': [person._selfReportStrokePriorToSim for person in self._people]})
+        state = self._state
+        return pd.DataFrame({'age': state.baseline('age'),
+                             'gender': state.static('gender'),
+                             'raceEthnicity': state.static('raceEthnicity'),
+                             'sbp': state.baseline('sbp'),
+                             'dbp': state.baseline('dbp'),
+                             'a1c': state.baseline('a1c'),
+                             'hdl': state.baseline('hdl'),
+                             'ldl': state.baseline('ldl'),
+                             'trig': state.baseline('trig'),
+                             'totChol': state.baseline('totChol'),
+                             'bmi': state.baseline('bmi'),
+                             'anyPhysicalActivity': state.baseline('anyPhysicalActivity'),
+                             'education': state.static('education'),
+                             'aFib': state.baseline('afib'),
+                             'antiHypertensive': state.baseline('antiHypertensiveCount'),
+                             'statin': state.baseline('statin'),
+                             'otherLipidLoweringMedicationCount':
+                                 state.baseline('otherLipidLoweringMedicationCount'),
+                             'waist': state.baseline('waist'),
+                             'smokingStatus': state.static('smokingStatus'),
+                             'miPriorToSim': state.static('selfReportMIPriorToSim'),
+                             'strokePriorToSim': state.static('selfReportStrokePriorToSim')})
+
+
+class SharedStateWorker(Population):
+    """
+    Advances a fixed slice of a population whose state is shared with a parent process.
+
+    Unlike the Population constructor, the worker doesn't move its people into a state of their
+    own: it re-points them at rows of the shared state. CV events are counted in the shared state
+    and written to the wave's event arrays; the parent adds them to its own people.
+    """
+
+    # event types in the wave's event arrays
+    noEvent = 0
+    miEvent = 1
+    strokeEvent = 2
+
+    def __init__(self, state, rows, people, riskModelRepository, outcomeModelRepository, events):
+        self._state = state
+        self._rows = rows
+        # the people that the parent had built. the others are built here if they're needed
+        self._peopleByRow = PersonViews(state)
+        for person in people:
+            person._state = state
+            self._peopleByRow._people[person._row] = person
+        self._risk_model_repository = riskModelRepository
+        self._outcome_model_repository = outcomeModelRepository
+        self._eventTypes, self._eventFatal, self._eventAges = events
+
+    def add_outcome_events(self, rows, isMI, fatal):
+        self._state.outcome_count("mi")[rows[isMI]] += 1
+        self._state.outcome_count("stroke")[rows[~isMI]] += 1
+        self._eventTypes[rows] = np.where(isMI, SharedStateWorker.miEvent,
+                                          SharedStateWorker.strokeEvent)
+        self._eventFatal[rows] = fatal
+        self._eventAges[rows] = self._state.current('age', rows)
+        self._state.append('alive', np.zeros(fatal.sum(), dtype=bool), rows[fatal])
+
+    def advance_wave(self):
+        self.advance_wave_vectorized(self._rows)
+
+
+def worker_seeds(randomStreams, numberOfProcesses):
+    """
+    Seeds of numpy's global random state in each worker, for draws that models make outside of
+    the random streams (e.g. in repositories that override the outcome methods). Those draws do
+    depend on how the people are split between the workers.
+    """
+    return [int(child.generate_state(1)[0])
+            for child in np.random.SeedSequence(randomStreams.seed).spawn(numberOfProcesses)]
+
+
+def run_shared_state_worker(descriptions, eventDescriptions, n, randomStreams, rows, people,
+                            riskModelRepository, outcomeModelRepository, seed, barrier, command):
+    blocks, state = attach_state(descriptions, n, randomStreams)
+    events = [attach_shared_array(description) for description in eventDescriptions]
+    blocks += [block for block, _ in events]
+    # draws that don't come from random streams would otherwise repeat in every worker
+    np.random.seed(seed)
+    worker = SharedStateWorker(state, rows, people, riskModelRepository, outcomeModelRepository,
+                               [values for _, values in events])
+    try:
+        while True:
+            barrier.wait()
+            if command.value == SharedMemoryWorkerPool.stopCommand:
+                break
+            worker.advance_wave()
+            barrier.wait()
+    except threading.BrokenBarrierError:
+        pass
+    except BaseException:
+        # let the parent know that the wave won't finish
+        barrier.abort()
+        raise
+    finally:
+        detach_state(state)
+        events.clear()
+        del worker
+        close_blocks(blocks)
+
+
+def stop_shared_state_workers(processes, barrier, command, blocks):
+    command.value = SharedMemoryWorkerPool.stopCommand
+    if any(process.is_alive() for process in processes):
+        try:
+            barrier.wait(timeout=10)
+        except threading.BrokenBarrierError:
+            pass
+    for process in processes:
+        process.join(timeout=10)
+        if process.is_alive():
+            process.terminate()
+    for block in blocks:
+        block.unlink()
+
+
+class SharedMemoryWorkerPool:
+    """
+    Long-lived worker processes that advance a population in place.
+
+    The population's state is moved into shared memory and every worker advances a fixed slice
+    of the people with the same vectorized wave as Population.advance_vectorized. The people and
+    model repositories are sent to the workers once, when the pool starts. After that the parent
+    and the workers only meet at a barrier at the start and at the end of every wave.
+
+    With random streams (see Population.set_random_seed) the results are identical to
+    advancing the population in a single process. Without them the workers draw from
+    worker_random_streams, so the results don't depend on the number of workers.
+    """
+
+    advanceCommand = 0
+    stopCommand = 1
+
+    def __init__(self, population, numberOfProcesses, waves):
+        self.numberOfProcesses = numberOfProcesses
+        self._population = population
+        self._state = population._state
+        # leave room to keep the pool for later calls. recalibration can add a fatal event after
+        # a person died in the wave, which needs one more alive status than there are waves
+        self.capacity = max(waves, 2 * self._state.capacity)
+        self._state.reserve(self.capacity + 1)
+        self._blocks, descriptions = share_state(self._state)
+
+        self._events = []
+        eventDescriptions = []
+        for dtype in [np.int8, np.bool_, np.float64]:
+            block, values = create_shared_array(np.zeros(self._state.n, dtype=dtype))
+            self._blocks.append(block)
+            self._events.append(values)
+            eventDescriptions.append(describe_shared_array(block, values))
+
+        context = mp.get_context()
+        self._barrier = context.Barrier(numberOfProcesses + 1)
+        self._command = context.Value('i', SharedMemoryWorkerPool.advanceCommand)
+        randomStreams = worker_random_streams(self._state)
+        seeds = worker_seeds(randomStreams, numberOfProcesses)
+        processes = []
+        for rows, seed in zip(np.array_split(np.arange(self._state.n), numberOfProcesses), seeds):
+            process = context.Process(
+                target=run_shared_state_worker,
+                args=(descriptions, eventDescriptions, self._state.n, randomStreams,
+                      rows, population.built_people(rows),
+                      population._risk_model_repository, population._outcome_model_repository,
+                      seed, self._barrier, self._command),
+                daemon=True)
+            process.start()
+            processes.append(process)
+        # also stops the workers and frees the shared memory if the pool is never closed
+        self._finalizer = weakref.finalize(self, stop_shared_state_workers, processes,
+                                           self._barrier, self._command, self._blocks)
+
+    def advance_wave(self):
+        """Advances everybody that is alive by one wave and adds their events to the population."""
+        aliveAtStart = np.flatnonzero(self._state.current('alive'))
+        waves = self._state.lengths('age').copy()
+        try:
+            self._barrier.wait()
+            self._barrier.wait()
+        except threading.BrokenBarrierError:
+            self.close()
+            raise RuntimeError("A worker process failed while advancing the population")
+
+        eventTypes, eventFatal, eventAges = self._events
+        rows = np.flatnonzero(eventTypes)
+        types = np.where(eventTypes[rows] == SharedStateWorker.miEvent,
+                         EventLog.type_code(OutcomeType.MI),
+                         EventLog.type_code(OutcomeType.STROKE))
+        # the outcome counts and alive statuses were already updated in the shared state, so the
+        # events only need to go into the log
+        self._state.events.add(rows, waves[rows], eventAges[rows], types, eventFatal[rows])
+        eventTypes[:] = SharedStateWorker.noEvent
+        # as in Person.apply_bp_treatment_strategy, a strategy is applied once. people that
+        # haven't been built don't have one
+        for person in self._population.built_people(aliveAtStart):
+            person._bpTreatmentStrategy = None
+
+    def apply_recalibration_standards(self):
+        # recalibration works on the shared state, so the workers see its changes
+        self._population.apply_recalibration_standards()
+
+    def close(self):
+        """Stops the workers and moves the population's state back into the parent's memory."""
+        if not self._finalizer.alive:
+            return
+        self._finalizer()
+        unshare_state(self._state)
+        self._events.clear()
+        close_blocks(self._blocks)
+
+
+def run_people_worker(connection, people, riskModelRepository, outcomeModelRepository,
+                      randomStreams, seed):
+    np.random.seed(seed)
+    population = Population(people)
+    population._state.randomStreams = randomStreams
+    population._risk_model_repository = riskModelRepository
+    population._outcome_model_repository = outcomeModelRepository
+    state = population._state
+    try:
+        while True:
+            message, payload = connection.recv()
+            if message == PeopleWorkerPool.stopMessage:
+                break
+            elif message == PeopleWorkerPool.updateMessage:
+                rows, rowState = payload
+                state._copy_rows_from(rowState, rows, np.arange(len(rows)))
+            elif message == PeopleWorkerPool.advanceMessage:
+                state.reserve(payload)
+                lengths = state.snapshot_lengths()
+                numberOfEvents = len(state.events)
+                hadRandomEffects = state.has_random_effects(np.arange(state.n))
+                for person in population._peopleByRow:
+                    population.advance_person(person)
+                connection.send(get_wave_changes(population, lengths, numberOfEvents,
+                                                 hadRandomEffects))
+    except Exception:
+        connection.send(PeopleWorkerPool.errorMessage)
+        raise
+
+
+def get_wave_changes(population, lengths, numberOfEvents, hadRandomEffects):
+    """
+    Everything a wave changed for the people in a worker: the values appended to each history,
+    the new events and the new random effects, as arrays over the worker's rows.
+    """
+    state = population._state
+    # a wave only adds events, so the new events are at the end of the log
+    events = state.events.events_since(numberOfEvents)
+    newRandomEffects = np.flatnonzero(~hadRandomEffects &
+                                      state.has_random_effects(np.arange(state.n)))
+    return {'appended': state.appended_since(lengths),
+            'events': events,
+            'randomEffects': (newRandomEffects,
+                              {name: state.random_effect(name, newRandomEffects)
+                               for name in state.randomEffectAttributes})}
+
+
+class PeopleWorkerPool:
+    """
+    Long-lived worker processes that each keep a fixed slice of a population's people and advance
+    them one at a time, as Population.advance does.
+
+    People are sent to the workers once, when the pool starts. After every wave a worker only
+    sends back what the wave changed: the values appended to each history, the new events and
+    random effects, so the cost of a wave doesn't grow with the length of the simulation. People
+    that are changed in the parent between waves (e.g. by recalibration) are sent back to their
+    worker.
+    """
+
+    advanceMessage = "advance"
+    updateMessage = "update"
+    stopMessage = "stop"
+    errorMessage = ("error", None)
+
+    def __init__(self, population, numberOfProcesses, waves):
+        self.numberOfProcesses = numberOfProcesses
+        self.capacity = waves
+        self._population = population
+        self._slices = np.array_split(np.arange(population._state.n), numberOfProcesses)
+        self._workerForRow = np.repeat(np.arange(numberOfProcesses),
+                                       [len(rows) for rows in self._slices])
+        context = mp.get_context()
+        randomStreams = worker_random_streams(population._state)
+        seeds = worker_seeds(randomStreams, numberOfProcesses)
+        self._connections = []
+        processes = []
+        for rows, seed in zip(self._slices, seeds):
+            connection, workerConnection = context.Pipe()
+            process = context.Process(
+                target=run_people_worker,
+                args=(workerConnection, [population._peopleByRow[row] for row in rows],
+                      population._risk_model_repository, population._outcome_model_repository,
+                      randomStreams, seed),
+                daemon=True)
+            process.start()
+            self._connections.append(connection)
+            processes.append(process)
+        self._finalizer = weakref.finalize(self, stop_people_workers, processes, self._connections)
+
+    def advance_wave(self):
+        state = self._population._state
+        aliveAtStart = np.flatnonzero(state.current('alive'))
+        for connection in self._connections:
+            connection.send((PeopleWorkerPool.advanceMessage, self.capacity))
+        for rows, connection in zip(self._slices, self._connections):
+            changes = connection.recv()
+            if changes == PeopleWorkerPool.errorMessage:
+                self.close()
+                raise RuntimeError("A worker process failed while advancing the population")
+            state.extend(changes['appended'], rows)
+            # the alive status came along with the other histories
+            events = changes['events']
+            state.add_events(rows[events['row']], events['wave'], events['age'], events['type'],
+                             events['fatal'])
+            randomEffectRows, randomEffects = changes['randomEffects']
+            state.set_random_effects_batch(randomEffects, rows[randomEffectRows])
+        # as in Person.apply_bp_treatment_strategy, a strategy is applied once. people that
+        # haven't been built don't have one
+        for person in self._population.built_people(aliveAtStart):
+            person._bpTreatmentStrategy = None
+
+    def apply_recalibration_standards(self):
+        if self._population._bpTreatmentStrategy is None:
+            return
+        # recalibration changes people in the parent, the workers need the same changes
+        state = self._population._state
+        lengths = state.snapshot_lengths()
+        current = {name: state.current(name) for name in state.historyAttributes}
+        counts = {name: state.outcome_count(name).copy() for name in state.outcomeAttributes}
+        self._population.apply_recalibration_standards()
+        changed = np.zeros(state.n, dtype=bool)
+        for name in state.historyAttributes:
+            changed |= (state.lengths(name) != lengths[name]) | \
+                (state.current(name) != current[name])
+        for name in state.outcomeAttributes:
+            changed |= state.outcome_count(name) != counts[name]
+        self.update_people(np.flatnonzero(changed))
+
+    def update_people(self, rows):
+        """Sends the people in `rows` (as they are in the parent) to their workers."""
+        for worker, connection in enumerate(self._connections):
+            workerRows = rows[self._workerForRow[rows] == worker]
+            if len(workerRows) == 0:
+                continue
+            connection.send((PeopleWorkerPool.updateMessage,
+                             (workerRows - self._slices[worker][0],
+                              self._population._state.take(workerRows))))
+
+    def close(self):
+        self._finalizer()
+
+
+def stop_people_workers(processes, connections):
+    for process, connection in zip(processes, connections):
+        if process.is_alive():
+            try:
+                connection.send((PeopleWorkerPool.stopMessage, None))
+            except (BrokenPipeError, OSError):
+                pass
+    for process in processes:
+        process.join(timeout=10)
+        if process.is_alive():
+            process.terminate()
 
 
 def initializeAFib(person):
-    model = load_regression_model("BaselineAFibModel")
-    statsModel = StatsModelLogisticRiskFactorModel(model)
+    statsModel = load_model("BaselineAFibModel", StatsModelLogisticRiskFactorModel)
     return statsModel.estimate_next_risk(person)
 
 
+def initialize_baseline_afib(people):
+    """
+    Assigns baseline afib to everybody in one pass: the model is evaluated over the columns of
+    a state shared by all of the people and the random draws are made as a single block.
+    """
+    state = PopulationState.from_rows([(person._state, person._row) for person in people])
+    for row, person in enumerate(people):
+        person._state = state
+        person._row = row
+    assign_baseline_afib(state)
+
+
+def assign_baseline_afib(state):
+    model = load_model("BaselineAFibModel", StatsModelLogisticRiskFactorModel)
+    # people have only their baseline values at this point
+    state.set_current('afib', model.estimate_next_risk_batch(state))
+
+
 def build_person(x):
     return Person(
         age=x.age,
@@ -463,49 +1196,138 @@ def build_person(x):
         antiHypertensiveCount=x.antiHypertensive,
         statin=x.statin,
         otherLipidLoweringMedicationCount=x.otherLipidLowering,
-        initializeAfib=initializeAFib,
+        # assigned for everybody at once by initialize_baseline_afib
+        initializeAfib=None,
         selfReportStrokeAge=x.selfReportStrokeAge,
         selfReportMIAge=x.selfReportMIAge,
-        dfIndex=x.index,
+        dfIndex=x['index'],
         diedBy2015=x.diedBy2015)
 
 
+def enum_codes(enumType, values):
+    """Converts an array of numbers to enum values like enumType(int(value)) does for one."""
+    codes = np.asarray(values).astype(np.int64)
+    valid = np.isin(codes, [member.value for member in enumType])
+    if not np.all(valid):
+        raise ValueError(f"{codes[~valid][0]} is not a valid {enumType.__name__}")
+    return codes
+
+
+def build_state_from_nhanes(nhanes):
+    """
+    Builds the state for the people in rows of the NHANES dataset, with the values that
+    build_person would give each of them, in one pass over the columns.
+    """
+    state = PopulationState(len(nhanes))
+    rows = np.arange(state.n)
+
+    def column(name):
+        return nhanes[name].to_numpy(dtype=np.float64)
+
+    for name, values in [
+            ('alive', True),
+            ('age', column('age')),
+            ('sbp', Person.apply_bounds_batch("sbp", column('meanSBP'))),
+            ('dbp', Person.apply_bounds_batch("dbp", column('meanDBP'))),
+            ('a1c', column('a1c')),
+            ('hdl', column('hdl')),
+            ('ldl', column('ldl')),
+            ('trig', column('trig')),
+            ('totChol', column('tot_chol')),
+            ('bmi', column('bmi')),
+            ('waist', column('waist')),
+            ('anyPhysicalActivity', column('anyPhysicalActivity')),
+            ('alcoholPerWeek',
+             AlcoholCategory.get_categories_for_consumption(column('alcoholPerWeek'))),
+            ('antiHypertensiveCount', column('antiHypertensive')),
+            ('statin', column('statin')),
+            ('otherLipidLoweringMedicationCount', column('otherLipidLowering')),
+            ('afib', False)]:
+        state.append(name, values)
+    for name, enumType, values in [
+            ('gender', NHANESGender, column('gender')),
+            ('raceEthnicity', NHANESRaceEthnicity, column('raceEthnicity')),
+            ('education', Education, column('education')),
+            ('smokingStatus', SmokingStatus, column('smokingStatus'))]:
+        state.set_static(name, rows, enum_codes(enumType, values))
+
+    # events prior to the simulation, as in Person.__init__
+    for name, outcomeType, ages in [
+            ('selfReportStrokePriorToSim', OutcomeType.STROKE, column('selfReportStrokeAge')),
+            ('selfReportMIPriorToSim', OutcomeType.MI, column('selfReportMIAge'))]:
+        priorToSim = ages > 1
+        state.set_static(name, rows, priorToSim.astype(np.int64))
+        eventRows = rows[priorToSim]
+        state.add_events(eventRows, np.zeros(len(eventRows), dtype=np.int64), -1, outcomeType,
+                         False)
+
+    assign_baseline_afib(state)
+    return state
+
+
+class PersonViews(Sequence):
+    """
+    People for the rows of a state, built as Person views the first time each one is asked for,
+    so that populations built from columns don't pay for a Person object per row up front.
+
+    attributes are per-row arrays that are set on each person as it's built (like the kwargs
+    of the Person constructor), index is the index of the population's people series.
+    """
+
+    def __init__(self, state, index=None, attributes=None):
+        self.state = state
+        self.index = pd.RangeIndex(state.n) if index is None else index
+        self._attributes = {} if attributes is None else attributes
+        self._people = [None] * state.n
+
+    def __len__(self):
+        return self.state.n
+
+    def __getitem__(self, row):
+        if isinstance(row, slice):
+            return [self[index] for index in range(*row.indices(len(self)))]
+        person = self._people[row]
+        if person is None:
+            person = Person.view(self.state, row, **{name: values[row] for name, values in
+                                                     self._attributes.items()})
+            self._people[row] = person
+        return person
+
+    def built(self, rows):
+        """The people in rows that have already been built."""
+        return [self._people[row] for row in rows if self._people[row] is not None]
+
+    @staticmethod
+    def restore(state, index, attributes, builtPeople):
+        """People over a state, with the people in builtPeople (by row) built with attributes."""
+        people = PersonViews(state, index, attributes)
+        for row, personAttributes in builtPeople.items():
+            people._people[row] = Person.view(state, row, **personAttributes)
+        return people
+
+
 def build_people_using_nhanes_for_sampling(nhanes, n, filter=None, random_seed=None):
     repeated_sample = nhanes.sample(
         n,
         weights=nhanes.WTINT2YR,
         random_state=random_seed,
         replace=True)
-    # people = repeated_sample.apply(build_person, axis=1)
-    people = parallelize_on_rows(repeated_sample, build_person)
+    people = PersonViews(build_state_from_nhanes(repeated_sample), repeated_sample.index,
+                         {'dfIndex': repeated_sample['index'].to_numpy(),
+                          'diedBy2015': repeated_sample.diedBy2015.to_numpy()})
     if filter is not None:
+        people = pd.Series(list(people), index=people.index)
         people = people.loc[people.apply(filter)]
 
     return people
 
-# from https://stackoverflow.com/questions/26784164/pandas-multiprocessing-apply
-
-
-def parallelize(data, func, number_of_processes=8):
-    data_split = np.array_split(data, number_of_processes)
-    pool = mp.Pool(number_of_processes)
-    data = pd.concat(pool.map(func, data_split))
-    pool.close()
-    pool.join()
-    return data
-
-
-def run_on_subset(func, data_subset):
-    return data_subset.apply(func, axis=1)
-
-
-def parallelize_on_rows(data, func, number_of_processes=8):
-    return parallelize(data, partial(run_on_subset, func), number_of_processes)
-
 
 class NHANESDirectSamplePopulation(Population):
     """ Simple base class to sample with replacement from 2015/2016 NHANES """
 
+    # sampled populations are cached here, see load_or_sample
+    baselineCacheDirectory = "populationCache"
+
     def __init__(
             self,
             n,
@@ -513,20 +1335,52 @@ class NHANESDirectSamplePopulation(Population):
             filter=None,
             generate_new_people=True,
             model_reposistory_type="cohort",
-            random_seed=None):
-        nhanes = pd.read_stata("microsim/data/fullyImputedDataset.dta")
-        nhanes = nhanes.loc[nhanes.year == year]
-        super().__init__(build_people_using_nhanes_for_sampling(
-            nhanes, n, filter=filter, random_seed=random_seed))
+            random_seed=None,
+            simulation_seed=None):
+        # random_seed only makes the sample of NHANES people reproducible. simulation_seed sets
+        # the random streams that the simulation draws from (see Population.set_random_seed)
+        # without new people the population starts empty, for people that are assigned later
+        if generate_new_people:
+            people = build_people_using_nhanes_for_sampling(
+                load_nhanes_year(year), n, filter=filter, random_seed=random_seed)
+        else:
+            people = pd.Series([], dtype=object)
+        super().__init__(people)
         self.n = n
         self.year = year
         self._initialize_risk_models(model_reposistory_type)
         self._outcome_model_repository = OutcomeModelRepository()
+        if simulation_seed is not None:
+            self.set_random_seed(simulation_seed)
 
     def copy(self):
-        newPop = NHANESDirectSamplePopulation(self.n, self.year, False)
-        newPop._people = copy.deepcopy(self._people)
-        return newPop
+        return self.clone()
+
+    @classmethod
+    def load_or_sample(cls, n, year, filter=None, model_reposistory_type="cohort",
+                       random_seed=None, cachePath=None):
+        """
+        Returns the population that the constructor samples for these arguments, loaded from a
+        checkpoint of it if it was sampled before (or sampled and saved if it wasn't).
+
+        Populations are cached by year, n, seed, filter (see function_key), model repository and
+        the NHANES dataset they are sampled from. Without a random_seed every sample is different,
+        so the population is sampled without being cached.
+        """
+        if random_seed is None:
+            return cls(n, year, filter=filter, model_reposistory_type=model_reposistory_type)
+        cachePath = get_cache_path(cls.baselineCacheDirectory) if cachePath is None else cachePath
+        path = os.path.join(cachePath, cache_key({
+            'class': cls.__qualname__, 'year': year, 'n': n, 'seed': random_seed,
+            'filter': function_key(filter), 'models': model_reposistory_type,
+            'nhanes': nhanes_source_hash()}))
+        if has_checkpoint(path):
+            # the random state is only restored when a simulation is resumed
+            return Population.load_checkpoint(path, restoreRandomState=False)
+        population = cls(n, year, filter=filter, model_reposistory_type=model_reposistory_type,
+                         random_seed=random_seed)
+        population.save_checkpoint(path)
+        return population
 
     def _initialize_risk_models(self, model_repository_type):
         if (model_repository_type == "cohort"):
@@ -0,0 +1,874 @@
+from collections.abc import MutableMapping
+
+import numpy as np
+
+from microsim.event_log import EventLog
+from microsim.race_ethnicity import NHANESRaceEthnicity
+from microsim.smoking_status import SmokingStatus
+
+
+def whole_numbers(values):
+    """Whether values (a value or an array of them) can be stored as integers unchanged."""
+    values = np.asarray(values)
+    if values.dtype.kind in "biu":
+        return True
+    if values.dtype.kind == "O":
+        try:
+            values = values.astype(np.float64)
+        except (TypeError, ValueError):
+            return False
+    return values.dtype.kind == "f" and bool(np.all(np.mod(values, 1) == 0))
+
+
+class PopulationState:
+    """
+    Columnar (struct-of-arrays) storage for the attributes of a group of people.
+
+    Every attribute that can change during the simulation is stored as a 2D array with one row
+    per person and one column per wave. Following the conventions in person.py, column [0] holds
+    the baseline value and column [k] holds the value at the end of wave k. Each person tracks
+    their own length for every attribute, because people that die stop growing their histories
+    (and some attributes, e.g. gcp, only start being populated after the first wave).
+
+    Attributes that are fixed at baseline are stored as 1D integer arrays. Outcome events are
+    kept in a columnar EventLog, with the number of events of each type per person kept
+    alongside it.
+
+    For every history the state also keeps running aggregates (sums and maxima) that are
+    updated as values are appended, so that models that use the mean or the maximum of a
+    history don't need to re-read the whole history every wave.
+
+    A state can be forked into branches (e.g. one per treatment scenario) that share the history
+    columns written before the fork, see fork.
+
+    A Person is a thin view over one row of a PopulationState. A person that is built on its
+    own owns a single-row state; when people are grouped into a Population, their rows are
+    copied into one shared state so that population-level code can work on whole columns.
+    """
+
+    # attributes that change over time and the dtype used to store them. age is stored as an
+    # integer so that it reads back the way it was given, until a value that isn't a whole number
+    # is stored in it (see _fit_dtype). counts that treatment strategies change (e.g. by half a
+    # medication) are floats from the start
+    historyAttributes = {
+        'alive': np.bool_,
+        'age': np.int64,
+        'sbp': np.float64,
+        'dbp': np.float64,
+        'a1c': np.float64,
+        'hdl': np.float64,
+        'ldl': np.float64,
+        'trig': np.float64,
+        'totChol': np.float64,
+        'bmi': np.float64,
+        'waist': np.float64,
+        'anyPhysicalActivity': np.float64,
+        'alcoholPerWeek': np.float64,
+        'antiHypertensiveCount': np.float64,
+        'statin': np.float64,
+        'otherLipidLoweringMedicationCount': np.float64,
+        'afib': np.bool_,
+        'gcp': np.float64,
+    }
+
+    # attributes that are set at baseline and don't change over time
+    staticAttributes = [
+        'gender',
+        'raceEthnicity',
+        'education',
+        'smokingStatus',
+        'selfReportStrokePriorToSim',
+        'selfReportMIPriorToSim',
+        # identifies a person for their random streams (see random_streams.py)
+        'personId',
+    ]
+
+    # used to store static attributes that were not provided (e.g. gender=None)
+    missingStaticValue = -1
+
+    # whether the arrays are in shared memory (see shared_memory_state.py), where they can't be
+    # replaced without losing the writes of the other processes
+    shared = False
+
+    # elementwise functions that running sums can be kept for. sums of the identity are always
+    # kept, the others are only kept once they have been asked for (see running_sum)
+    aggregateFunctions = {
+        'identity': None,
+        'log': np.log,
+        'square': np.square,
+    }
+
+    # number of events of each outcome type (including events prior to the simulation)
+    outcomeAttributes = ['mi', 'stroke']
+
+    # per-person random effects for outcome models, drawn once when a person enters the
+    # simulation. NaN means that no random effect has been drawn
+    randomEffectAttributes = ['gcp']
+
+    # attributes that are calculated from the other columns. these mirror the properties on Person
+    # with the same names, so that models can be evaluated against either.
+    derivedAttributes = {
+        'current_smoker': lambda state, rows:
+            state.static('smokingStatus')[rows] == SmokingStatus.CURRENT,
+        'current_bp_treatment': lambda state, rows:
+            state.current('antiHypertensiveCount', rows) > 0,
+        'current_diabetes': lambda state, rows:
+            state.running_max('a1c', rows) >= 6.5,
+        'black': lambda state, rows:
+            state.static('raceEthnicity')[rows] == NHANESRaceEthnicity.NON_HISPANIC_BLACK,
+        'mi': lambda state, rows: state.outcome_count('mi')[rows] > 0,
+        'stroke': lambda state, rows: state.outcome_count('stroke')[rows] > 0,
+    }
+
+    def __init__(self, n, waves=1):
+        self.n = n
+        self._history = {name: np.zeros((n, max(waves, 1)), dtype=dtype)
+                         for name, dtype in PopulationState.historyAttributes.items()}
+        # the columns of each history that are shared with other branches of the state, in
+        # order. _history holds the columns that come after them
+        self._frozen = {name: [] for name in PopulationState.historyAttributes}
+        self._lengths = {name: np.zeros(n, dtype=np.int64)
+                         for name in PopulationState.historyAttributes}
+        self._static = {name: np.full(n, PopulationState.missingStaticValue, dtype=np.int64)
+                        for name in PopulationState.staticAttributes}
+        self._outcomeCounts = {name: np.zeros(n, dtype=np.int64)
+                               for name in PopulationState.outcomeAttributes}
+        self.events = EventLog()
+        self._randomEffects = {name: np.full(n, np.nan)
+                               for name in PopulationState.randomEffectAttributes}
+        # RandomStreams used for the draws of everybody in the state, or None to use numpy's
+        # global random state
+        self.randomStreams = None
+        self._sums = {name: {'identity': np.zeros(n)}
+                      for name in PopulationState.historyAttributes}
+        self._maxima = {name: np.full(n, -np.inf) for name in PopulationState.historyAttributes}
+
+    @property
+    def capacity(self):
+        return self._capacity('age')
+
+    def _capacity(self, name):
+        return self._frozen_width(name) + self._history[name].shape[1]
+
+    def reserve(self, waves):
+        """Preallocate enough columns to hold `waves` values for every attribute."""
+        for name in self._history:
+            self._ensure_capacity(name, waves)
+
+    def _ensure_capacity(self, name, waves):
+        values = self._history[name]
+        waves -= self._frozen_width(name)
+        if values.shape[1] >= waves:
+            return
+        # grow geometrically so that appending a wave at a time doesn't copy on every wave
+        newCapacity = max(waves, 2 * values.shape[1])
+        grown = np.zeros((values.shape[0], newCapacity), dtype=values.dtype)
+        grown[:, :values.shape[1]] = values
+        self._history[name] = grown
+
+    def _fit_dtype(self, name, values):
+        """
+        Turns an integer history into floats before values that aren't whole numbers (e.g. a
+        fractional age) are stored in it, rather than truncating them.
+        """
+        if self._history[name].dtype.kind not in "iu" or whole_numbers(values):
+            return
+        if self.shared:
+            raise ValueError(f"Can't store {values} in {name}, the integer history of a state in "
+                             "shared memory")
+        self._history[name] = self._history[name].astype(np.float64)
+        # frozen columns are shared with other branches, so this state gets copies of them
+        self._frozen[name] = [values.astype(np.float64) for values in self._frozen[name]]
+
+    # copy-on-write histories. after a fork, the columns that were written before it are kept in
+    # frozen arrays that are shared with the other branch, and the state's own array only holds
+    # the columns after them. an attribute's frozen columns are copied into its own array
+    # (thawed) the first time the state writes to one of them.
+
+    def _frozen_width(self, name):
+        return sum(values.shape[1] for values in self._frozen[name])
+
+    def _gather(self, name, rows, columns):
+        """Returns the history values at (rows, columns), wherever the columns are kept."""
+        if not self._frozen[name]:
+            return self._history[name][rows, columns]
+        rows, columns = np.broadcast_arrays(np.asarray(rows), np.asarray(columns))
+        values = np.zeros(rows.shape, dtype=self._history[name].dtype)
+        start = 0
+        for segment in self._frozen[name]:
+            inSegment = (columns >= start) & (columns < start + segment.shape[1])
+            values[inSegment] = segment[rows[inSegment], columns[inSegment] - start]
+            start += segment.shape[1]
+        inOwn = columns >= start
+        values[inOwn] = self._history[name][rows[inOwn], columns[inOwn] - start]
+        return values
+
+    def _columns(self, name, rows, width):
+        """Returns the first `width` columns of the histories of rows (a row or an array)."""
+        if not self._frozen[name]:
+            return self._history[name][rows, :width]
+        pieces = []
+        for segment in self._frozen[name] + [self._history[name]]:
+            if width <= 0:
+                break
+            pieces.append(segment[rows, :width])
+            width -= segment.shape[1]
+        return np.concatenate(pieces, axis=-1)
+
+    def _thaw(self, name):
+        if self._frozen[name]:
+            self._history[name] = np.concatenate(self._frozen[name] + [self._history[name]],
+                                                 axis=1)
+            self._frozen[name] = []
+
+    def _own_columns(self, name, columns):
+        """
+        Makes sure that the columns can be written to and returns the offset of the state's own
+        array, i.e. column c is at _history[name][:, c - offset].
+        """
+        frozenWidth = self._frozen_width(name)
+        if frozenWidth > 0 and np.any(np.asarray(columns) < frozenWidth):
+            self._thaw(name)
+            return 0
+        return frozenWidth
+
+    def consolidate(self):
+        """Thaws every history, e.g. before the state's arrays are moved into shared memory."""
+        for name in self._history:
+            self._thaw(name)
+
+    def fork(self):
+        """
+        Returns a copy of the state for another branch of the simulation (e.g. another treatment
+        scenario).
+
+        The histories written so far aren't copied: this state and the branch both keep them as
+        frozen columns, and each writes its new waves to arrays of its own. A branch only copies
+        the frozen columns of an attribute if it changes one of them (e.g. reset_to_baseline).
+        The per-person arrays (lengths, aggregates, outcome counts, ...) are copied.
+        """
+        branch = PopulationState.__new__(PopulationState)
+        branch.n = self.n
+        branch._history = {}
+        branch._frozen = {}
+        for name, values in self._history.items():
+            used = int(self._lengths[name].max(initial=0)) - self._frozen_width(name)
+            if used > 0:
+                self._frozen[name] = self._frozen[name] + [values[:, :used]]
+            # the rest of the array is never written to again, both states start new arrays
+            # (which don't take up memory until they're written to)
+            spare = max(values.shape[1] - max(used, 0), 1)
+            self._history[name] = np.zeros((self.n, spare), dtype=values.dtype)
+            branch._history[name] = np.zeros((self.n, spare), dtype=values.dtype)
+            branch._frozen[name] = list(self._frozen[name])
+        branch._lengths = {name: lengths.copy() for name, lengths in self._lengths.items()}
+        branch._static = {name: values.copy() for name, values in self._static.items()}
+        branch._outcomeCounts = {name: counts.copy()
+                                 for name, counts in self._outcomeCounts.items()}
+        branch.events = self.events.copy()
+        branch._randomEffects = {name: values.copy()
+                                 for name, values in self._randomEffects.items()}
+        branch.randomStreams = self.randomStreams
+        branch._sums = {name: {function: sums.copy() for function, sums in sumsByFunction.items()}
+                        for name, sumsByFunction in self._sums.items()}
+        branch._maxima = {name: maxima.copy() for name, maxima in self._maxima.items()}
+        return branch
+
+    # single-person accessors, used by the Person view
+
+    def get_length(self, name, row):
+        return int(self._lengths[name][row])
+
+    def get_row(self, name, row):
+        """
+        Returns the populated part of one person's history, a writeable view unless some of it
+        is frozen (see fork).
+        """
+        return self._columns(name, row, self._lengths[name][row])
+
+    def append_value(self, name, row, value):
+        self._fit_dtype(name, value)
+        length = self._lengths[name][row]
+        self._ensure_capacity(name, length + 1)
+        column = length - self._own_columns(name, length)
+        self._history[name][row, column] = value
+        self._lengths[name][row] = length + 1
+        # aggregate what was stored, so that the aggregates see the same casts as the history
+        stored = np.float64(self._history[name][row, column])
+        for function, sums in self._sums[name].items():
+            sums[row] += PopulationState._aggregate_values(function, stored)
+        self._maxima[name][row] = max(self._maxima[name][row], stored)
+
+    def set_value(self, name, row, index, value):
+        self._fit_dtype(name, value)
+        length = self._lengths[name][row]
+        if isinstance(index, slice):
+            self._thaw(name)
+            values = self.get_row(name, row)
+            values[index] = value
+            self._recompute_aggregates(name, [row])
+            return
+        index = index if index >= 0 else length + index
+        if not 0 <= index < length:
+            raise IndexError("history index out of range")
+        # only the person's own columns, from the first one that isn't frozen
+        offset = self._own_columns(name, index)
+        values = self._history[name][row, :length - offset]
+        index -= offset
+        previous = np.float64(values[index])
+        values[index] = value
+        stored = np.float64(values[index])
+        for function, sums in self._sums[name].items():
+            change = [PopulationState._aggregate_values(function, stored),
+                      PopulationState._aggregate_values(function, previous)]
+            if np.all(np.isfinite(change)):
+                sums[row] += change[0] - change[1]
+            else:
+                # e.g. the log of a zero, which can't be taken back out of the sum
+                self._recompute_aggregates(name, [row], [function])
+        if stored >= self._maxima[name][row]:
+            self._maxima[name][row] = stored
+        elif previous == self._maxima[name][row]:
+            self._recompute_aggregates(name, [row])
+
+    def pop_value(self, name, row):
+        length = self._lengths[name][row]
+        if length == 0:
+            raise IndexError("pop from empty history")
+        self._lengths[name][row] = length - 1
+        self._recompute_aggregates(name, [row])
+        return self._gather(name, row, length - 1).item()
+
+    def set_history(self, name, row, values):
+        values = list(values)
+        self._fit_dtype(name, values)
+        self._ensure_capacity(name, len(values))
+        self._thaw(name)
+        self._history[name][row, :len(values)] = values
+        self._lengths[name][row] = len(values)
+        self._recompute_aggregates(name, [row])
+
+    def truncate(self, name, row, length):
+        self._lengths[name][row] = min(length, self._lengths[name][row])
+        self._recompute_aggregates(name, [row])
+
+    def get_static(self, name, row):
+        value = self._static[name][row]
+        return None if value == PopulationState.missingStaticValue else int(value)
+
+    def set_static(self, name, row, value):
+        self._static[name][row] = PopulationState.missingStaticValue if value is None else value
+
+    def set_outcome_count(self, name, row, count):
+        self._outcomeCounts[name][row] = count
+
+    def add_events(self, rows, waves, ages, outcomeTypes, fatal):
+        """Adds events to the log (see EventLog.add) and counts them."""
+        self.events.add(rows, waves, ages, outcomeTypes, fatal)
+        self._count_events(slice(self.events.n - len(np.atleast_1d(rows)), self.events.n), 1)
+
+    def remove_events(self, eventIds):
+        self._count_events(eventIds, -1)
+        self.events.remove(eventIds)
+
+    def _count_events(self, eventIds, change):
+        rows = self.events.column('row')[eventIds]
+        types = self.events.column('type')[eventIds]
+        for code, outcomeType in enumerate(EventLog.outcomeTypes):
+            np.add.at(self._outcomeCounts[outcomeType.value], rows[types == code], change)
+
+    def get_random_effect(self, name, row):
+        value = self._randomEffects[name][row]
+        if np.isnan(value):
+            raise KeyError(name)
+        return value.item()
+
+    def set_random_effect(self, name, row, value):
+        if name not in self._randomEffects:
+            raise KeyError(f"Population state has no random effect: {name}")
+        self._randomEffects[name][row] = value
+
+    # columnar accessors, used by population-level code
+
+    def _rows(self, rows):
+        return np.arange(self.n) if rows is None else np.asarray(rows)
+
+    def lengths(self, name):
+        return self._lengths[name]
+
+    def static(self, name):
+        return self._static[name]
+
+    def outcome_count(self, name):
+        return self._outcomeCounts[name]
+
+    def random_effect(self, name, rows=None):
+        values = self._randomEffects[name]
+        return values if rows is None else values[rows]
+
+    def set_random_effects_batch(self, randomEffects, rows):
+        """Sets random effects given as a dictionary of arrays with one value per row."""
+        for name, values in randomEffects.items():
+            self._randomEffects[name][rows] = values
+
+    def has_random_effects(self, rows=None):
+        rows = self._rows(rows)
+        return np.any([~np.isnan(values[rows]) for values in self._randomEffects.values()],
+                      axis=0)
+
+    def history(self, name, rows=None):
+        """Returns the histories of an attribute as a masked (people x waves) array."""
+        rows = self._rows(rows)
+        lengths = self._lengths[name][rows]
+        width = max(int(lengths.max()), 1) if len(rows) > 0 else 1
+        values = self._columns(name, rows, width)
+        return np.ma.masked_array(values, mask=np.arange(width) >= lengths[:, None])
+
+    def model_argument(self, name, rows=None):
+        """
+        Returns the values a model sees for an attribute: the (masked) history for attributes
+        that change over time, and a single column for everything else.
+        """
+        rows = self._rows(rows)
+        if name in self._history:
+            return self.history(name, rows)
+        elif name in self._static:
+            return self._static[name][rows]
+        elif name in PopulationState.derivedAttributes:
+            return PopulationState.derivedAttributes[name](self, rows)
+        raise AttributeError(f"Population state has no attribute: {name}")
+
+    @staticmethod
+    def _aggregate_values(function, values):
+        aggregateFunction = PopulationState.aggregateFunctions[function]
+        if aggregateFunction is None:
+            return values
+        # e.g. the log of a zero in a history that no model takes the log of
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return aggregateFunction(values)
+
+    def _recompute_aggregates(self, name, rows=None, functions=None):
+        """Recalculates the running aggregates of an attribute from the stored histories."""
+        rows = self._rows(rows)
+        history = self.history(name, rows).astype(np.float64)
+        functions = self._sums[name].keys() if functions is None else functions
+        with np.errstate(divide='ignore', invalid='ignore'):
+            for function in functions:
+                # add the waves up one at a time, in the same order as values are appended, so
+                # that recalculated sums are identical to the ones kept as values are appended
+                sums = np.zeros(len(rows))
+                for wave in range(history.shape[1]):
+                    sums += PopulationState._aggregate_values(function, history[:, wave]).filled(0)
+                self._sums[name][function][rows] = sums
+        self._maxima[name][rows] = history.max(axis=1).filled(-np.inf)
+
+    def running_sum(self, name, rows=None, function='identity'):
+        """
+        Returns the sum of (a function of) each history, e.g. running_sum('sbp', function='log')
+        is the sum of the log of each person's sbp history.
+        """
+        if function not in self._sums[name]:
+            self._sums[name][function] = np.zeros(self.n)
+            self._recompute_aggregates(name, functions=[function])
+        sums = self._sums[name][function]
+        return sums if rows is None else sums[rows]
+
+    def keep_all_aggregates(self):
+        """
+        Starts keeping every kind of running sum for every history. Sums are otherwise added the
+        first time they are asked for, which doesn't work once the arrays are shared with other
+        processes.
+        """
+        for name in self._sums:
+            for function in PopulationState.aggregateFunctions:
+                self.running_sum(name, function=function)
+
+    def running_mean(self, name, rows=None, function='identity'):
+        lengths = self._lengths[name]
+        return self.running_sum(name, rows, function) / \
+            (lengths if rows is None else lengths[rows])
+
+    def running_max(self, name, rows=None):
+        maxima = self._maxima[name]
+        return maxima if rows is None else maxima[rows]
+
+    def baseline(self, name, rows=None):
+        values = (self._frozen[name] + [self._history[name]])[0][:, 0]
+        return values if rows is None else values[rows]
+
+    def current(self, name, rows=None):
+        """Returns the most recent value of an attribute for every person (or for `rows`)."""
+        rows = self._rows(rows)
+        lengths = self._lengths[name][rows]
+        # people without any values for an attribute (e.g. gcp before the first wave) get the
+        # default value for the column
+        return np.where(lengths > 0,
+                        self._gather(name, rows, np.maximum(lengths - 1, 0)),
+                        np.zeros(1, dtype=self._history[name].dtype))
+
+    def value_at(self, name, index, rows=None):
+        """Returns the value of an attribute at a given index for every person (or `rows`)."""
+        rows = self._rows(rows)
+        return self._gather(name, rows, index)
+
+    def append(self, name, values, rows=None):
+        """Appends one value per person (or per entry in `rows`) to an attribute's history."""
+        rows = self._rows(rows)
+        if len(rows) == 0:
+            return
+        self._fit_dtype(name, values)
+        lengths = self._lengths[name][rows]
+        self._ensure_capacity(name, lengths.max() + 1)
+        columns = lengths - self._own_columns(name, lengths)
+        self._history[name][rows, columns] = values
+        self._lengths[name][rows] = lengths + 1
+        stored = self._history[name][rows, columns]
+        for function, sums in self._sums[name].items():
+            sums[rows] += PopulationState._aggregate_values(function, stored)
+        self._maxima[name][rows] = np.maximum(self._maxima[name][rows], stored)
+
+    def snapshot_lengths(self):
+        return {name: lengths.copy() for name, lengths in self._lengths.items()}
+
+    def appended_since(self, lengths):
+        """
+        Returns the values appended to every history since `lengths` (from snapshot_lengths), as
+        {name: (rows, values)} with a row repeated for every value that was appended to it.
+        """
+        appended = {}
+        for name in self._history:
+            counts = np.maximum(self._lengths[name] - lengths[name], 0)
+            if not np.any(counts):
+                continue
+            rows = np.repeat(np.arange(self.n), counts)
+            # index of each value among the values appended to its row
+            offsets = np.arange(len(rows)) - np.repeat(np.cumsum(counts) - counts, counts)
+            appended[name] = (rows, self._gather(name, rows, lengths[name][rows] + offsets))
+        return appended
+
+    def extend(self, appended, rows=None):
+        """
+        Appends values returned by appended_since for another state, where `rows` maps the rows
+        of that state to rows of this one.
+        """
+        for name, (appendedRows, values) in appended.items():
+            targetRows = appendedRows if rows is None else np.asarray(rows)[appendedRows]
+            # rows can have more than one value, so append the first remaining value for each row
+            # until all of them are appended
+            while len(targetRows) > 0:
+                _, first = np.unique(targetRows, return_index=True)
+                self.append(name, values[first], targetRows[first])
+                remaining = np.ones(len(targetRows), dtype=bool)
+                remaining[first] = False
+                targetRows, values = targetRows[remaining], values[remaining]
+
+    def set_current(self, name, values, rows=None):
+        """Overwrites the most recent value of an attribute for every person (or `rows`)."""
+        rows = self._rows(rows)
+        self._fit_dtype(name, values)
+        columns = self._lengths[name][rows] - 1
+        self._history[name][rows, columns - self._own_columns(name, columns)] = values
+        self._recompute_aggregates(name, rows)
+
+    def alive_at_start_of_wave(self, wave):
+        """Columnar version of Person.alive_at_start_of_wave — returns a mask over all people."""
+        aliveLengths = self._lengths['alive']
+        currentlyAlive = self.current('alive')
+        if np.any(currentlyAlive & (wave > self._lengths['age'])):
+            raise Exception(
+                f"Trying to find status for a wave: {wave} beyond current wave")
+        # people that died before the wave are still dead. everyone else has a status recorded
+        # at the end of the prior wave
+        index = np.clip(wave - 1 if wave > 0 else aliveLengths + wave - 1, 0, aliveLengths - 1)
+        aliveAtStart = self._gather('alive', np.arange(self.n), index)
+        return np.where(~currentlyAlive & (wave > aliveLengths - 1), False, aliveAtStart)
+
+    def take(self, rows):
+        """Returns a new state holding copies of the given rows."""
+        rows = np.asarray(rows, dtype=np.int64)
+        subset = PopulationState.__new__(PopulationState)
+        subset.n = len(rows)
+        subset._history = {name: self._columns(name, rows, self._capacity(name))
+                           for name in self._history}
+        subset._frozen = {name: [] for name in self._history}
+        subset._lengths = {name: lengths[rows] for name, lengths in self._lengths.items()}
+        subset._static = {name: values[rows] for name, values in self._static.items()}
+        subset._outcomeCounts = {name: counts[rows]
+                                 for name, counts in self._outcomeCounts.items()}
+        subset.events = self.events.take(rows)
+        subset._randomEffects = {name: values[rows]
+                                 for name, values in self._randomEffects.items()}
+        subset.randomStreams = self.randomStreams
+        subset._sums = {name: {function: sums[rows] for function, sums in sumsByFunction.items()}
+                        for name, sumsByFunction in self._sums.items()}
+        subset._maxima = {name: maxima[rows] for name, maxima in self._maxima.items()}
+        return subset
+
+    @staticmethod
+    def from_rows(sources, waves=1):
+        """
+        Builds a state from (state, row) pairs, copying each row in order.
+
+        Rows that come from the same source state are copied together.
+        """
+        state = PopulationState(len(sources), waves)
+        rowsBySource = {}
+        for index, (source, row) in enumerate(sources):
+            rowsBySource.setdefault(id(source), (source, [], []))
+            rowsBySource[id(source)][1].append(index)
+            rowsBySource[id(source)][2].append(row)
+
+        for source, targetRows, sourceRows in rowsBySource.values():
+            state._copy_rows_from(source, np.array(targetRows), np.array(sourceRows))
+        return state
+
+    def _copy_rows_from(self, source, targetRows, sourceRows):
+        for name in source._history:
+            values = source._columns(name, sourceRows, source._capacity(name))
+            self._fit_dtype(name, values)
+            self._ensure_capacity(name, values.shape[1])
+            self._thaw(name)
+            self._history[name][targetRows, :values.shape[1]] = values
+            self._lengths[name][targetRows] = source._lengths[name][sourceRows]
+        for name, values in source._static.items():
+            self._static[name][targetRows] = values[sourceRows]
+        for name, counts in source._outcomeCounts.items():
+            self._outcomeCounts[name][targetRows] = counts[sourceRows]
+        self.events.copy_rows_from(source.events, targetRows, sourceRows)
+        for name, values in source._randomEffects.items():
+            self._randomEffects[name][targetRows] = values[sourceRows]
+        for name, sumsByFunction in self._sums.items():
+            self._maxima[name][targetRows] = source._maxima[name][sourceRows]
+            for function, sums in sumsByFunction.items():
+                if function in source._sums[name]:
+                    sums[targetRows] = source._sums[name][function][sourceRows]
+                else:
+                    self._recompute_aggregates(name, targetRows)
+
+
+class CounterfactualState:
+    """
+    Read-only view of a PopulationState with a second copy of every person, in which the most
+    recent values of some attributes are shifted (e.g. by minus the effect of a treatment).
+
+    Rows 0 to n - 1 of the view are the people as they are, rows n to 2n - 1 are the same people
+    with the shifts applied. Batch models can evaluate risks for rows and for rows + n in one
+    call, without changing the state. The view supports the accessors that batch models read.
+    """
+
+    def __init__(self, state, shifts):
+        self._state = state
+        self._shifts = shifts
+        self.n = 2 * state.n
+        self.randomStreams = state.randomStreams
+        self.missingStaticValue = state.missingStaticValue
+
+    def counterfactual_rows(self, rows):
+        return np.asarray(rows) + self._state.n
+
+    def _split(self, rows):
+        """The rows of the underlying state and whether each row is a shifted copy."""
+        rows = np.arange(self.n) if rows is None else np.asarray(rows)
+        return rows % self._state.n, rows >= self._state.n
+
+    def _shift(self, name, shifted):
+        return np.where(shifted, self._shifts.get(name, 0), 0)
+
+    def lengths(self, name):
+        return np.tile(self._state.lengths(name), 2)
+
+    def static(self, name):
+        return np.tile(self._state.static(name), 2)
+
+    def outcome_count(self, name):
+        return np.tile(self._state.outcome_count(name), 2)
+
+    def random_effect(self, name, rows=None):
+        stateRows, _ = self._split(rows)
+        return self._state.random_effect(name, stateRows)
+
+    def current(self, name, rows=None):
+        stateRows, shifted = self._split(rows)
+        values = self._state.current(name, stateRows)
+        if name not in self._shifts:
+            return values
+        return np.where(shifted, values + self._shifts[name], values)
+
+    def baseline(self, name, rows=None):
+        stateRows, shifted = self._split(rows)
+        values = self._state.baseline(name, stateRows)
+        # the baseline is the most recent value for people that haven't been advanced yet
+        return np.where(shifted & (self._state.lengths(name)[stateRows] == 1),
+                        values + self._shift(name, shifted), values)
+
+    def history(self, name, rows=None):
+        stateRows, shifted = self._split(rows)
+        values = self._state.history(name, stateRows)
+        if name not in self._shifts or not np.any(shifted):
+            return values
+        values = values.copy()
+        lastIndex = self._state.lengths(name)[stateRows] - 1
+        values[shifted, lastIndex[shifted]] += self._shifts[name]
+        return values
+
+    def running_sum(self, name, rows=None, function='identity'):
+        stateRows, shifted = self._split(rows)
+        sums = self._state.running_sum(name, stateRows, function)
+        if name not in self._shifts:
+            return sums
+        # as if the most recent value had been changed with set_value
+        previous = self._state.current(name, stateRows).astype(np.float64)
+        stored = (previous + self._shifts[name]).astype(self._state._history[name].dtype)
+        change = PopulationState._aggregate_values(function, stored.astype(np.float64)) - \
+            PopulationState._aggregate_values(function, previous)
+        return np.where(shifted, sums + change, sums)
+
+    def running_mean(self, name, rows=None, function='identity'):
+        stateRows, _ = self._split(rows)
+        return self.running_sum(name, rows, function) / self._state.lengths(name)[stateRows]
+
+    def running_max(self, name, rows=None):
+        stateRows, shifted = self._split(rows)
+        maxima = self._state.running_max(name, stateRows)
+        if name not in self._shifts or not np.any(shifted):
+            return maxima
+        return np.where(shifted, self.history(name, rows).max(axis=1).filled(-np.inf), maxima)
+
+    def model_argument(self, name, rows=None):
+        rows = np.arange(self.n) if rows is None else np.asarray(rows)
+        if name in PopulationState.historyAttributes:
+            return self.history(name, rows)
+        elif name in PopulationState.staticAttributes:
+            return self.static(name)[rows]
+        elif name in PopulationState.derivedAttributes:
+            return PopulationState.derivedAttributes[name](self, rows)
+        raise AttributeError(f"Population state has no attribute: {name}")
+
+
+class PersonHistory:
+    """
+    List-like view over one person's history for a single attribute of a PopulationState.
+
+    Supports the list operations the simulation relies on (indexing, slicing, assignment,
+    append, pop, len, iteration and equality) so that code written against the original
+    list-based Person keeps working.
+    """
+
+    __slots__ = ('_state', '_name', '_row')
+
+    def __init__(self, state, name, row):
+        self._state = state
+        self._name = name
+        self._row = row
+
+    def __len__(self):
+        return self._state.get_length(self._name, self._row)
+
+    def __getitem__(self, index):
+        values = self._state.get_row(self._name, self._row)
+        if isinstance(index, slice):
+            return values[index].tolist()
+        return values[index].item()
+
+    def __setitem__(self, index, value):
+        self._state.set_value(self._name, self._row, index, value)
+
+    def __iter__(self):
+        return iter(self._state.get_row(self._name, self._row).tolist())
+
+    def __array__(self, dtype=None, copy=None):
+        return np.array(self._state.get_row(self._name, self._row), dtype=dtype)
+
+    def append(self, value):
+        self._state.append_value(self._name, self._row, value)
+
+    def mean(self):
+        """Mean of the history, from the running aggregates of the state."""
+        return self._state.running_mean(self._name, self._row)
+
+    def max(self):
+        return self._state.running_max(self._name, self._row)
+
+    def pop(self):
+        return self._state.pop_value(self._name, self._row)
+
+    def __eq__(self, other):
+        if isinstance(other, (PersonHistory, list, tuple)):
+            return list(self) == list(other)
+        return NotImplemented
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        return result if result is NotImplemented else not result
+
+    __hash__ = None
+
+    def __repr__(self):
+        return repr(list(self))
+
+
+class PersonRandomEffects(MutableMapping):
+    """Dictionary-like view over one person's random effects in a PopulationState."""
+
+    __slots__ = ('_state', '_row')
+
+    def __init__(self, state, row):
+        self._state = state
+        self._row = row
+
+    def __getitem__(self, name):
+        if name not in self._state._randomEffects:
+            raise KeyError(name)
+        return self._state.get_random_effect(name, self._row)
+
+    def __setitem__(self, name, value):
+        self._state.set_random_effect(name, self._row, value)
+
+    def __delitem__(self, name):
+        self[name]
+        self._state.set_random_effect(name, self._row, np.nan)
+
+    def __iter__(self):
+        return iter([name for name, values in self._state._randomEffects.items()
+                     if not np.isnan(values[self._row])])
+
+    def __len__(self):
+        return len(list(iter(self)))
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
+class HistoryAttribute:
+    """Descriptor that exposes a column of the person's PopulationState as a list-like history."""
+
+    def __init__(self, name):
+        self.name = name
+
+    def __get__(self, person, owner):
+        if person is None:
+            return self
+        return PersonHistory(person._state, self.name, person._row)
+
+    def __set__(self, person, values):
+        person._state.set_history(self.name, person._row, values)
+
+
+class StaticAttribute:
+    """Descriptor that exposes a baseline-only attribute stored in the person's PopulationState."""
+
+    def __init__(self, name, enumType=None):
+        self.name = name
+        self.enumType = enumType
+
+    def __get__(self, person, owner):
+        if person is None:
+            return self
+        value = person._state.get_static(self.name, person._row)
+        if self.enumType is not None and value is not None:
+            # values that aren't part of the enumeration are passed through as plain ints
+            return self.enumType._value2member_map_.get(value, value)
+        return value
+
+    def __set__(self, person, value):
+        person._state.set_static(self.name, person._row, value)
@@ -0,0 +1,183 @@
+import copy
+import multiprocessing
+
+import numpy as np
+import pandas as pd
+import scipy.special as scipySpecial
+from scipy.stats import qmc
+
+from microsim.outcome_model_type import OutcomeModelType
+from microsim.statsmodel_linear_risk_factor_model import StatsModelLinearRiskFactorModel
+
+
+def standard_normal_draws(numberOfDraws, dimensions, method="montecarlo", seed=None):
+    """
+    A (numberOfDraws, dimensions) array of independent standard normal draws, sampled by plain
+    Monte Carlo ("montecarlo"), a Latin hypercube ("lhs") or a scrambled Sobol sequence ("sobol").
+    The quasi random methods cover the space more evenly, Sobol sequences are best balanced
+    when the number of draws is a power of 2.
+    """
+    if method == "montecarlo":
+        return np.random.default_rng(seed).standard_normal((numberOfDraws, dimensions))
+    if method == "lhs":
+        uniforms = qmc.LatinHypercube(d=dimensions, seed=seed).random(numberOfDraws)
+    elif method == "sobol":
+        uniforms = qmc.Sobol(d=dimensions, scramble=True, seed=seed).random(numberOfDraws)
+    else:
+        raise ValueError(f"Unknown sampling method: {method}")
+    # scrambled points are never exactly 0 or 1 in practice, but a single one would be infinite
+    return scipySpecial.ndtri(np.clip(uniforms, 1e-12, 1 - 1e-12))
+
+
+def uncertain_models(population):
+    """
+    The regression models of a population whose coefficients are uncertain, by name: the cohort
+    risk factor models, the ASCVD models, the non CV mortality (Cox) model and the model that
+    splits CV events into strokes and MIs.
+    """
+    models = {}
+    for name, model in population._risk_model_repository._repository.items():
+        models[f"riskFactor.{name}"] = model
+    outcomeRepository = population._outcome_model_repository
+    for gender, model in outcomeRepository._models[OutcomeModelType.CARDIOVASCULAR].items():
+        models[f"cv.{gender}"] = model
+    models["nonCVMortality"] = outcomeRepository._models[OutcomeModelType.NON_CV_MORTALITY]
+    models["strokePartition"] = \
+        outcomeRepository.get_cv_outcome_determination().get_stroke_partition_model()
+    return {name: model for name, model in models.items()
+            if isinstance(model, StatsModelLinearRiskFactorModel)}
+
+
+def with_coefficients(model, coefficients):
+    """A copy of a model with some of its coefficients replaced."""
+    model = copy.copy(model)
+    model.parameters = {**model.parameters, **coefficients}
+    model.non_intercept_params = {name: value for name, value in model.parameters.items()
+                                  if name != 'Intercept'}
+    # the generated predictor has the old coefficients built in
+    model.invalidate_compiled_linear_predictor()
+    return model
+
+
+class ProbabilisticSensitivityAnalysis:
+    """
+    Propagates the uncertainty in the model coefficients to the outcomes of a population.
+
+    Each coefficient with a positive standard error is drawn from a normal distribution around
+    its estimate, independently of the others, once per draw. Every draw then simulates a clone of
+    the population (see Population.clone) with its own coefficients. The population needs a
+    random seed, so that all of the draws use the same random numbers for the same person and
+    the spread of the outcomes across draws is due to the coefficients.
+
+    standardErrors supplies (or replaces) standard errors by model and coefficient, e.g.
+    {'cv.male': {'lagSbp': 0.002}}, for models that were published without them like the
+    ASCVD models.
+    """
+
+    def __init__(self, population, numberOfDraws, method="montecarlo", seed=None,
+                 standardErrors=None):
+        if population._state.randomStreams is None:
+            raise ValueError("Draws need common random numbers, set a random seed first")
+        self._population = population
+        standardErrors = {} if standardErrors is None else standardErrors
+        self.parameters = []
+        for name, model in uncertain_models(population).items():
+            modelErrors = {**model.standard_errors, **standardErrors.get(name, {})}
+            for coeff_name, value in model.parameters.items():
+                if modelErrors.get(coeff_name, 0) > 0:
+                    self.parameters.append((name, coeff_name, value, modelErrors[coeff_name]))
+        columns = pd.MultiIndex.from_tuples([parameter[:2] for parameter in self.parameters],
+                                            names=['model', 'coefficient'])
+        estimates = np.array([parameter[2] for parameter in self.parameters], dtype=np.float64)
+        standardErrors = np.array([parameter[3] for parameter in self.parameters],
+                                  dtype=np.float64)
+        normals = standard_normal_draws(numberOfDraws, len(self.parameters), method, seed)
+        # one row of coefficients per draw
+        self.draws = pd.DataFrame(estimates + standardErrors * normals, columns=columns)
+
+    def population_for_draw(self, draw):
+        """A clone of the population that uses the coefficients of draw."""
+        coefficientsByModel = {}
+        for (name, coeff_name), value in self.draws.iloc[draw].items():
+            coefficientsByModel.setdefault(name, {})[coeff_name] = value
+        models = uncertain_models(self._population)
+
+        branch = self._population.clone()
+        riskRepository = copy.copy(branch._risk_model_repository)
+        riskRepository._repository = dict(riskRepository._repository)
+        outcomeRepository = copy.copy(branch._outcome_model_repository)
+        outcomeRepository._models = dict(outcomeRepository._models)
+        outcomeRepository._models[OutcomeModelType.CARDIOVASCULAR] = dict(
+            outcomeRepository._models[OutcomeModelType.CARDIOVASCULAR])
+        for name, coefficients in coefficientsByModel.items():
+            model = with_coefficients(models[name], coefficients)
+            group, _, key = name.partition(".")
+            if group == "riskFactor":
+                riskRepository._repository[key] = model
+            elif group == "cv":
+                outcomeRepository._models[OutcomeModelType.CARDIOVASCULAR][key] = model
+            elif group == "nonCVMortality":
+                outcomeRepository._models[OutcomeModelType.NON_CV_MORTALITY] = model
+            elif group == "strokePartition":
+                outcomeRepository.stroke_partition_model = model
+        branch._risk_model_repository = riskRepository
+        branch._outcome_model_repository = outcomeRepository
+        return branch
+
+    def run_draw(self, draw, years):
+        """Simulates a draw for years and returns its outcomes, see summarize_population."""
+        population = self.population_for_draw(draw)
+        population.advance_vectorized(years)
+        return summarize_population(population)
+
+    def run(self, years, processes=1):
+        """
+        Simulates every draw for years and returns a data frame with the outcomes of each draw.
+        Draws are simulated across a pool of processes if processes > 1, each draw depends only
+        on its coefficients so the results don't depend on the number of processes.
+        """
+        draws = range(len(self.draws))
+        if processes > 1:
+            with multiprocessing.Pool(processes, initializer=_set_analysis,
+                                      initargs=(self, years)) as pool:
+                outcomes = pool.map(_run_draw, draws,
+                                    chunksize=max(1, len(self.draws) // (4 * processes)))
+        else:
+            outcomes = [self.run_draw(draw, years) for draw in draws]
+        results = pd.DataFrame(outcomes)
+        results.index.name = 'draw'
+        return results
+
+    @staticmethod
+    def summarize(results):
+        """The mean, standard deviation and 95% uncertainty interval of each outcome."""
+        return pd.DataFrame({'mean': results.mean(),
+                             'standardDeviation': results.std(ddof=1),
+                             'lowerBound': results.quantile(0.025),
+                             'upperBound': results.quantile(0.975)})
+
+
+def summarize_population(population):
+    """Outcomes of a simulated population, summed or averaged over the people."""
+    people = population.get_people_current_state_as_dataframe()
+    return {'deaths': int(people.dead.sum()),
+            'miEvents': int(people.miInSim.sum()),
+            'strokeEvents': int(people.strokeInSim.sum()),
+            'personYears': int(people.totalYearsInSim.sum()),
+            'meanSbp': float(people.sbp.mean()),
+            'meanDbp': float(people.dbp.mean())}
+
+
+# the analysis of the worker processes in ProbabilisticSensitivityAnalysis.run, sent once per
+# worker rather than once per draw
+_workerAnalysis = None
+
+
+def _set_analysis(analysis, years):
+    global _workerAnalysis
+    _workerAnalysis = (analysis, years)
+
+
+def _run_draw(draw):
+    analysis, years = _workerAnalysis
+    return analysis.run_draw(draw, years)
@@ -0,0 +1,139 @@
+import zlib
+
+import numpy as np
+import scipy.special as scipySpecial
+
+
+class RandomStreams:
+    """
+    Counter-based random numbers for the simulation.
+
+    Every draw is a pure function of (seed, person, wave, stage), where the stage names the
+    place in the simulation that makes the draw (e.g. "cvEvent"). Draws don't depend on the
+    order people are processed in or on how many people are drawn for at once, so advancing a
+    population one person at a time, in worker processes or over whole columns gives the same
+    trajectories for the same seed.
+
+    The seed is turned into a key with numpy's SeedSequence, and each (person, wave, stage)
+    counter is hashed with the key by a splitmix64 finalizer, which can be evaluated for all
+    people in a wave at once (constructing a Generator per person and draw is far too slow).
+    """
+
+    _stageIds = {}
+
+    def __init__(self, seed):
+        self.seed = seed
+        self._key = np.random.SeedSequence(seed).generate_state(1, dtype=np.uint64)[0]
+
+    @staticmethod
+    def get_stage_id(stage):
+        if stage not in RandomStreams._stageIds:
+            RandomStreams._stageIds[stage] = np.uint64(zlib.crc32(stage.encode("utf-8")))
+        return RandomStreams._stageIds[stage]
+
+    @staticmethod
+    def _mix(values):
+        values = (values ^ (values >> np.uint64(30))) * np.uint64(0xbf58476d1ce4e5b9)
+        values = (values ^ (values >> np.uint64(27))) * np.uint64(0x94d049bb133111eb)
+        return values ^ (values >> np.uint64(31))
+
+    def random_bits(self, stage, personIds, waves):
+        """Returns 64 random bits for each (person, wave) pair for the given stage."""
+        personIds = np.atleast_1d(np.asarray(personIds)).astype(np.uint64)
+        waves = np.atleast_1d(np.asarray(waves)).astype(np.uint64)
+        bits = RandomStreams._mix(np.array([self._key ^ RandomStreams.get_stage_id(stage)]))
+        bits = RandomStreams._mix(bits ^ personIds)
+        return RandomStreams._mix(bits ^ waves)
+
+    def uniform(self, stage, personIds, waves):
+        """Uniform draws on [0, 1), one per (person, wave) pair."""
+        return (self.random_bits(stage, personIds, waves) >> np.uint64(11)) * 2.0**-53
+
+    def normal(self, stage, personIds, waves, loc=0.0, scale=1.0):
+        # the inverse normal CDF needs draws on the open interval (0, 1)
+        uniform = ((self.random_bits(stage, personIds, waves) >> np.uint64(11)) + 0.5) * 2.0**-53
+        return loc + scale * scipySpecial.ndtri(uniform)
+
+
+def worker_random_streams(state):
+    """
+    The random streams for the worker processes that advance a state: its own streams, or for
+    a state without any, streams seeded by a single draw from numpy's global random state. All of
+    the workers draw from the same streams, so the trajectories don't depend on how the people
+    are split between the workers.
+    """
+    if state.randomStreams is not None:
+        return state.randomStreams
+    return RandomStreams(int(np.random.randint(np.iinfo(np.int32).max)))
+
+
+# the functions below are how models make random draws. people (or population states) that
+# don't have random streams, i.e. populations without a random seed, use numpy's global random
+# state as before, so np.random.seed still makes their runs reproducible. worker processes don't
+# share that state, so worker pools give them worker_random_streams instead
+
+def get_stream_keys(state, rows):
+    """Returns the random streams, person ids and current waves for rows of a state."""
+    streams = state.randomStreams
+    if streams is None:
+        return None, None, None
+    personIds = state.static('personId')[rows]
+    if np.any(personIds == state.missingStaticValue):
+        return None, None, None
+    # the wave being simulated is the next index in the age history
+    return streams, personIds, state.lengths('age')[rows]
+
+
+def draw_uniform(person, stage):
+    streams, personIds, waves = get_stream_keys(person._state, [person._row])
+    if streams is None:
+        return np.random.uniform()
+    return streams.uniform(stage, personIds, waves)[0]
+
+
+def draw_uniform_batch(state, rows, stage):
+    streams, personIds, waves = get_stream_keys(state, rows)
+    if streams is None:
+        return np.random.uniform(size=len(rows))
+    return streams.uniform(stage, personIds, waves)
+
+
+def draw_normal(person, stage, loc=0.0, scale=1.0):
+    streams, personIds, waves = get_stream_keys(person._state, [person._row])
+    if streams is None:
+        return np.random.normal(loc, scale)
+    return streams.normal(stage, personIds, waves, loc, scale)[0]
+
+
+def draw_normal_batch(state, rows, stage, loc=0.0, scale=1.0):
+    streams, personIds, waves = get_stream_keys(state, rows)
+    if streams is None:
+        return np.random.normal(loc, scale, size=len(rows))
+    return streams.normal(stage, personIds, waves, loc, scale)
+
+
+def sample_without_replacement_batch(state, rows, weights, k, stage):
+    """
+    Picks k of rows without replacement, each pick with probability proportional to the weights
+    of the rows that are left (like pandas' sample(n=k, weights=weights)).
+
+    Uses exponential keys (Efraimidis and Spirakis): every row gets the key log(u) / weight for
+    a uniform draw u, and the rows with the k largest keys are the sample. That takes one
+    uniform draw per row and a partial sort, rather than k rounds of renormalizing the weights.
+    Returns the picked rows in order of their keys.
+    """
+    rows = np.asarray(rows)
+    weights = np.asarray(weights, dtype=np.float64)
+    if k > len(rows):
+        raise ValueError("Cannot take a larger sample than population when 'replace=False'")
+    if k <= 0:
+        return rows[:0]
+    uniforms = draw_uniform_batch(state, rows, stage)
+    # rows with a zero weight get the smallest possible key, so they are only picked if there
+    # aren't enough other rows
+    keys = np.full(len(rows), -np.inf)
+    positive = weights > 0
+    with np.errstate(divide='ignore'):
+        keys[positive] = np.log(uniforms[positive]) / weights[positive]
+    largest = np.argpartition(-keys, k - 1)[:k]
+    return rows[largest[np.argsort(-keys[largest], kind='stable')]]
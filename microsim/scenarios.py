@@ -0,0 +1,85 @@
+import numpy as np
+import pandas as pd
+
+
+class Scenario:
+    """
+    One arm of a comparison: a BP treatment strategy (see Population.set_bp_treatment_strategy)
+    and attributes of the population to override in that arm, e.g. another outcome model
+    repository.
+    """
+
+    def __init__(self, name, bpTreatmentStrategy=None, overrides=None):
+        self.name = name
+        self.bpTreatmentStrategy = bpTreatmentStrategy
+        self.overrides = {} if overrides is None else overrides
+
+
+class ScenarioSet:
+    """
+    Advances a population under several scenarios in lockstep, so that the scenarios can be
+    compared person by person.
+
+    Each scenario is a clone of the population (see Population.clone), so the people's
+    baseline and the waves simulated before the scenarios were built are stored once and shared
+    by every arm. The population needs a random seed: every draw is then a function of
+    (person, wave, stage) only, so all of the arms use the same random numbers for the same
+    person and the differences between arms are due to the scenarios rather than to Monte
+    Carlo noise.
+    """
+
+    # per-person results that are compared by default, see
+    # Population.get_people_current_state_as_dataframe
+    measures = ['dead', 'miInSim', 'strokeInSim', 'totalYearsInSim', 'sbp', 'dbp']
+
+    def __init__(self, population, scenarios):
+        if population._state.randomStreams is None:
+            raise ValueError("Scenarios need common random numbers, set a random seed first")
+        names = [scenario.name for scenario in scenarios]
+        if len(set(names)) != len(names):
+            raise ValueError(f"Scenario names aren't unique: {names}")
+        self.populations = {}
+        for scenario in scenarios:
+            branch = population.clone()
+            for name, value in scenario.overrides.items():
+                setattr(branch, name, value)
+            if scenario.bpTreatmentStrategy is not None:
+                branch.set_bp_treatment_strategy(scenario.bpTreatmentStrategy)
+            self.populations[scenario.name] = branch
+
+    def advance(self, years):
+        """Advances every scenario by one wave at a time (see Population.advance_vectorized)."""
+        for _ in range(years):
+            for population in self.populations.values():
+                population.advance_vectorized(1)
+
+    def results(self, measures=None):
+        """The per-person results of every scenario, with a column per (scenario, measure)."""
+        measures = ScenarioSet.measures if measures is None else measures
+        return pd.concat(
+            {name: population.get_people_current_state_as_dataframe()[measures].astype(float)
+             for name, population in self.populations.items()}, axis=1)
+
+    def paired_differences(self, reference, measures=None):
+        """
+        Each person's result in every other scenario minus their result in the reference
+        scenario, with a column per (scenario, measure).
+        """
+        results = self.results(measures)
+        return pd.concat({name: results[name] - results[reference]
+                          for name in self.populations if name != reference}, axis=1)
+
+    def compare(self, reference, measures=None):
+        """
+        Mean paired difference from the reference scenario for every other scenario and
+        measure, with its standard error and a 95% confidence interval.
+        """
+        differences = self.paired_differences(reference, measures)
+        n = len(differences)
+        summary = pd.DataFrame({
+            'meanDifference': differences.mean(),
+            'standardError': differences.std(ddof=1) / np.sqrt(n)})
+        summary['lowerBound'] = summary.meanDifference - 1.96 * summary.standardError
+        summary['upperBound'] = summary.meanDifference + 1.96 * summary.standardError
+        summary.index.names = ['scenario', 'measure']
+        return summary
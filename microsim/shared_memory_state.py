@@ -0,0 +1,113 @@
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from microsim.event_log import EventLog
+from microsim.population_state import PopulationState
+
+# the groups of per-person arrays in a PopulationState that are moved into shared memory
+_sharedArrayGroups = ['_history', '_lengths', '_static', '_outcomeCounts', '_randomEffects',
+                      '_maxima']
+
+
+def _state_arrays(state):
+    """Yields (key, array) for every per-person array in a state."""
+    for group in _sharedArrayGroups:
+        for name, values in getattr(state, group).items():
+            yield (group, name), values
+    for name, sumsByFunction in state._sums.items():
+        for function, sums in sumsByFunction.items():
+            yield ('_sums', name, function), sums
+
+
+def _set_state_array(state, key, values):
+    if key[0] == '_sums':
+        state._sums[key[1]][key[2]] = values
+    else:
+        getattr(state, key[0])[key[1]] = values
+
+
+def create_shared_array(values):
+    """Copies an array into a new shared memory block. Returns the block and the shared array."""
+    block = shared_memory.SharedMemory(create=True, size=max(values.nbytes, 1))
+    sharedValues = np.ndarray(values.shape, dtype=values.dtype, buffer=block.buf)
+    sharedValues[...] = values
+    return block, sharedValues
+
+
+def describe_shared_array(block, values):
+    return (block.name, values.shape, values.dtype.str)
+
+
+def attach_shared_array(description):
+    """Opens an array that another process made with create_shared_array."""
+    blockName, shape, dtype = description
+    block = shared_memory.SharedMemory(name=blockName)
+    return block, np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf)
+
+
+def close_blocks(blocks):
+    for block in blocks:
+        try:
+            block.close()
+        except BufferError:
+            # something still has a view on the block, it's released along with the view
+            pass
+
+
+def share_state(state):
+    """
+    Moves the arrays of a state into shared memory, in place. Returns the shared memory blocks
+    and a description of the arrays that attach_state uses to open the state in another process.
+
+    The state can't grow its histories once it is shared, so enough waves need to be reserved
+    first. Every running aggregate is kept from the start, because aggregates that are added
+    later would only exist in the process that added them. Histories that are shared with other
+    branches of the state (see PopulationState.fork) are copied, so that the state's histories
+    are one array each.
+    """
+    state.keep_all_aggregates()
+    state.consolidate()
+    state.shared = True
+    blocks = []
+    descriptions = {}
+    for key, values in list(_state_arrays(state)):
+        block, sharedValues = create_shared_array(values)
+        _set_state_array(state, key, sharedValues)
+        blocks.append(block)
+        descriptions[key] = describe_shared_array(block, sharedValues)
+    return blocks, descriptions
+
+
+def attach_state(descriptions, n, randomStreams):
+    """Opens a state that another process shared with share_state."""
+    state = PopulationState.__new__(PopulationState)
+    state.n = n
+    state.randomStreams = randomStreams
+    state.shared = True
+    # events stay in the parent's log, workers only record them in shared arrays
+    state.events = EventLog()
+    for group in _sharedArrayGroups:
+        setattr(state, group, {})
+    state._sums = {name: {} for name in PopulationState.historyAttributes}
+    state._frozen = {name: [] for name in PopulationState.historyAttributes}
+    blocks = []
+    for key, description in descriptions.items():
+        block, values = attach_shared_array(description)
+        _set_state_array(state, key, values)
+        blocks.append(block)
+    return blocks, state
+
+
+def unshare_state(state):
+    """Copies the arrays of a shared state back into the process's own memory."""
+    for key, values in list(_state_arrays(state)):
+        _set_state_array(state, key, np.array(values))
+    state.shared = False
+
+
+def detach_state(state):
+    """Drops a state's references to its shared arrays, so that the blocks can be closed."""
+    for group in _sharedArrayGroups:
+        getattr(state, group).clear()
+    state._sums.clear()
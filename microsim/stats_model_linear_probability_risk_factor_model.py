@@ -9,5 +9,13 @@ class StatsModelLinearProbabilityRiskFactorModel(StatsModelLinearRiskFactorModel
         linearRisk = super(
             StatsModelLinearProbabilityRiskFactorModel,
             self).estimate_next_risk(person)
-        riskWithResidual = linearRisk + self.draw_from_residual_distribution()
+        riskWithResidual = linearRisk + self.draw_from_residual_distribution(person)
+        return riskWithResidual > 0.5
+
+    def estimate_next_risk_batch(self, state, rows=None):
+        rows = self.get_rows(state, rows)
+        linearRisk = super(
+            StatsModelLinearProbabilityRiskFactorModel,
+            self).estimate_next_risk_batch(state, rows)
+        riskWithResidual = linearRisk + self.draw_from_residual_distribution_batch(state, rows)
         return riskWithResidual > 0.5
@@ -1,5 +1,7 @@
 from microsim.statsmodel_linear_risk_factor_model import StatsModelLinearRiskFactorModel
 
+import numpy as np
+
 
 class StatsModelRoundedLinearRiskFactorModel(StatsModelLinearRiskFactorModel):
     def __init__(self, regression_model):
@@ -8,5 +10,13 @@ class StatsModelRoundedLinearRiskFactorModel(StatsModelLinearRiskFactorModel):
     # apply inverse logit to the linear predictor
     def estimate_next_risk(self, person):
         linearRisk = super(StatsModelRoundedLinearRiskFactorModel, self).estimate_next_risk(person)
-        riskWithResidual = round(linearRisk + self.draw_from_residual_distribution())
+        riskWithResidual = round(linearRisk + self.draw_from_residual_distribution(person))
         return riskWithResidual if riskWithResidual > 0 else 0
+
+    def estimate_next_risk_batch(self, state, rows=None):
+        rows = self.get_rows(state, rows)
+        linearRisk = super(StatsModelRoundedLinearRiskFactorModel,
+                           self).estimate_next_risk_batch(state, rows)
+        riskWithResidual = np.round(
+            linearRisk + self.draw_from_residual_distribution_batch(state, rows))
+        return np.where(riskWithResidual > 0, riskWithResidual, 0)
@@ -1,5 +1,6 @@
 from microsim.statsmodel_linear_risk_factor_model import StatsModelLinearRiskFactorModel
 import numpy as np
+from microsim.random_streams import draw_uniform_batch
 
 
 class StatsModelCoxModel(StatsModelLinearRiskFactorModel):
@@ -8,6 +9,8 @@ class StatsModelCoxModel(StatsModelLinearRiskFactorModel):
         self.one_year_linear_cumulative_hazard = \
             regression_model._one_year_linear_cumulative_hazard
         self.one_year_quad_cumulative_hazard = regression_model._one_year_quad_cumulative_hazard
+        # cumulative hazard over the next year, indexed by years in simulation
+        self._cumulativeHazardByYearsInSim = np.zeros(0)
 
     def get_intercept(self):
         return 0
@@ -27,3 +30,26 @@ class StatsModelCoxModel(StatsModelLinearRiskFactorModel):
 
     def get_risk_for_person(self, person, years):
         return self.get_cumulative_hazard(person) * np.exp(self.linear_predictor(person))
+
+    def get_cumulative_hazard_batch(self, yearsInSim):
+        """
+        Cumulative hazard over the next year for people that have been in the simulation for
+        `yearsInSim` years. The hazard only depends on years in simulation, so it is tabulated
+        once per wave and looked up for everybody.
+        """
+        yearsInSim = np.asarray(yearsInSim, dtype=np.int64)
+        maxYears = int(yearsInSim.max()) + 1 if len(yearsInSim) > 0 else 0
+        if maxYears > len(self._cumulativeHazardByYearsInSim):
+            waves = np.arange(max(maxYears, 2 * len(self._cumulativeHazardByYearsInSim)))
+            self._cumulativeHazardByYearsInSim = self.get_cumulative_hazard_for_interval(
+                waves, waves + 1)
+        return self._cumulativeHazardByYearsInSim[yearsInSim]
+
+    def get_risk_batch(self, state, rows):
+        yearsInSim = state.lengths('age')[rows] - 1
+        return self.get_cumulative_hazard_batch(yearsInSim) * \
+            np.exp(self.estimate_next_risk_batch(state, rows))
+
+    def assign_death_batch(self, state, rows):
+        """Returns a death indicator for each of `rows` for the current wave."""
+        return draw_uniform_batch(state, rows, "nonCVMortality") < self.get_risk_batch(state, rows)
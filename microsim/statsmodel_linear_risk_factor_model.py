@@ -1,12 +1,28 @@
-from functools import reduce
+from functools import reduce, lru_cache
 import numpy as np
-from microsim.model_argument_transform import get_all_argument_transforms
+from microsim.model_argument_transform import get_all_argument_transforms, MeanTransform
+from microsim.population_state import PersonHistory, PopulationState
+from microsim.random_streams import draw_normal, draw_normal_batch
 
 # TODO: this class needs to be renamed. its no longer interfacing with statsmodel
 # conceptually, what it does now is bridge the regression model and the person
 
 INTERACTION_INDICATOR = "#"
 
+
+def last_value(value):
+    if isinstance(value, (list, np.ndarray, PersonHistory)):
+        return value[-1]
+    return value
+
+
+# generated predictors for models loaded from the same spec share their source, so only compile
+# it once
+@lru_cache(maxsize=None)
+def compile_predictor_source(source):
+    return compile(source, "<generated linear predictor>", "exec")
+
+
 class StatsModelLinearRiskFactorModel:
     def __init__(self, regression_model, log_transform=False):
         self.standard_errors = regression_model._coefficient_standard_errors
@@ -21,12 +37,23 @@ class StatsModelLinearRiskFactorModel:
         self.parameters = {**(regression_model._coefficients)}
         self.non_intercept_params = {k: v for k, v in self.parameters.items() if k != 'Intercept'}
         self.argument_transforms = get_all_argument_transforms(self.get_keys_for_transforms())
+        self._compiledLinearPredictor = None
+        # names the draws this model makes in the random streams. based on the coefficient names
+        # (not values) so that it is the same for every copy of the model in every process
+        self.random_stage = "model:" + ",".join(sorted(self.parameters))
 
-    # method to be overriden by models that want to, in addition to the risks estimated by 
-    # the regression coefficients loaded from a model, also be able to apply some manual parameters.
+    # method to be overriden by models that want to, in addition to the risks estimated by
+    # the regression coefficients loaded from a model, also be able to apply some manual
+    # parameters.
     def get_manual_parameters(self):
         return {}
 
+    # batch equivalent of get_manual_parameters. the second item in each tuple is a method that
+    # gets the values from a population state (and the rows being evaluated) instead of from a
+    # person.
+    def get_manual_parameters_batch(self):
+        return {}
+
     def get_keys_for_transforms(self):
         keysForTransforms = []
         for key in self.non_intercept_params.keys():
@@ -36,14 +63,23 @@ class StatsModelLinearRiskFactorModel:
                 keysForTransforms.append(key)
         return keysForTransforms
 
-    def draw_from_residual_distribution(self):
+    def draw_from_residual_distribution(self, person):
         if not hasattr(self, "residual_mean") and hasattr(self, "residual_standard_deviation"):
             raise RuntimeError("Cannot draw from residual distribution: model does not have"
                                " residual information")
-        return np.random.normal(
-            loc=self.residual_mean,
-            scale=self.residual_standard_deviation,
-            size=1)[0]
+        return draw_normal(person, self.random_stage, self.residual_mean,
+                           self.residual_standard_deviation)
+
+    def draw_from_residual_distribution_batch(self, state, rows):
+        if not hasattr(self, "residual_mean") and hasattr(self, "residual_standard_deviation"):
+            raise RuntimeError("Cannot draw from residual distribution: model does not have"
+                               " residual information")
+        return draw_normal_batch(state, rows, self.random_stage, self.residual_mean,
+                                 self.residual_standard_deviation)
+
+    @staticmethod
+    def get_rows(state, rows):
+        return np.arange(state.n) if rows is None else np.asarray(rows)
 
     def get_intercept(self):
         return self.parameters['Intercept']
@@ -55,17 +91,128 @@ class StatsModelLinearRiskFactorModel:
             prop_name, transforms = self.argument_transforms[coeff_name]
             prop_value = getattr(person, f"_{prop_name}")
             model_argument = reduce(lambda v, t: t.apply(v), transforms, prop_value)
-        if isinstance(model_argument, list) or isinstance(model_argument, np.ndarray):
+        if isinstance(model_argument, (list, np.ndarray, PersonHistory)):
             model_argument = model_argument[-1]
         return model_argument
-    
+
     def contains_interaction(self, coeff_name):
         return INTERACTION_INDICATOR in coeff_name
 
     def get_interactions(self, coeff_name):
         return coeff_name.split(INTERACTION_INDICATOR)
-    
+
     def estimate_next_risk(self, person):
+        linearPredictor = self.get_compiled_linear_predictor()(person)
+
+        if (self.log_transform):
+            linearPredictor = np.exp(linearPredictor)
+
+        return linearPredictor
+
+    def get_compiled_linear_predictor(self):
+        """
+        Returns a function of a person that computes the linear predictor of the model with the
+        coefficients inlined as constants. It is generated the first time it is asked for and kept
+        until invalidate_compiled_linear_predictor is called (e.g. after changing coefficients).
+        Models whose arguments can't be generated fall back to the interpreted version.
+        """
+        if getattr(self, "_compiledLinearPredictor", None) is None:
+            try:
+                source, namespace = self.get_linear_predictor_source()
+                exec(compile_predictor_source(source), namespace)
+                self._compiledLinearPredictor = namespace["linear_predictor"]
+            except NotImplementedError:
+                self._compiledLinearPredictor = self.linear_predictor_interpreted
+        return self._compiledLinearPredictor
+
+    def invalidate_compiled_linear_predictor(self):
+        self._compiledLinearPredictor = None
+
+    def get_running_mean(self, prop_name, transforms):
+        """
+        Checks whether an argument starts with the mean of a history (or of an elementwise
+        function of a history, e.g. meanLogLagSbp), which the population state keeps running
+        sums for. If it does, returns the name of the aggregate function and the transforms that
+        still have to be applied to the mean.
+        """
+        if prop_name not in PopulationState.historyAttributes:
+            return None
+        for index, transform in enumerate(transforms):
+            if isinstance(transform, MeanTransform):
+                elementwise = transforms[:index]
+                if len(elementwise) == 0:
+                    return 'identity', transforms[index + 1:]
+                if len(elementwise) == 1 and elementwise[0].aggregateFunction is not None:
+                    return elementwise[0].aggregateFunction, transforms[index + 1:]
+                return None
+            if transform.reducesHistory:
+                return None
+        return None
+
+    def get_model_argument_source(self, coeff_name):
+        if coeff_name in self.argument_transforms:
+            prop_name, transforms = self.argument_transforms[coeff_name]
+        else:
+            prop_name, transforms = coeff_name, []
+        if not prop_name.isidentifier():
+            raise NotImplementedError(f"Can't generate an argument for {coeff_name}")
+
+        runningMean = self.get_running_mean(prop_name, transforms)
+        if runningMean is not None:
+            function, transforms = runningMean
+            is_vector = False
+            source = f"state.running_mean({prop_name!r}, row, {function!r})"
+        elif prop_name in PopulationState.historyAttributes:
+            # read straight from the person's row of the population state. histories that are
+            # never reduced only need their last value, which all of the other transforms
+            # commute with
+            is_vector = any(transform.reducesHistory for transform in transforms)
+            source = f"state.get_row({prop_name!r}, row)" + ("" if is_vector else "[-1]")
+        else:
+            is_vector = False
+            source = f"person._{prop_name}"
+
+        for transform in transforms:
+            source = transform.source(source, is_vector)
+            is_vector = is_vector and not transform.reducesHistory
+
+        if is_vector:
+            source = f"{source}[-1]"
+        elif (prop_name not in PopulationState.historyAttributes
+              and prop_name not in PopulationState.staticAttributes
+              and prop_name not in PopulationState.derivedAttributes):
+            # attributes we don't know the shape of are checked at run time
+            source = f"last_value({source})"
+        return source
+
+    def get_linear_predictor_source(self):
+        terms = [repr(float(self.get_intercept()))]
+        for coeff_name, coeff_val in self.non_intercept_params.items():
+            if self.contains_interaction(coeff_name):
+                argument = " * ".join(self.get_model_argument_source(interact)
+                                      for interact in self.get_interactions(coeff_name))
+            else:
+                argument = self.get_model_argument_source(coeff_name)
+            terms.append(f"{float(coeff_val)!r} * ({argument})")
+
+        namespace = {"np": np, "last_value": last_value}
+        for i, (coeff_name, manual_tuple) in enumerate(self.get_manual_parameters().items()):
+            namespace[f"manual{i}"] = manual_tuple[1]
+            terms.append(f"{float(manual_tuple[0])!r} * manual{i}(person)")
+
+        source = "def linear_predictor(person):\n" + \
+            "    state = person._state\n" + \
+            "    row = person._row\n" + \
+            "    return (" + "\n            + ".join(terms) + ")\n"
+        return source, namespace
+
+    def __getstate__(self):
+        # generated functions can't be pickled, they get regenerated on first use
+        state = self.__dict__.copy()
+        state["_compiledLinearPredictor"] = None
+        return state
+
+    def linear_predictor_interpreted(self, person):
         # TODO: think about what to do with teh hard-coded strings for parameters and prefixes
         linearPredictor = self.get_intercept()
 
@@ -77,15 +224,71 @@ class StatsModelLinearRiskFactorModel:
                 model_argument = reduce(lambda x, y: x * y, interactions, 1)
             else:
                 model_argument = self.get_model_argument_for_coeff_name(coeff_name, person)
-            
+
             linearPredictor += coeff_val * model_argument
-        
+
         for coeff_name, manual_tuple in self.get_manual_parameters().items():
-            # the tuple gives one item as the regression coefficent and the second item as a method 
+            # the tuple gives one item as the regression coefficent and the second item as a method
             # to get the values from a person
             linearPredictor += manual_tuple[0] * manual_tuple[1](person)
-        
-        
+
+        return linearPredictor
+
+    def get_model_argument_for_coeff_name_batch(self, coeff_name, state, rows):
+        if coeff_name in self.argument_transforms:
+            prop_name, transforms = self.argument_transforms[coeff_name]
+        else:
+            prop_name, transforms = coeff_name, []
+
+        runningMean = self.get_running_mean(prop_name, transforms)
+        if runningMean is not None:
+            function, transforms = runningMean
+            prop_value = state.running_mean(prop_name, rows, function)
+        elif (prop_name in PopulationState.historyAttributes
+              and not any(transform.reducesHistory for transform in transforms)):
+            prop_value = state.current(prop_name, rows)
+        else:
+            prop_value = state.model_argument(prop_name, rows)
+        model_argument = reduce(lambda v, t: t.apply_batch(v), transforms, prop_value)
+        # histories that haven't been reduced to a single value by a transform use the most
+        # recent value, as in the per-person version
+        if np.ndim(model_argument) == 2:
+            lastIndex = np.ma.count(model_argument, axis=1) - 1
+            model_argument = model_argument[np.arange(len(rows)), lastIndex]
+        return np.ma.getdata(model_argument).astype(np.float64)
+
+    def get_design_matrix_batch(self, state, rows):
+        """Returns one row per person and one column per (non-intercept) coefficient."""
+        columns = []
+        for coeff_name in self.non_intercept_params:
+            if self.contains_interaction(coeff_name):
+                column = np.ones(len(rows))
+                for interact in self.get_interactions(coeff_name):
+                    column = column * self.get_model_argument_for_coeff_name_batch(
+                        interact, state, rows)
+            else:
+                column = self.get_model_argument_for_coeff_name_batch(coeff_name, state, rows)
+            columns.append(column)
+        if len(columns) == 0:
+            return np.zeros((len(rows), 0))
+        return np.column_stack(columns)
+
+    def estimate_next_risk_batch(self, state, rows=None):
+        """
+        Vectorized version of estimate_next_risk: evaluates the model for every person in a
+        PopulationState (or for the given rows) and returns one prediction per person.
+        """
+        rows = self.get_rows(state, rows)
+        # accumulate the terms in the same order as the per-person predictor (rather than with a
+        # matrix product), so that both give bit-identical results
+        linearPredictor = np.full(len(rows), float(self.get_intercept()))
+        designMatrix = self.get_design_matrix_batch(state, rows)
+        for index, coeff_val in enumerate(self.non_intercept_params.values()):
+            linearPredictor += float(coeff_val) * designMatrix[:, index]
+
+        for coeff_name, manual_tuple in self.get_manual_parameters_batch().items():
+            linearPredictor += manual_tuple[0] * manual_tuple[1](state, rows)
+
         if (self.log_transform):
             linearPredictor = np.exp(linearPredictor)
 
@@ -1,6 +1,7 @@
 from microsim.statsmodel_linear_risk_factor_model import StatsModelLinearRiskFactorModel
 
 import numpy as np
+from microsim.random_streams import draw_uniform, draw_uniform_batch
 
 
 class StatsModelLogisticRiskFactorModel(StatsModelLinearRiskFactorModel):
@@ -10,4 +11,12 @@ class StatsModelLogisticRiskFactorModel(StatsModelLinearRiskFactorModel):
     # apply inverse logit to the linear predictor
     def estimate_next_risk(self, person):
         linearRisk = super(StatsModelLogisticRiskFactorModel, self).estimate_next_risk(person)
-        return np.random.rand() < np.exp(linearRisk) / (1 + np.exp(linearRisk))
+        return draw_uniform(person, self.random_stage) < \
+            np.exp(linearRisk) / (1 + np.exp(linearRisk))
+
+    def estimate_next_risk_batch(self, state, rows=None):
+        rows = self.get_rows(state, rows)
+        linearRisk = super(StatsModelLogisticRiskFactorModel,
+                           self).estimate_next_risk_batch(state, rows)
+        return draw_uniform_batch(state, rows, self.random_stage) < \
+            np.exp(linearRisk) / (1 + np.exp(linearRisk))
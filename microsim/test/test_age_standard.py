@@ -0,0 +1,187 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from microsim.age_standard import (build_standard_population_table,
+                                   save_standard_population_table,
+                                   load_standard_population_table, get_age_standard,
+                                   SEERPopulationReader)
+from microsim.population import Population
+from microsim.person import Person
+from microsim.gender import NHANESGender
+from microsim.race_ethnicity import NHANESRaceEthnicity
+from microsim.education import Education
+from microsim.smoking_status import SmokingStatus
+from microsim.alcohol_category import AlcoholCategory
+
+
+def seer_line(year, state, race, sex, ageGroup, population):
+    # year, state, state fips, county fips, registry, race, origin, sex, age group, population
+    sexCode = 1 if sex == 'male' else 2
+    return f"{year}{state}0100199{race}0{sexCode}{ageGroup:02d}{population:08d}\n"
+
+
+class TestAgeStandard(unittest.TestCase):
+    def setUp(self):
+        self._directory = tempfile.mkdtemp()
+        self._seerPath = os.path.join(self._directory, "seer.txt")
+        with open(self._seerPath, "w") as seerFile:
+            seerFile.write(seer_line(1969, "AL", 1, 'male', 1, 999))
+            seerFile.write(seer_line(2016, "AL", 1, 'male', 0, 10))
+            seerFile.write(seer_line(2016, "AK", 2, 'male', 0, 5))
+            seerFile.write(seer_line(2016, "AL", 1, 'female', 1, 20))
+            seerFile.write(seer_line(2016, "AL", 1, 'female', 18, 30))
+            seerFile.write(seer_line(2017, "AL", 1, 'male', 0, 40))
+
+    def tearDown(self):
+        shutil.rmtree(self._directory)
+
+    def testTableHasOnePopulationPerYearAgeGroupAndSex(self):
+        table = build_standard_population_table(self._seerPath)
+        self.assertEqual([2016, 2016, 2016, 2017], table['year'].tolist())
+        self.assertEqual([0, 1, 18, 0], table['ageGroup'].tolist())
+        self.assertEqual([0, 1, 1, 0], table['female'].tolist())
+        self.assertEqual([15, 20, 30, 40], table['standardPopulation'].tolist())
+
+    def testAgeStandardIsLoadedFromTheSavedTable(self):
+        path = os.path.join(self._directory, "standardPopulation.npz")
+        save_standard_population_table(build_standard_population_table(self._seerPath), path)
+        ageStandard = get_age_standard(2016, standardPopulationPath=path)
+        load_standard_population_table.cache_clear()
+
+        self.assertEqual([(0, 0), (1, 1), (18, 1)], list(ageStandard.index))
+        self.assertEqual([0, 1, 85], ageStandard.lowerAgeBound.tolist())
+        self.assertEqual([0, 4, 150], ageStandard.upperAgeBound.tolist())
+        self.assertEqual([15, 20, 30], ageStandard.standardPopulation.tolist())
+        np.testing.assert_array_equal([0, 0, 0], ageStandard.outcomeCount)
+
+    def testReaderIndexesYearsAndSubsetsByStateAndRace(self):
+        reader = SEERPopulationReader(self._seerPath)
+        try:
+            self.assertEqual([1969, 2016, 2017], reader.years())
+            alaska = reader.standard_population(2016, state="AK")
+            self.assertEqual([0], alaska['ageGroup'].tolist())
+            self.assertEqual([5], alaska['standardPopulation'].tolist())
+
+            white = reader.standard_population(2016, race=1)
+            self.assertEqual([10, 20, 30], white['standardPopulation'].tolist())
+            self.assertEqual(0, len(reader.standard_population(2016, race=3)['year']))
+            self.assertEqual(0, len(reader.standard_population(2000)['year']))
+        finally:
+            reader.close()
+
+    def testRecordsThatArentFixedWidthAreRejected(self):
+        with open(self._seerPath, "a") as seerFile:
+            seerFile.write("2017\n")
+        with self.assertRaises(ValueError):
+            SEERPopulationReader(self._seerPath)
+
+    def testSubsetAgeStandardsAreReadFromTheSEERFile(self):
+        ageStandard = get_age_standard(2016, race=1, seerPath=self._seerPath)
+        self.assertEqual([(0, 0), (1, 1), (18, 1)], list(ageStandard.index))
+        self.assertEqual([10, 20, 30], ageStandard.standardPopulation.tolist())
+
+
+class StandardizedPopulation(Population):
+    def __init__(self, people, standardPopulationPath):
+        super().__init__(people)
+        self._standardPopulationPath = standardPopulationPath
+
+    def build_age_standard(self, yearOfStandardizedPopulation):
+        return get_age_standard(yearOfStandardizedPopulation,
+                                standardPopulationPath=self._standardPopulationPath)
+
+
+class TestStandardizedRates(unittest.TestCase):
+    def setUp(self):
+        self._directory = tempfile.mkdtemp()
+        path = os.path.join(self._directory, "standardPopulation.npz")
+        ageGroups = np.repeat(np.arange(19), 2)
+        save_standard_population_table({'year': np.full(38, 2016),
+                                        'ageGroup': ageGroups,
+                                        'female': np.tile([0, 1], 19),
+                                        'standardPopulation': 1000 + 37 * np.arange(38)}, path)
+        people = []
+        for index in range(60):
+            person = Person(
+                age=30 + index, gender=NHANESGender(index % 2 + 1),
+                raceEthnicity=NHANESRaceEthnicity.NON_HISPANIC_WHITE,
+                sbp=120, dbp=80, a1c=6, hdl=50, totChol=213, ldl=90, trig=150, bmi=22, waist=34,
+                anyPhysicalActivity=0, education=Education.COLLEGEGRADUATE,
+                smokingStatus=SmokingStatus.NEVER, alcohol=AlcoholCategory.NONE,
+                antiHypertensiveCount=0, statin=0, otherLipidLoweringMedicationCount=0,
+                initializeAfib=lambda _: False)
+            people.append(person)
+        self._population = StandardizedPopulation(people, path)
+        for wave in range(4):
+            for index, person in enumerate(self._population._people):
+                if person.is_dead():
+                    continue
+                if (index + wave) % 9 == 0:
+                    person._alive.append(False)
+                else:
+                    person._age.append(person._age[-1] + 1)
+                    person._alive.append(True)
+        self._population._totalWavesAdvanced = 4
+
+    def tearDown(self):
+        load_standard_population_table.cache_clear()
+        shutil.rmtree(self._directory)
+
+    def legacy_standardized_events(self, eventSelector, eventAgeIdentifier, people):
+        popDF = self._population.get_people_current_state_as_dataframe()
+        popDF = popDF.loc[[person in people for person in self._population._people]]
+        events = []
+        for year in range(1, 5):
+            peopleDF = pd.DataFrame({
+                'age': popDF.baseAge + year,
+                'female': popDF.gender - 1,
+                'event': [eventSelector(person) and eventAgeIdentifier(person) == year
+                          for person in people]})
+            events.append(self._population.get_standardized_events_for_year(peopleDF, 2016))
+        return events
+
+    def testAllYearsMatchTheYearByYearStandardization(self):
+        def eventSelector(person):
+            return person._personId % 3 == 0
+
+        def eventAgeIdentifier(person):
+            return person._personId % 4 + 1
+
+        expected = self.legacy_standardized_events(eventSelector, eventAgeIdentifier,
+                                                   self._population._people)
+        actual = self._population.calculate_mean_age_sex_standardized_event(
+            eventSelector, eventAgeIdentifier)
+        np.testing.assert_array_almost_equal(expected, actual)
+
+        older = [person for person in self._population._people if person._age[0] >= 60]
+        expected = self.legacy_standardized_events(eventSelector, eventAgeIdentifier, older)
+        actual = self._population.calculate_mean_age_sex_standardized_event(
+            eventSelector, eventAgeIdentifier, subPopulationSelector=lambda x: x._age[0] >= 60)
+        np.testing.assert_array_almost_equal(expected, actual)
+
+    def testRatesForSeveralGroupsInOnePass(self):
+        deathYears = np.where(self._population._state.current('alive'), np.nan,
+                              self._population._state.lengths('age') - 1)
+        ages = self._population._state.baseline('age')
+        rates = self._population.calculate_age_sex_standardized_rates(
+            deathYears, groups=np.where(ages >= 60, "older", "younger"))
+
+        older = [person for person in self._population._people if person._age[0] >= 60]
+        expected = self.legacy_standardized_events(
+            lambda x: x.is_dead(), lambda x: x.years_in_simulation(), older)
+        np.testing.assert_array_almost_equal(expected, rates.loc["older"].to_numpy())
+        self.assertEqual(8, len(rates))
+        self.assertAlmostEqual(
+            np.mean([rate for rate, _ in self.legacy_standardized_events(
+                lambda x: x.is_dead(), lambda x: x.years_in_simulation(),
+                self._population._people)]),
+            self._population.calculate_mean_age_sex_standardized_mortality())
+
+
+if __name__ == "__main__":
+    unittest.main()
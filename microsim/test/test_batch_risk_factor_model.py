@@ -0,0 +1,96 @@
+import unittest
+
+import numpy as np
+
+from microsim.person import Person
+from microsim.population import Population
+from microsim.gender import NHANESGender
+from microsim.race_ethnicity import NHANESRaceEthnicity
+from microsim.education import Education
+from microsim.smoking_status import SmokingStatus
+from microsim.alcohol_category import AlcoholCategory
+from microsim.cohort_risk_model_repository import CohortRiskModelRepository
+from microsim.statsmodel_linear_risk_factor_model import StatsModelLinearRiskFactorModel
+from microsim.outcome_model_repository import OutcomeModelRepository
+from microsim.outcome_model_type import OutcomeModelType
+from microsim.population import initialize_baseline_afib
+from microsim.data_loader import load_model
+from microsim.statsmodel_logistic_risk_factor_model import StatsModelLogisticRiskFactorModel
+
+
+def initializeAfib(person):
+    return False
+
+
+def build_person(age, gender, raceEthnicity, sbp, a1c, smokingStatus):
+    return Person(
+        age=age, gender=gender, raceEthnicity=raceEthnicity,
+        sbp=sbp, dbp=80, a1c=a1c, hdl=50, totChol=213, ldl=90, trig=150,
+        bmi=22, waist=34, anyPhysicalActivity=0, education=Education.COLLEGEGRADUATE,
+        smokingStatus=smokingStatus, alcohol=AlcoholCategory.NONE,
+        antiHypertensiveCount=1, statin=0, otherLipidLoweringMedicationCount=0,
+        initializeAfib=initializeAfib)
+
+
+class TestBatchRiskFactorModel(unittest.TestCase):
+    def setUp(self):
+        people = [
+            build_person(45, NHANESGender.MALE, NHANESRaceEthnicity.NON_HISPANIC_WHITE, 120, 5.5,
+                         SmokingStatus.NEVER),
+            build_person(62, NHANESGender.FEMALE, NHANESRaceEthnicity.NON_HISPANIC_BLACK, 150, 7.0,
+                         SmokingStatus.CURRENT),
+            build_person(75, NHANESGender.MALE, NHANESRaceEthnicity.MEXICAN_AMERICAN, 135, 6.0,
+                         SmokingStatus.FORMER)]
+        # give everybody a history of different lengths
+        people[1]._sbp.append(155)
+        people[1]._a1c.append(6.0)
+        people[2]._sbp.append(130)
+        people[2]._sbp.append(128)
+        self._people = people
+        self._population = Population(people)
+        self._repository = CohortRiskModelRepository()
+
+    def testLinearPredictorMatchesPerPersonModel(self):
+        for riskFactor, model in self._repository._repository.items():
+            batch = StatsModelLinearRiskFactorModel.estimate_next_risk_batch(
+                model, self._population._state)
+            expected = [StatsModelLinearRiskFactorModel.estimate_next_risk(model, person)
+                        for person in self._people]
+            np.testing.assert_allclose(expected, batch, err_msg=riskFactor)
+
+    def testBatchOverSubsetOfRows(self):
+        model = self._repository.get_model("sbp")
+        batch = StatsModelLinearRiskFactorModel.estimate_next_risk_batch(
+            model, self._population._state, rows=[2])
+        self.assertEqual(1, len(batch))
+        self.assertAlmostEqual(
+            StatsModelLinearRiskFactorModel.estimate_next_risk(model, self._people[2]), batch[0])
+
+    def testASCVDBatchMatchesPerPersonModel(self):
+        outcomeRepository = OutcomeModelRepository()
+        for person in self._people:
+            model = outcomeRepository.select_model_for_person(person,
+                                                              OutcomeModelType.CARDIOVASCULAR)
+            batch = model.estimate_next_risk_batch(self._population._state, rows=[person._row])
+            self.assertAlmostEqual(model.estimate_next_risk(person), batch[0])
+
+    def testBaselineAfibIsAssignedInOnePass(self):
+        people = [build_person(40 + i, NHANESGender.MALE, NHANESRaceEthnicity.NON_HISPANIC_WHITE,
+                               120 + i, 5.5, SmokingStatus.NEVER) for i in range(50)]
+        model = load_model("BaselineAFibModel", StatsModelLogisticRiskFactorModel)
+        linearPredictor = np.array([model.linear_predictor_interpreted(person)
+                                    for person in people])
+
+        np.random.seed(1)
+        expected = np.random.rand(len(people)) < \
+            np.exp(linearPredictor) / (1 + np.exp(linearPredictor))
+        np.random.seed(1)
+        initialize_baseline_afib(people)
+
+        self.assertTrue(all(person._state is people[0]._state for person in people))
+        self.assertEqual(expected.tolist(), [person._afib[0] for person in people])
+        self.assertTrue(all(len(person._afib) == 1 for person in people))
+
+
+if __name__ == "__main__":
+    unittest.main()
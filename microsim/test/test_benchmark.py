@@ -0,0 +1,52 @@
+import copy
+import os
+import shutil
+import tempfile
+import unittest
+
+from microsim.benchmark import (BenchmarkFixtures, compare_results, fixture_nhanes,
+                                load_results, person_years, run_benchmarks, save_results)
+
+
+class TestBenchmark(unittest.TestCase):
+    def setUp(self):
+        self._directory = tempfile.mkdtemp()
+        self._fixtures = BenchmarkFixtures(self._directory, numberOfPeople=40, years=2,
+                                           processes=2)
+
+    def tearDown(self):
+        shutil.rmtree(self._directory)
+
+    def testFixturesAreStable(self):
+        self.assertTrue(fixture_nhanes(50, 3).equals(fixture_nhanes(50, 3)))
+        self.assertEqual(person_years(self._fixtures.advanced_population()),
+                         person_years(self._fixtures.advanced_population()))
+
+    def testResultsCanBeSavedAndComparedWithABaseline(self):
+        results = run_benchmarks(self._fixtures, repeats=1,
+                                 names=["advance.vectorized", "buildAgeStandard"])
+        self.assertEqual(["advance.vectorized", "buildAgeStandard", "buildAgeStandard.subset"],
+                         list(results['cases']))
+        vectorized = results['cases']['advance.vectorized']
+        self.assertGreater(vectorized['personYearsPerSecond'], 0)
+        self.assertGreater(vectorized['peakMemory'], 0)
+        self.assertIsNone(results['cases']['buildAgeStandard']['personYearsPerSecond'])
+
+        path = os.path.join(self._directory, "baseline.json")
+        save_results(results, path)
+        baseline = load_results(path)
+        self.assertFalse(compare_results(results, baseline).regressed.any())
+
+        baseline['cases']['buildAgeStandard']['latency'] /= 2
+        comparison = compare_results(results, baseline)
+        self.assertEqual(["buildAgeStandard"],
+                         comparison.index[comparison.regressed].tolist())
+
+        otherSettings = copy.deepcopy(baseline)
+        otherSettings['settings']['numberOfPeople'] = 100
+        with self.assertRaises(ValueError):
+            compare_results(results, otherSettings)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,121 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from microsim.person import Person
+from microsim.population import Population
+from microsim.checkpoint import function_key, has_checkpoint
+from microsim.cohort_risk_model_repository import CohortRiskModelRepository
+from microsim.outcome_model_repository import OutcomeModelRepository
+from microsim.gender import NHANESGender
+from microsim.race_ethnicity import NHANESRaceEthnicity
+from microsim.education import Education
+from microsim.smoking_status import SmokingStatus
+from microsim.alcohol_category import AlcoholCategory
+
+
+def initializeAfib(person):
+    return False
+
+
+def build_population():
+    people = []
+    for index in range(40):
+        people.append(Person(
+            age=50 + index / 2, gender=NHANESGender(index % 2 + 1),
+            raceEthnicity=NHANESRaceEthnicity.NON_HISPANIC_BLACK,
+            sbp=130 + index, dbp=80, a1c=6, hdl=40, totChol=213, ldl=90, trig=150,
+            bmi=30, waist=100, anyPhysicalActivity=0, education=Education.HIGHSCHOOLGRADUATE,
+            smokingStatus=SmokingStatus.CURRENT, alcohol=AlcoholCategory.NONE,
+            antiHypertensiveCount=0, statin=0, otherLipidLoweringMedicationCount=0,
+            initializeAfib=initializeAfib))
+    population = Population(people)
+    population._risk_model_repository = CohortRiskModelRepository()
+    population._outcome_model_repository = OutcomeModelRepository()
+    return population
+
+
+class TestCheckpoint(unittest.TestCase):
+    def setUp(self):
+        self._directory = tempfile.mkdtemp()
+        self._path = os.path.join(self._directory, "checkpoint")
+        self._population = build_population()
+
+    def tearDown(self):
+        shutil.rmtree(self._directory)
+
+    def assert_populations_equal(self, population, other):
+        for name in population._state.historyAttributes:
+            np.testing.assert_array_equal(population._state.history(name),
+                                          other._state.history(name), err_msg=name)
+        for person, otherPerson in zip(population._people, other._people):
+            self.assertEqual(person._outcomes, otherPerson._outcomes)
+            self.assertEqual(person._randomEffects, otherPerson._randomEffects)
+
+    def testResumedSimulationsMatchUninterruptedOnes(self):
+        self._population.set_random_seed(17)
+        self._population.advance_vectorized(2)
+        self._population.save_checkpoint(self._path)
+        resumed = Population.load_checkpoint(self._path)
+        self.assertEqual(2, resumed._totalWavesAdvanced)
+        self.assertEqual(2, resumed._currentWave)
+        self.assertIsInstance(resumed._state._history['sbp'], np.memmap)
+
+        self._population.advance_vectorized(3)
+        resumed.advance_vectorized(3)
+        self.assert_populations_equal(self._population, resumed)
+
+    def testNumpyRandomStateIsRestored(self):
+        np.random.seed(3)
+        self._population.advance(1)
+        self._population.save_checkpoint(self._path)
+        self._population.advance(2)
+        resumed = Population.load_checkpoint(self._path)
+        resumed.advance(2)
+        self.assert_populations_equal(self._population, resumed)
+
+    def testCheckpointsAreSavedEveryKWaves(self):
+        self._population.set_random_seed(17)
+        self._population.checkpoint_every(2, self._path)
+        self._population.advance_vectorized(5)
+        resumed = Population.load_checkpoint(self._path)
+        self.assertEqual(4, resumed._totalWavesAdvanced)
+        resumed.advance_vectorized(1)
+        self.assert_populations_equal(self._population, resumed)
+        self.assertEqual(2, len(os.listdir(self._path)))
+
+    def testClonesArentCheckpointed(self):
+        self._population.set_random_seed(17)
+        self._population.checkpoint_every(1, self._path)
+        branch = self._population.clone()
+        branch.advance_vectorized(2)
+        self.assertFalse(has_checkpoint(self._path))
+        self._population.advance_vectorized(1)
+        self.assertEqual(1, Population.load_checkpoint(self._path)._totalWavesAdvanced)
+
+    def testFailedCheckpointsLeaveThePreviousOne(self):
+        self._population.save_checkpoint(self._path)
+        self._population.advance_vectorized(1)
+        # a lambda can't be pickled
+        self._population._bpTreatmentStrategy = lambda population: None
+        with self.assertRaises(Exception):
+            self._population.save_checkpoint(self._path)
+        self.assertTrue(has_checkpoint(self._path))
+        self.assertEqual(0, Population.load_checkpoint(self._path)._totalWavesAdvanced)
+        self.assertEqual(2, len(os.listdir(self._path)))
+
+    def testFunctionKeysFollowCodeAndClosures(self):
+        def older_than(age):
+            return lambda person: person._age[0] > age
+
+        self.assertEqual(function_key(older_than(50)), function_key(older_than(50)))
+        self.assertNotEqual(function_key(older_than(50)), function_key(older_than(60)))
+        self.assertNotEqual(function_key(lambda person: True), function_key(lambda person: False))
+        self.assertIsNone(function_key(None))
+
+
+if __name__ == "__main__":
+    unittest.main()
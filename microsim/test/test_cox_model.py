@@ -1,4 +1,7 @@
 import unittest
+import copy
+
+import numpy as np
 
 from microsim.person import Person
 from microsim.gender import NHANESGender
@@ -9,6 +12,7 @@ from microsim.statsmodel_cox_model import StatsModelCoxModel
 from microsim.education import Education
 from microsim.data_loader import load_model_spec
 from microsim.alcohol_category import AlcoholCategory
+from microsim.population import Population
 
 
 def initializeAFib(person):
@@ -38,6 +42,25 @@ class TestCoxModel(unittest.TestCase):
             first=0.026299703075722214, second=self.model.get_risk_for_person(
                 self.imputed_dataset_first_person, 1), places=1)
 
+    def test_batch_risk_matches_per_person_risk(self):
+        person = self.imputed_dataset_first_person
+        for year in range(3):
+            person._age.append(person._age[-1] + 1)
+            person._sbp.append(person._sbp[-1] + 5)
+        population = Population([person, copy.deepcopy(person)])
+        population._people[1]._age.pop()
+
+        expected = [self.model.get_risk_for_person(person, 1) for person in population._people]
+        np.testing.assert_array_almost_equal(
+            expected, self.model.get_risk_batch(population._state, np.arange(2)))
+        self.assertNotAlmostEqual(expected[0], expected[1])
+
+    def test_cumulative_hazard_batch_is_tabulated_by_years_in_simulation(self):
+        np.testing.assert_array_almost_equal(
+            [self.model.get_cumulative_hazard_for_interval(years, years + 1)
+             for years in [3, 0, 3, 10]],
+            self.model.get_cumulative_hazard_batch([3, 0, 3, 10]))
+
 
 if __name__ == "__main__":
     unittest.main()
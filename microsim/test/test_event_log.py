@@ -0,0 +1,113 @@
+import unittest
+
+import numpy as np
+
+from microsim.person import Person
+from microsim.population import Population
+from microsim.event_log import EventLog
+from microsim.gender import NHANESGender
+from microsim.race_ethnicity import NHANESRaceEthnicity
+from microsim.education import Education
+from microsim.smoking_status import SmokingStatus
+from microsim.alcohol_category import AlcoholCategory
+from microsim.outcome import Outcome, OutcomeType
+
+
+def build_person(age, selfReportStrokeAge=None):
+    return Person(
+        age=age, gender=NHANESGender.MALE, raceEthnicity=NHANESRaceEthnicity.NON_HISPANIC_WHITE,
+        sbp=120, dbp=80, a1c=6, hdl=50, totChol=213, ldl=90, trig=150, bmi=22, waist=34,
+        anyPhysicalActivity=0, education=Education.COLLEGEGRADUATE,
+        smokingStatus=SmokingStatus.NEVER, alcohol=AlcoholCategory.NONE,
+        antiHypertensiveCount=0, statin=0, otherLipidLoweringMedicationCount=0,
+        initializeAfib=lambda _: False, selfReportStrokeAge=selfReportStrokeAge)
+
+
+def advance_ages(population):
+    for person in population._people:
+        if not person.is_dead():
+            person._age.append(person._age[-1] + 1)
+            person._alive.append(True)
+    population._totalWavesAdvanced += 1
+
+
+class TestEventLog(unittest.TestCase):
+    def setUp(self):
+        self._population = Population([build_person(50 + index, 40 if index == 3 else None)
+                                       for index in range(5)])
+        people = self._population._people
+        # wave 1
+        people[0].add_outcome_event(Outcome(OutcomeType.MI, False))
+        people[1].add_outcome_event(Outcome(OutcomeType.STROKE, True))
+        advance_ages(self._population)
+        # wave 2
+        people[0].add_outcome_event(Outcome(OutcomeType.STROKE, False))
+        people[2].add_outcome_event(Outcome(OutcomeType.MI, False))
+        people[3].add_outcome_event(Outcome(OutcomeType.STROKE, False))
+        advance_ages(self._population)
+
+    def testPeopleQueryTheLogThroughTheirRow(self):
+        people = self._population._people
+        self.assertEqual([(50, Outcome(OutcomeType.MI, False))],
+                         list(people[0]._outcomes[OutcomeType.MI]))
+        self.assertTrue(people[0].has_stroke_during_wave(2))
+        self.assertFalse(people[0].has_stroke_during_wave(1))
+        self.assertTrue(people[1].has_fatal_stroke())
+        self.assertTrue(people[3].has_stroke_prior_to_simulation())
+        self.assertTrue(people[3].has_stroke_during_simulation())
+        self.assertEqual([1, 0, 1, 0, 0], self._population._state.outcome_count('mi').tolist())
+        self.assertEqual([1, 1, 0, 2, 0], self._population._state.outcome_count('stroke').tolist())
+
+    def testASingleEventCanBeStoredInPlaceOfAList(self):
+        person = self._population._people[4]
+        person._outcomes[OutcomeType.MI] = (person._age, Outcome(OutcomeType.MI, True))
+        self.assertEqual([(56, Outcome(OutcomeType.MI, True))], person._outcomes[OutcomeType.MI])
+        self.assertTrue(person.has_fatal_mi())
+
+    def testPopulationQueriesAreArrayOperations(self):
+        self.assertEqual([2, 3], self._population.get_event_counts_by_wave().tolist())
+        self.assertEqual([1, 1],
+                         self._population.get_event_counts_by_wave(OutcomeType.MI).tolist())
+        np.testing.assert_array_equal([51, 51, np.nan, -1, np.nan],
+                                      self._population.get_first_event_ages(OutcomeType.STROKE))
+
+        # an event in the wave that is being simulated
+        people = self._population._people
+        people[4].add_outcome_event(Outcome(OutcomeType.MI, False))
+        self.assertEqual([people[4]],
+                         self._population.get_events_in_most_recent_wave(OutcomeType.MI))
+        counts = self._population._state.events.count_by_wave(4, OutcomeType.MI)
+        self.assertEqual([1, 1, 1], counts[1:].tolist())
+
+    def testLastEventsOfRows(self):
+        log = self._population._state.events
+        lastStrokes = log.last_events([3, 1, 2], OutcomeType.STROKE)
+        self.assertEqual([54, 51], log.column('age')[lastStrokes[:2]].tolist())
+        self.assertEqual(-1, lastStrokes[2])
+
+    def testRollbackAndResetRemoveEventsFromTheLog(self):
+        person = self._population._people[3]
+        person.rollback_most_recent_event(OutcomeType.STROKE)
+        self.assertEqual(1, self._population._state.outcome_count('stroke')[3])
+        self.assertEqual(1, self._population.get_event_counts_by_wave(OutcomeType.STROKE)[1])
+
+        self._population._people[0].reset_to_baseline()
+        self.assertEqual(0, len(self._population._people[0]._outcomes[OutcomeType.MI]))
+        self.assertEqual(3, len(self._population._state.events))
+
+    def testEventsMoveWithTheirRows(self):
+        subset = self._population._state.take([3, 0])
+        self.assertEqual([0, 0, 1, 1], sorted(subset.events.column('row').tolist()))
+        np.testing.assert_array_equal([-1, 54], subset.events.column('age')[
+            subset.events.events_for_row(0, OutcomeType.STROKE)])
+        self.assertEqual([2, 1], subset.outcome_count('stroke').tolist())
+
+        log = EventLog()
+        log.add([0, 1], [1, 1], [60, 61], OutcomeType.MI, [False, False])
+        log.copy_rows_from(subset.events, np.array([1]), np.array([1]))
+        self.assertEqual([0, 1, 1], log.column('row').tolist())
+        self.assertEqual([60, 50, 51], log.column('age').tolist())
+
+
+if __name__ == "__main__":
+    unittest.main()
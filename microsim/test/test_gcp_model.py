@@ -9,6 +9,10 @@ from microsim.race_ethnicity import NHANESRaceEthnicity
 from microsim.gcp_model_with_bp_treatment import GCPModel
 from microsim.test.do_not_change_risk_factors_model_repository import DoNotChangeRiskFactorsModelRepository
 from microsim.outcome_model_repository import OutcomeModelRepository
+from microsim.gcp_model import GCPModel as RepositoryGCPModel
+from microsim.population import Population
+
+import numpy as np
 
 
 class AlwaysNegativeOutcomeRepository(OutcomeModelRepository):
@@ -122,3 +126,17 @@ class TestGCPModel(unittest.TestCase):
         self._test_case_one._randomEffects['gcp'] = 5
         self.assertAlmostEqual(
             64.45419405-2.7905+5, GCPModel().get_risk_for_person(person=self._test_case_one, years=1, test=True), places=1)
+
+    def test_batch_gcp_matches_per_person_gcp(self):
+        people = [self._test_case_one, self._test_case_two, self._test_case_three]
+        self._test_case_two.advance_year(DoNotChangeRiskFactorsModelRepository(),
+                                         AlwaysNegativeOutcomeRepository())
+        self._test_case_three._randomEffects = {'gcp': -3}
+        population = Population(people)
+
+        np.testing.assert_array_almost_equal(
+            [GCPModel().get_risk_for_person(person, years=1, test=True) for person in people],
+            GCPModel().get_risk_batch(population._state, np.arange(3), test=True))
+        np.testing.assert_array_almost_equal(
+            [RepositoryGCPModel().get_risk_for_person(person) for person in people],
+            RepositoryGCPModel().get_risk_batch(population._state, np.arange(3)))
@@ -0,0 +1,67 @@
+import unittest
+import os
+import shutil
+import tempfile
+
+from microsim.data_loader import ModelRegistry, load_model, load_model_spec
+from microsim.regression_model import RegressionModel
+from microsim.statsmodel_linear_risk_factor_model import StatsModelLinearRiskFactorModel
+
+
+class TestModelRegistry(unittest.TestCase):
+    def setUp(self):
+        self._directory = tempfile.mkdtemp()
+        self._registry = ModelRegistry(data_directory=self._directory)
+        self.write_spec({'Intercept': 1.0, 'age': 0.5})
+
+    def tearDown(self):
+        shutil.rmtree(self._directory)
+
+    def write_spec(self, coefficients, modifiedTime=1000):
+        path = os.path.join(self._directory, "testModelSpec.json")
+        with open(path, 'w') as specfile:
+            specfile.write(RegressionModel(coefficients, {}, 0, 1).to_json())
+        os.utime(path, (modifiedTime, modifiedTime))
+
+    def testModelsAreBuiltOncePerModelType(self):
+        model = self._registry.get_model("testModel", StatsModelLinearRiskFactorModel)
+        self.assertIs(model, self._registry.get_model(
+            "testModel", StatsModelLinearRiskFactorModel))
+        self.assertIsNot(model, self._registry.get_model(
+            "testModel", StatsModelLinearRiskFactorModel, log_transform=True))
+
+    def testSpecsAreCopiesOfTheCachedSpec(self):
+        spec = self._registry.get_model_spec("testModel")
+        spec['coefficients']['age'] = 100
+        self.assertEqual(0.5, self._registry.get_model_spec("testModel")['coefficients']['age'])
+
+    def testModifiedSpecsAreReloaded(self):
+        model = self._registry.get_model("testModel", StatsModelLinearRiskFactorModel)
+        self.write_spec({'Intercept': 2.0, 'age': 0.5}, modifiedTime=2000)
+        reloaded = self._registry.get_model("testModel", StatsModelLinearRiskFactorModel)
+        self.assertIsNot(model, reloaded)
+        self.assertEqual(2.0, reloaded.get_intercept())
+
+    def testInvalidate(self):
+        self._registry.check_modified_times = False
+        model = self._registry.get_model("testModel", StatsModelLinearRiskFactorModel)
+        self.write_spec({'Intercept': 2.0, 'age': 0.5}, modifiedTime=2000)
+        self.assertIs(model, self._registry.get_model(
+            "testModel", StatsModelLinearRiskFactorModel))
+
+        self._registry.invalidate("testModel")
+        self.assertEqual(2.0, self._registry.get_model(
+            "testModel", StatsModelLinearRiskFactorModel).get_intercept())
+
+    def testUnsafeModelNamesAreRejected(self):
+        with self.assertRaises(ValueError):
+            self._registry.get_model_spec("../testModel")
+
+    def testProcessWideRegistry(self):
+        self.assertIs(load_model("StrokeMIPartitionModel", StatsModelLinearRiskFactorModel),
+                      load_model("StrokeMIPartitionModel", StatsModelLinearRiskFactorModel))
+        self.assertIn('coefficients', load_model_spec("StrokeMIPartitionModel"))
+
+
+if __name__ == "__main__":
+    unittest.main()
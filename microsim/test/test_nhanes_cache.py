@@ -0,0 +1,70 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+
+from microsim.nhanes_cache import (build_nhanes_cache, is_nhanes_cache_current, load_nhanes_year,
+                                   nhanesColumns)
+
+
+class TestNHANESCache(unittest.TestCase):
+    def setUp(self):
+        self._directory = tempfile.mkdtemp()
+        self._sourcePath = os.path.join(self._directory, "nhanes.dta")
+        self._cachePath = os.path.join(self._directory, "cache")
+        random = np.random.RandomState(7)
+        self._nhanes = pd.DataFrame({name: random.uniform(1, 100, 30) for name in nhanesColumns})
+        self._nhanes['year'] = np.repeat([1999, 2015, 2001], 10)
+        self._nhanes['unused'] = 1.0
+        self._nhanes.to_stata(self._sourcePath, write_index=False)
+
+    def tearDown(self):
+        shutil.rmtree(self._directory)
+
+    def testYearsAreReadFromTheCache(self):
+        nhanes2015 = load_nhanes_year(2015, sourcePath=self._sourcePath, cachePath=self._cachePath)
+        expected = pd.read_stata(self._sourcePath)
+        expected = expected.loc[expected.year == 2015, nhanesColumns]
+        pd.testing.assert_frame_equal(expected, nhanes2015)
+        self.assertEqual(['1999', '2001', '2015', 'manifest.json'],
+                         sorted(os.listdir(self._cachePath)))
+
+        self.assertTrue(is_nhanes_cache_current(self._sourcePath, self._cachePath))
+        ages = load_nhanes_year(2001, ['age'], self._sourcePath, self._cachePath)
+        self.assertEqual(['age'], list(ages.columns))
+        self.assertEqual(list(range(20, 30)), list(ages.index))
+
+    def testCacheIsRebuiltWhenTheSourceChanges(self):
+        build_nhanes_cache(self._sourcePath, self._cachePath)
+        # touching the file doesn't invalidate the cache, changing it does
+        os.utime(self._sourcePath, ns=(0, 0))
+        self.assertTrue(is_nhanes_cache_current(self._sourcePath, self._cachePath))
+
+        self._nhanes.loc[15, 'age'] = 200
+        self._nhanes.to_stata(self._sourcePath, write_index=False)
+        self.assertFalse(is_nhanes_cache_current(self._sourcePath, self._cachePath))
+        nhanes2015 = load_nhanes_year(2015, sourcePath=self._sourcePath, cachePath=self._cachePath)
+        self.assertEqual(200, nhanes2015.age[15])
+        self.assertTrue(is_nhanes_cache_current(self._sourcePath, self._cachePath))
+
+    def testLabelledColumnsKeepTheirCodes(self):
+        self._nhanes['gender'] = pd.Categorical.from_codes(np.arange(30) % 2, ['male', 'female'])
+        self._nhanes.to_stata(self._sourcePath, write_index=False)
+        nhanes2015 = load_nhanes_year(2015, sourcePath=self._sourcePath, cachePath=self._cachePath)
+        self.assertEqual([1, 0, 1], nhanes2015.gender[[11, 12, 13]].tolist())
+
+    def testCacheIsKeptOutOfThePackage(self):
+        cacheDirectory = os.path.join(self._directory, "userCache", "microsim")
+        with mock.patch.dict(os.environ, {"MICROSIM_CACHE_DIR": cacheDirectory}):
+            load_nhanes_year(2015, sourcePath=self._sourcePath)
+        self.assertEqual(['nhanesCache'], os.listdir(cacheDirectory))
+        self.assertTrue(is_nhanes_cache_current(
+            self._sourcePath, os.path.join(cacheDirectory, "nhanesCache")))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -6,14 +6,33 @@ from microsim.smoking_status import SmokingStatus
 from microsim.outcome_model_repository import OutcomeModelRepository
 from microsim.education import Education
 from microsim.alcohol_category import AlcoholCategory
+from microsim.population import Population
+
+from microsim.outcome import Outcome, OutcomeType
 
 import unittest
+import numpy as np
 
 
 def initializeAfib(person):
     return None
 
 
+class FixedRandomEffects(OutcomeModelRepository):
+    def get_random_effects(self):
+        return {'gcp': 1.5}
+
+
+class OlderMenHaveFatalStrokes(OutcomeModelRepository):
+    def assign_cv_outcome(self, person, years=1, manualStrokeMIProbability=None):
+        if person._gender == NHANESGender.MALE:
+            return Outcome(OutcomeType.STROKE, True)
+        return None
+
+    def get_risk_for_person(self, person, outcome, years=1):
+        return 0.25 if outcome == OutcomeModelType.CARDIOVASCULAR else 0
+
+
 class TestOutcomeRepository(unittest.TestCase):
 
     def setUp(self):
@@ -88,5 +107,55 @@ class TestOutcomeRepository(unittest.TestCase):
         self.assertAlmostEqual(0.069810753, self._outcome_model_repository.get_risk_for_person(
             self._black_treated_male, OutcomeModelType.CARDIOVASCULAR, 10), delta=0.00001)
 
+    def test_cv_risk_batch_matches_per_person_risk(self):
+        people = [self._white_male, self._black_male, self._black_treated_male,
+                  self._white_female, self._black_female]
+        population = Population(people)
+        np.testing.assert_array_almost_equal(
+            [self._outcome_model_repository.get_risk_for_person(
+                person, OutcomeModelType.CARDIOVASCULAR, 10) for person in people],
+            self._outcome_model_repository.get_cv_risk_batch(population._state, range(5), 10))
+
+    def test_assign_cv_outcome_batch(self):
+        population = Population([self._white_male, self._white_female, self._black_female])
+        self._outcome_model_repository.secondary_prevention_multiplier = 1e6
+        self._outcome_model_repository.manualStrokeMIProbability = 1
+        self._outcome_model_repository.mi_case_fatality = 0
+        self._outcome_model_repository.secondary_mi_case_fatality = 1
+        self._white_female._outcomes[OutcomeType.STROKE].append(
+            (-1, Outcome(OutcomeType.STROKE, False)))
+        self._white_female._update_outcome_counts()
+        self._black_female._outcomes[OutcomeType.MI].append((-1, Outcome(OutcomeType.MI, False)))
+        self._black_female._update_outcome_counts()
+
+        hadEvent, isMI, fatal = self._outcome_model_repository.assign_cv_outcome_batch(
+            population._state, np.arange(3))
+        # only people with prior events have their risk multiplied up to certainty
+        self.assertEqual([True, True], hadEvent[1:].tolist())
+        self.assertEqual([True, True], isMI[1:].tolist())
+        self.assertEqual([False, True], fatal[1:].tolist())
+
+    def test_batch_methods_use_overridden_person_methods(self):
+        population = Population([self._white_male, self._white_female, self._black_male])
+        repository = OlderMenHaveFatalStrokes()
+        np.testing.assert_array_equal(
+            [0.25, 0.25, 0.25], repository.get_cv_risk_batch(population._state, np.arange(3)))
+        self.assertEqual([False, False, False], repository.assign_non_cv_mortality_batch(
+            population._state, np.arange(3)).tolist())
+
+        hadEvent, isMI, fatal = repository.assign_cv_outcome_batch(population._state,
+                                                                   np.arange(3))
+        self.assertEqual([True, False, True], hadEvent.tolist())
+        self.assertEqual([False, False, False], isMI.tolist())
+        self.assertEqual([True, False, True], fatal.tolist())
+        self.assertFalse(OutcomeModelRepository().overrides('assign_cv_outcome'))
+
+    def test_random_effects_hooks_without_a_person_are_still_called(self):
+        population = Population([self._white_male, self._white_female])
+        repository = FixedRandomEffects()
+        self.assertEqual({'gcp': 1.5}, repository.get_random_effects_for_person(self._white_male))
+        self.assertEqual([1.5, 1.5], repository.get_random_effects_batch(
+            population._state, np.arange(2))['gcp'].tolist())
+
     if __name__ == "__main__":
         unittest.main()
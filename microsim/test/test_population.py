@@ -1,11 +1,14 @@
 from microsim.population import NHANESDirectSamplePopulation
 from microsim.population import Population
+from microsim.population import (build_people_using_nhanes_for_sampling, build_person,
+                                 initialize_baseline_afib, PersonViews)
 from microsim.person import Person
 from microsim.gender import NHANESGender
 from microsim.race_ethnicity import NHANESRaceEthnicity
 from microsim.smoking_status import SmokingStatus
 from microsim.education import Education
 from microsim.alcohol_category import AlcoholCategory
+from microsim.nhanes_cache import load_nhanes_year
 
 import unittest
 import pandas as pd
@@ -16,8 +19,7 @@ class TestPopulation(unittest.TestCase):
     def setUp(self):
         self.test_n = 10000
         self.pandas_seed = 78483
-        full_nhanes = pd.read_stata("microsim/data/fullyImputedDataset.dta")
-        test_nhanes = full_nhanes.loc[full_nhanes.year == 2015]
+        test_nhanes = load_nhanes_year(2015)
         self.test_sample = test_nhanes.sample(
             self.test_n, weights=test_nhanes.WTINT2YR, random_state=self.pandas_seed, replace=True)
 
@@ -76,5 +78,86 @@ class TestPopulationAdvanceOutcomes(unittest.TestCase):
         self.assertEqual(expected_risk_factor_length, len(self.joe._sbp))
 
 
+class TestPopulationFromNHANESColumns(unittest.TestCase):
+    def setUp(self):
+        random = np.random.RandomState(3)
+        n = 200
+        self.nhanes = pd.DataFrame({
+            'age': random.randint(18, 85, n).astype(float),
+            'gender': random.randint(1, 3, n).astype(float),
+            'raceEthnicity': random.randint(1, 6, n).astype(float),
+            'meanSBP': random.normal(125, 60, n),
+            'meanDBP': random.normal(72, 11, n),
+            'a1c': random.normal(5.7, 0.8, n),
+            'hdl': random.normal(52, 14, n),
+            'ldl': random.normal(115, 35, n),
+            'trig': random.normal(130, 60, n),
+            'tot_chol': random.normal(195, 40, n),
+            'bmi': random.normal(28, 6, n),
+            'waist': random.normal(98, 15, n),
+            'anyPhysicalActivity': random.randint(0, 2, n).astype(float),
+            'smokingStatus': random.randint(0, 3, n).astype(float),
+            'alcoholPerWeek': random.choice([0, 2, 6, 8, 13, 15], n).astype(float),
+            'education': random.randint(1, 6, n).astype(float),
+            'antiHypertensive': random.choice([0, 1, 2], n).astype(float),
+            'statin': random.randint(0, 2, n).astype(float),
+            'otherLipidLowering': np.zeros(n),
+            'selfReportStrokeAge': np.where(random.rand(n) < 0.1, 50.0, np.nan),
+            'selfReportMIAge': np.where(random.rand(n) < 0.1, 55.0, np.nan),
+            'index': np.arange(n),
+            'diedBy2015': np.zeros(n),
+            'WTINT2YR': random.uniform(1000, 50000, n)},
+            index=np.arange(1000, 1000 + n))
+
+    def test_columns_give_the_same_people_as_building_them_one_at_a_time(self):
+        np.random.seed(5)
+        people = build_people_using_nhanes_for_sampling(self.nhanes, 300, random_seed=8)
+        self.assertIsInstance(people, PersonViews)
+        population = Population(people)
+
+        np.random.seed(5)
+        sample = self.nhanes.sample(300, weights=self.nhanes.WTINT2YR, random_state=8,
+                                    replace=True)
+        expectedPeople = sample.apply(build_person, axis=1)
+        initialize_baseline_afib(expectedPeople)
+        expected = Population(expectedPeople)
+
+        # nobody has been built as a Person yet
+        self.assertEqual([], people.built(range(300)))
+        for name in expected._state.historyAttributes:
+            np.testing.assert_array_equal(expected._state.history(name),
+                                          population._state.history(name), err_msg=name)
+        for name in expected._state.staticAttributes:
+            np.testing.assert_array_equal(expected._state.static(name),
+                                          population._state.static(name), err_msg=name)
+        self.assertEqual(list(sample.index), list(population._people.index))
+        for person, expectedPerson in zip(population._people, expected._people):
+            self.assertEqual(expectedPerson, person)
+            self.assertEqual(expectedPerson.dfIndex, person.dfIndex)
+
+    def test_people_are_built_when_they_are_asked_for(self):
+        population = Population(build_people_using_nhanes_for_sampling(self.nhanes, 50,
+                                                                       random_seed=8))
+        person = population._peopleByRow[7]
+        self.assertIs(person, population._peopleByRow[7])
+        self.assertEqual([person], population._peopleByRow.built(range(50)))
+        self.assertEqual(population._state.current('age')[7], person._age[-1])
+
+    def test_populations_without_new_people_start_empty(self):
+        population = NHANESDirectSamplePopulation(10, 2015, generate_new_people=False)
+        self.assertEqual(0, len(population._people))
+        population._people = Population(build_people_using_nhanes_for_sampling(
+            self.nhanes, 10, random_seed=8))._people
+        self.assertEqual(10, population._state.n)
+
+    def test_sampling_seed_doesnt_seed_the_simulation(self):
+        population = NHANESDirectSamplePopulation(10, 2015, generate_new_people=False,
+                                                  random_seed=3)
+        self.assertIsNone(population._state.randomStreams)
+        population = NHANESDirectSamplePopulation(10, 2015, generate_new_people=False,
+                                                  random_seed=3, simulation_seed=5)
+        self.assertEqual(5, population._state.randomStreams.seed)
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,256 @@
+import unittest
+import copy
+import pickle
+
+import numpy as np
+
+from microsim.person import Person
+from microsim.population import Population
+from microsim.population_state import PopulationState, CounterfactualState
+from microsim.cohort_risk_model_repository import CohortRiskModelRepository
+from microsim.outcome_model_repository import OutcomeModelRepository
+from microsim.gender import NHANESGender
+from microsim.race_ethnicity import NHANESRaceEthnicity
+from microsim.education import Education
+from microsim.smoking_status import SmokingStatus
+from microsim.alcohol_category import AlcoholCategory
+
+
+def initializeAfib(person):
+    return False
+
+
+def build_person(age, sbp):
+    return Person(
+        age=age, gender=NHANESGender.MALE,
+        raceEthnicity=NHANESRaceEthnicity.NON_HISPANIC_WHITE,
+        sbp=sbp, dbp=80, a1c=6, hdl=50, totChol=213, ldl=90, trig=150,
+        bmi=22, waist=34, anyPhysicalActivity=0, education=Education.COLLEGEGRADUATE,
+        smokingStatus=SmokingStatus.NEVER, alcohol=AlcoholCategory.NONE,
+        antiHypertensiveCount=0, statin=0, otherLipidLoweringMedicationCount=0,
+        initializeAfib=initializeAfib)
+
+
+class TestPopulationState(unittest.TestCase):
+    def setUp(self):
+        self._young = build_person(45, 120)
+        self._old = build_person(70, 150)
+
+    def testPersonHistoryBehavesLikeAList(self):
+        self._young._sbp.append(125)
+        self._young._sbp.append(130)
+        self.assertEqual(3, len(self._young._sbp))
+        self.assertEqual([120, 125, 130], self._young._sbp)
+        self.assertEqual(130, self._young._sbp[-1])
+        self.assertEqual([125, 130], self._young._sbp[1:])
+        self.assertEqual(125, np.array(self._young._sbp).mean())
+
+        self._young._sbp[-1] = 140
+        self.assertEqual(140, self._young._sbp[-1])
+        self.assertEqual(140, self._young._sbp.pop())
+        self.assertEqual([120, 125], list(self._young._sbp))
+
+    def testStaticAttributesAreEnums(self):
+        self.assertEqual(NHANESGender.MALE, self._young._gender)
+        self.assertIsInstance(self._young._education, Education)
+        self.assertEqual(Education.COLLEGEGRADUATE.value, self._young._education.value)
+
+    def testIntegerHistoriesKeepTheirType(self):
+        self._young._age.append(self._young._age[-1] + 1)
+        self.assertEqual("46", repr(self._young._age[-1]))
+        # a fractional value turns the whole history into floats rather than being truncated
+        fractional = build_person(45.5, 120)
+        fractional._age.append(fractional._age[-1] + 1)
+        self.assertEqual([45.5, 46.5], list(fractional._age))
+        # ...but not once the history is shared with other processes
+        self._young._state.shared = True
+        with self.assertRaises(ValueError):
+            self._young._age.append(46.5)
+        self._young._state.shared = False
+
+    def testPopulationSharesStateWithPeople(self):
+        population = Population([self._young, self._old])
+        self.assertIs(population._state, self._young._state)
+        self.assertIs(population._state, self._old._state)
+
+        self._old._sbp.append(155)
+        self._old._alive.append(False)
+        np.testing.assert_array_equal([120, 155], population._state.current('sbp'))
+        np.testing.assert_array_equal([True, False], population._state.current('alive'))
+        np.testing.assert_array_equal([45, 70], population._state.baseline('age'))
+
+    def testColumnarAppendGrowsHistories(self):
+        population = Population([self._young, self._old])
+        state = population._state
+        for wave in range(1, 10):
+            state.append('age', state.current('age') + 1)
+        self.assertEqual(10, len(self._young._age))
+        self.assertEqual(79, self._old._age[-1])
+
+        state.append('sbp', [200], rows=[1])
+        self.assertEqual(1, len(self._young._sbp))
+        self.assertEqual([150, 200], self._old._sbp)
+
+    def testAliveAtStartOfWaveMatchesPerson(self):
+        population = Population([self._young, self._old])
+        for person in [self._young, self._old]:
+            person._age.append(person._age[-1] + 1)
+            person._alive.append(True)
+        self._old._alive.append(False)
+
+        for wave in [1, 2]:
+            self.assertEqual([person.alive_at_start_of_wave(wave)
+                              for person in population._people],
+                             population._state.alive_at_start_of_wave(wave).tolist())
+
+    def testCopiesAndPicklesOnlyCarryTheirOwnRow(self):
+        Population([self._young, self._old])
+        self._old._sbp.append(155)
+
+        for duplicate in [copy.deepcopy(self._old), pickle.loads(pickle.dumps(self._old))]:
+            self.assertEqual(self._old, duplicate)
+            self.assertEqual(1, duplicate._state.n)
+            duplicate._sbp.append(160)
+            self.assertEqual(2, len(self._old._sbp))
+
+    def testFromRowsPreservesLengths(self):
+        self._young._gcp.append(50)
+        state = PopulationState.from_rows([(self._old._state, self._old._row),
+                                           (self._young._state, self._young._row)])
+        np.testing.assert_array_equal([0, 1], state.lengths('gcp'))
+        np.testing.assert_array_equal([150, 120], state.current('sbp'))
+
+    def testRunningAggregatesFollowHistoryChanges(self):
+        sbp = self._young._sbp
+        for value in [130, 110, 140]:
+            sbp.append(value)
+        self.assertAlmostEqual(np.array(list(sbp)).mean(), sbp.mean())
+        self.assertEqual(140, sbp.max())
+
+        sbp[-1] = 100
+        self.assertAlmostEqual(115, sbp.mean())
+        self.assertEqual(130, sbp.max())
+        sbp.pop()
+        self.assertAlmostEqual(120, sbp.mean())
+        self.assertEqual(130, sbp.max())
+        self._young._state.truncate('sbp', self._young._row, 1)
+        self.assertEqual(120, sbp.max())
+
+    def testRunningAggregatesAreCopiedAndAppendedByColumn(self):
+        self._old._sbp.append(170)
+        population = Population([self._young, self._old])
+        state = population._state
+        np.testing.assert_array_almost_equal([120, 160], state.running_mean('sbp'))
+        np.testing.assert_array_almost_equal(
+            [np.log(120), np.log([150, 170]).mean()], state.running_mean('sbp', function='log'))
+
+        state.append('sbp', [124, 120])
+        np.testing.assert_array_almost_equal([122, 440 / 3], state.running_mean('sbp'))
+        np.testing.assert_array_almost_equal(
+            [np.log([120, 124]).mean(), np.log([150, 170, 120]).mean()],
+            state.running_mean('sbp', function='log'))
+        np.testing.assert_array_equal([124, 170], state.running_max('sbp'))
+        self.assertAlmostEqual(440 / 3, state.take([1]).running_mean('sbp')[0])
+
+    def testRandomEffectsAreStoredInTheState(self):
+        self.assertEqual({}, self._young._randomEffects)
+        self._young._randomEffects['gcp'] = 2.5
+        self._old._randomEffects = {'gcp': -1}
+        population = Population([self._young, self._old])
+
+        np.testing.assert_array_equal([2.5, -1], population._state.random_effect('gcp'))
+        self.assertEqual({'gcp': 2.5}, self._young._randomEffects)
+        self.assertEqual({'gcp': -1}, copy.deepcopy(self._old)._randomEffects)
+        with self.assertRaises(KeyError):
+            self._young._randomEffects['other'] = 1
+
+    def testForkedStatesShareHistoriesUntilTheyChangeThem(self):
+        population = Population([self._young, self._old])
+        state = population._state
+        state.append('sbp', [125, 155])
+        branch = state.fork()
+        self.assertTrue(np.shares_memory(state._frozen['sbp'][0], branch._frozen['sbp'][0]))
+
+        # new waves go to each state's own columns
+        state.append('sbp', [130, 160])
+        branch.append('sbp', [110, 140])
+        np.testing.assert_array_equal([[120, 125, 130], [150, 155, 160]], state.history('sbp'))
+        np.testing.assert_array_equal([[120, 125, 110], [150, 155, 140]], branch.history('sbp'))
+        np.testing.assert_array_equal([120, 150], branch.baseline('sbp'))
+        np.testing.assert_array_almost_equal([355 / 3, 445 / 3], branch.running_mean('sbp'))
+
+        # changing a shared column copies the branch's columns first
+        branch.set_value('sbp', 0, 1, 100)
+        self.assertEqual([], branch._frozen['sbp'])
+        self.assertEqual([120, 125, 130], list(self._young._sbp))
+        self.assertEqual([120, 100, 110], branch.get_row('sbp', 0).tolist())
+        self.assertEqual(np.log([150, 155, 160]).mean(),
+                         state.running_mean('sbp', function='log')[1])
+
+
+class SbpRiskRepository(OutcomeModelRepository):
+    def get_risk_for_person(self, person, outcome, years=1):
+        return person._sbp[-1] / 1000
+
+
+class TestCounterfactualState(unittest.TestCase):
+    def setUp(self):
+        self._population = Population([build_person(45 + index, 120 + 2 * index)
+                                       for index in range(30)])
+        self._population._risk_model_repository = CohortRiskModelRepository()
+        self._population._outcome_model_repository = OutcomeModelRepository()
+        self._population.set_random_seed(11)
+        self._population.advance_vectorized(2)
+
+    def testShiftsOnlyApplyToTheCopies(self):
+        state = self._population._state
+        counterfactual = CounterfactualState(state, {'sbp': -10})
+        rows = np.array([0, 4])
+        bothRows = np.concatenate([rows, counterfactual.counterfactual_rows(rows)])
+        current = state.current('sbp', rows)
+        np.testing.assert_array_equal(np.concatenate([current, current - 10]),
+                                      counterfactual.current('sbp', bothRows))
+        np.testing.assert_array_equal(state.current('dbp', rows).tolist() * 2,
+                                      counterfactual.current('dbp', bothRows))
+        np.testing.assert_array_almost_equal(
+            state.history('sbp', rows).mean(axis=1) - 10 / 3,
+            counterfactual.running_mean('sbp', bothRows)[2:])
+
+    def testRisksMatchChangingThePeople(self):
+        population = self._population
+        rows = np.flatnonzero(population._state.alive_at_start_of_wave(2))
+        sbp = population._state.history('sbp').copy()
+        factual, counterfactual = population.estimate_counterfactual_risks(
+            {'sbp': -5.5, 'antiHypertensiveCount': -1}, rows)
+        np.testing.assert_array_equal(sbp, population._state.history('sbp'))
+
+        people = population.get_people_alive_at_the_start_of_wave(2)
+        for expected, actual in zip(population.estimate_risks(people), factual):
+            np.testing.assert_array_equal(expected, actual)
+        for person in people:
+            person._sbp[-1] = person._sbp[-1] - 5.5
+            person._antiHypertensiveCount[-1] = person._antiHypertensiveCount[-1] - 1
+        for expected, actual in zip(population.estimate_risks(people), counterfactual):
+            np.testing.assert_array_equal(expected, actual)
+
+    def testOverriddenRisksAreEstimatedPerPerson(self):
+        population = self._population
+        population._outcome_model_repository = SbpRiskRepository()
+        rows = np.flatnonzero(population._state.alive_at_start_of_wave(2))
+        sbp = population._state.history('sbp').copy()
+        counts = population._state.history('antiHypertensiveCount').copy()
+        factual, counterfactual = population.estimate_counterfactual_risks(
+            {'sbp': -5.5, 'antiHypertensiveCount': -1}, rows)
+        np.testing.assert_array_equal(sbp, population._state.history('sbp'))
+        np.testing.assert_array_equal(counts,
+                                      population._state.history('antiHypertensiveCount'))
+
+        people = population.get_people_alive_at_the_start_of_wave(2)
+        for expected, actual in zip(population.estimate_risks(people), factual):
+            np.testing.assert_array_almost_equal(expected, actual)
+        np.testing.assert_array_almost_equal(
+            (factual[0] + factual[1]) - 0.0055, counterfactual[0] + counterfactual[1])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,69 @@
+import unittest
+
+import numpy as np
+import scipy.special as scipySpecial
+
+from microsim.psa import (ProbabilisticSensitivityAnalysis, standard_normal_draws,
+                          summarize_population, uncertain_models)
+from microsim.test.test_checkpoint import build_population
+
+
+class TestProbabilisticSensitivityAnalysis(unittest.TestCase):
+    def setUp(self):
+        self._population = build_population()
+        self._population.set_random_seed(29)
+
+    def testLatinHypercubeDrawsAreStratified(self):
+        normals = standard_normal_draws(50, 3, "lhs", seed=4)
+        strata = np.floor(scipySpecial.ndtr(normals) * 50).astype(int)
+        for column in strata.T:
+            self.assertEqual(list(range(50)), sorted(column))
+
+    def testDrawsFollowTheStandardErrors(self):
+        analysis = ProbabilisticSensitivityAnalysis(self._population, 512, "sobol", seed=3)
+        self.assertEqual(512, len(analysis.draws))
+        for name, coeff_name, value, standardError in analysis.parameters[:20]:
+            draws = analysis.draws[(name, coeff_name)]
+            self.assertAlmostEqual(value, draws.mean(), delta=0.2 * standardError)
+            self.assertAlmostEqual(standardError, draws.std(), delta=0.1 * standardError)
+        self.assertTrue({'riskFactor.sbp', 'nonCVMortality', 'strokePartition'}.issubset(
+            analysis.draws.columns.get_level_values('model')))
+        # the ASCVD models don't have standard errors unless they are given
+        self.assertNotIn('cv.male', analysis.draws.columns.get_level_values('model'))
+        analysis = ProbabilisticSensitivityAnalysis(self._population, 2, seed=3,
+                                                    standardErrors={'cv.male': {'lagSbp': 0.01}})
+        self.assertIn(('cv.male', 'lagSbp'), analysis.draws.columns)
+
+    def testDrawsDontChangeThePopulationsModels(self):
+        analysis = ProbabilisticSensitivityAnalysis(self._population, 2, seed=3)
+        models = uncertain_models(self._population)
+        parameters = {name: dict(model.parameters) for name, model in models.items()}
+        branchModels = uncertain_models(analysis.population_for_draw(1))
+        for name, model in uncertain_models(self._population).items():
+            self.assertEqual(parameters[name], model.parameters)
+        for name, coeff_name, _, _ in analysis.parameters:
+            self.assertEqual(analysis.draws[(name, coeff_name)][1],
+                             branchModels[name].parameters[coeff_name])
+
+    def testDrawsAtTheEstimatesMatchThePopulation(self):
+        analysis = ProbabilisticSensitivityAnalysis(self._population, 1, seed=3)
+        analysis.draws.iloc[0] = [parameter[2] for parameter in analysis.parameters]
+        clone = self._population.clone()
+        clone.advance_vectorized(3)
+        self.assertEqual(summarize_population(clone), analysis.run_draw(0, 3))
+
+    def testProcessPoolsMatchSerialRuns(self):
+        analysis = ProbabilisticSensitivityAnalysis(self._population, 4, "lhs", seed=3)
+        results = analysis.run(2)
+        self.assertEqual(4, len(results))
+        self.assertTrue(results.equals(analysis.run(2, processes=2)))
+        summary = ProbabilisticSensitivityAnalysis.summarize(results)
+        self.assertEqual(list(results.columns), list(summary.index))
+
+    def testPopulationsNeedARandomSeed(self):
+        with self.assertRaises(ValueError):
+            ProbabilisticSensitivityAnalysis(build_population(), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,129 @@
+import unittest
+import copy
+
+import numpy as np
+
+from microsim.person import Person
+from microsim.population import Population
+from microsim.random_streams import RandomStreams, sample_without_replacement_batch
+from microsim.cohort_risk_model_repository import CohortRiskModelRepository
+from microsim.outcome_model_repository import OutcomeModelRepository
+from microsim.gender import NHANESGender
+from microsim.race_ethnicity import NHANESRaceEthnicity
+from microsim.education import Education
+from microsim.smoking_status import SmokingStatus
+from microsim.alcohol_category import AlcoholCategory
+
+
+def initializeAfib(person):
+    return False
+
+
+def build_person(age, gender, sbp, smokingStatus):
+    return Person(
+        age=age, gender=gender, raceEthnicity=NHANESRaceEthnicity.NON_HISPANIC_WHITE,
+        sbp=sbp, dbp=80, a1c=6, hdl=50, totChol=213, ldl=90, trig=150,
+        bmi=26, waist=90, anyPhysicalActivity=0, education=Education.COLLEGEGRADUATE,
+        smokingStatus=smokingStatus, alcohol=AlcoholCategory.NONE,
+        antiHypertensiveCount=0, statin=0, otherLipidLoweringMedicationCount=0,
+        initializeAfib=initializeAfib)
+
+
+def build_population(people):
+    population = Population(people)
+    population._risk_model_repository = CohortRiskModelRepository()
+    population._outcome_model_repository = OutcomeModelRepository()
+    return population
+
+
+class TestRandomStreams(unittest.TestCase):
+    def setUp(self):
+        people = []
+        for index in range(40):
+            people.append(build_person(
+                45 + index, NHANESGender.MALE if index % 2 else NHANESGender.FEMALE,
+                110 + index, SmokingStatus.CURRENT if index % 3 == 0 else SmokingStatus.NEVER))
+        self._population = build_population(people)
+        self._population.set_random_seed(1234)
+
+    def testDrawsDependOnlyOnPersonWaveAndStage(self):
+        streams = RandomStreams(1234)
+        personIds = np.arange(100)
+        waves = np.full(100, 3)
+        draws = streams.uniform("cvEvent", personIds, waves)
+
+        reordered = streams.uniform("cvEvent", personIds[::-1], waves)
+        np.testing.assert_array_equal(draws, reordered[::-1])
+        self.assertEqual(draws[17], streams.uniform("cvEvent", [17], [3])[0])
+        np.testing.assert_array_equal(draws,
+                                      RandomStreams(1234).uniform("cvEvent", personIds, waves))
+
+        self.assertFalse(np.array_equal(draws,
+                                        streams.uniform("nonCVMortality", personIds, waves)))
+        self.assertFalse(np.array_equal(draws, streams.uniform("cvEvent", personIds, waves + 1)))
+        self.assertFalse(np.array_equal(draws,
+                                        RandomStreams(99).uniform("cvEvent", personIds, waves)))
+        self.assertTrue(np.all((draws >= 0) & (draws < 1)))
+
+    def testPeopleKeepTheirIdsAndStreamsWhenCopied(self):
+        ids = self._population._state.static('personId')
+        np.testing.assert_array_equal(np.arange(40), ids)
+        person = copy.deepcopy(self._population._people[5])
+        self.assertEqual(5, person._personId)
+        self.assertIs(self._population._state.randomStreams, person._state.randomStreams)
+
+    def testSerialAndVectorizedAdvanceGiveIdenticalTrajectories(self):
+        vectorized = build_population([copy.deepcopy(person)
+                                       for person in self._population._people])
+        self._population.advance(5)
+        vectorized.advance_vectorized(5)
+
+        for name in self._population._state.historyAttributes:
+            np.testing.assert_array_equal(self._population._state.history(name),
+                                          vectorized._state.history(name), err_msg=name)
+        for serialPerson, vectorizedPerson in zip(self._population._people, vectorized._people):
+            self.assertEqual(serialPerson._outcomes, vectorizedPerson._outcomes)
+            self.assertEqual(serialPerson._randomEffects, vectorizedPerson._randomEffects)
+
+    def testSameSeedRepeatsTheSimulation(self):
+        repeat = build_population([copy.deepcopy(person) for person in self._population._people])
+        np.random.seed(1)
+        self._population.advance_vectorized(3)
+        np.random.seed(2)
+        repeat.advance_vectorized(3)
+        np.testing.assert_array_equal(self._population._state.history('sbp'),
+                                      repeat._state.history('sbp'))
+
+    def testUnseededPopulationsDrawFromNumpysRandomState(self):
+        histories = []
+        for seed in [3, 3, 4]:
+            population = build_population([build_person(50 + index, NHANESGender.MALE, 120,
+                                                        SmokingStatus.NEVER)
+                                           for index in range(10)])
+            self.assertIsNone(population._state.randomStreams)
+            np.random.seed(seed)
+            population.advance_vectorized(3)
+            histories.append(population._state.history('sbp'))
+        np.testing.assert_array_equal(histories[0], histories[1])
+        self.assertFalse(np.array_equal(histories[0], histories[2]))
+
+    def testWeightedSamplesWithoutReplacement(self):
+        state = self._population._state
+        rows = np.array([3, 8, 11, 20])
+        weights = np.array([1, 2, 3, 0])
+        picks = np.concatenate([sample_without_replacement_batch(state, rows, weights, 1,
+                                                                 f"sample{trial}")
+                                for trial in range(3000)])
+        np.testing.assert_allclose([1 / 6, 2 / 6, 3 / 6, 0],
+                                   [np.mean(picks == row) for row in rows], atol=0.03)
+
+        sample = sample_without_replacement_batch(state, rows, weights, 4, "sample")
+        self.assertEqual(sorted(rows.tolist()), sorted(sample.tolist()))
+        # rows without any weight are picked last
+        self.assertEqual(20, sample[-1])
+        with self.assertRaises(ValueError):
+            sample_without_replacement_batch(state, rows, weights, 5, "sample")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,7 +1,10 @@
 import unittest
 import copy
 
+import numpy as np
+
 from microsim.person import Person
+from microsim.population import Population
 from microsim.test.test_risk_model_repository import TestRiskModelRepository
 from microsim.outcome_model_repository import OutcomeModelRepository
 from microsim.gender import NHANESGender
@@ -358,6 +361,28 @@ class TestResetPersonAndRollBackEvents(unittest.TestCase):
         self.assertEqual(False, self._baseline_stroke_person.is_dead())
         self.assertEqual(self.baseAge+1, self._baseline_stroke_person._age[-1])
 
+    def testRollbackEventsForAPopulation(self):
+        self._white_male.advance_year(TestRiskModelRepository(),
+                                      AlwaysNonFatalStrokeOutcomeRepository())
+        self._baseline_stroke_person.advance_year(TestRiskModelRepository(),
+                                                  AlwaysFatalStrokeOutcomeRepository())
+        expected = [copy.deepcopy(self._white_male), copy.deepcopy(self._baseline_stroke_person)]
+        for person in expected:
+            person.rollback_most_recent_event(OutcomeType.STROKE)
+        population = Population([self._white_male, self._baseline_stroke_person])
+        self.assertEqual([True, True], population.has_outcome_during_wave_batch(
+            1, OutcomeType.STROKE, np.array([0, 1])).tolist())
+
+        population.rollback_most_recent_events(np.array([1, 0]), OutcomeType.STROKE)
+        for person, expectedPerson in zip(population._people, expected):
+            self.assertEqual(expectedPerson._outcomes, person._outcomes)
+            self.assertEqual(list(expectedPerson._age), list(person._age))
+            self.assertEqual(list(expectedPerson._alive), list(person._alive))
+        self.assertEqual([False, False], population.has_outcome_during_wave_batch(
+            1, OutcomeType.STROKE, np.array([0, 1])).tolist())
+        with self.assertRaises(IndexError):
+            population.rollback_most_recent_events(np.array([0]), OutcomeType.STROKE)
+
     def testBasePatientEquals(self):
         self.assertTrue(self._white_male == self._white_male_copy_paste)
         self.assertEqual(self._white_male, self._white_male_copy_paste)
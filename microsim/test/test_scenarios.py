@@ -0,0 +1,87 @@
+import unittest
+
+import numpy as np
+
+from microsim.person import Person
+from microsim.population import Population
+from microsim.scenarios import Scenario
+from microsim.cohort_risk_model_repository import CohortRiskModelRepository
+from microsim.outcome_model_repository import OutcomeModelRepository
+from microsim.gender import NHANESGender
+from microsim.race_ethnicity import NHANESRaceEthnicity
+from microsim.education import Education
+from microsim.smoking_status import SmokingStatus
+from microsim.alcohol_category import AlcoholCategory
+
+
+def initializeAfib(person):
+    return False
+
+
+def add_a_single_blood_pressure_medication_strategy(person):
+    return {'_antiHypertensiveCount': 1}, {'_sbp': -5, '_dbp': -3}, None
+
+
+class TestScenarios(unittest.TestCase):
+    def setUp(self):
+        people = []
+        for index in range(50):
+            people.append(Person(
+                age=50 + index / 2, gender=NHANESGender(index % 2 + 1),
+                raceEthnicity=NHANESRaceEthnicity.NON_HISPANIC_WHITE,
+                sbp=130 + index, dbp=80, a1c=6, hdl=40, totChol=213, ldl=90, trig=150,
+                bmi=30, waist=100, anyPhysicalActivity=0, education=Education.HIGHSCHOOLGRADUATE,
+                smokingStatus=SmokingStatus.CURRENT, alcohol=AlcoholCategory.NONE,
+                antiHypertensiveCount=0, statin=0, otherLipidLoweringMedicationCount=0,
+                initializeAfib=initializeAfib))
+        self._population = Population(people)
+        self._population._risk_model_repository = CohortRiskModelRepository()
+        self._population._outcome_model_repository = OutcomeModelRepository()
+        self._population.set_random_seed(21)
+        self._population.advance_vectorized(1)
+
+    def testArmsMatchPopulationsAdvancedOnTheirOwn(self):
+        scenarios = self._population.build_scenarios([
+            Scenario("control"),
+            Scenario("treated", add_a_single_blood_pressure_medication_strategy)])
+        alone = self._population.clone()
+        alone.set_bp_treatment_strategy(add_a_single_blood_pressure_medication_strategy)
+        scenarios.advance(3)
+        alone.advance_vectorized(3)
+
+        for name in self._population._state.historyAttributes:
+            np.testing.assert_array_equal(alone._state.history(name),
+                                          scenarios.populations["treated"]._state.history(name))
+        # the population the scenarios were built from isn't advanced
+        self.assertEqual(1, self._population._totalWavesAdvanced)
+        self.assertEqual(4, scenarios.populations["control"]._totalWavesAdvanced)
+
+    def testArmsShareRandomNumbers(self):
+        scenarios = self._population.build_scenarios([
+            Scenario("control"),
+            Scenario("same", overrides={'num_of_processes': 2}),
+            Scenario("treated", add_a_single_blood_pressure_medication_strategy)])
+        scenarios.advance(2)
+        differences = scenarios.paired_differences("control")
+        self.assertTrue(np.all(differences["same"].to_numpy() == 0))
+        self.assertEqual(2, scenarios.populations["same"].num_of_processes)
+
+        # people are treated in the first wave of the scenarios, so their sbp differs by the
+        # effect of the treatment on the sbp they'd have had anyway
+        treatedSbp = differences[("treated", "sbp")]
+        self.assertTrue(np.all(treatedSbp[~scenarios.results()[("control", "dead")].astype(bool)]
+                               < 0))
+        summary = scenarios.compare("control")
+        self.assertEqual(0, summary.loc[("same", "sbp"), "standardError"])
+        self.assertLess(summary.loc[("treated", "sbp"), "upperBound"], 0)
+
+    def testScenariosNeedARandomSeed(self):
+        with self.assertRaises(ValueError):
+            self._population.build_scenarios([Scenario("a"), Scenario("a")])
+        self._population._state.randomStreams = None
+        with self.assertRaises(ValueError):
+            self._population.build_scenarios([Scenario("control")])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,160 @@
+import unittest
+import copy
+import warnings
+
+import numpy as np
+
+from microsim.person import Person
+from microsim.population import Population, build_people_using_nhanes_for_sampling
+from microsim.benchmark import fixture_nhanes
+from microsim.cohort_risk_model_repository import CohortRiskModelRepository
+from microsim.outcome_model_repository import OutcomeModelRepository
+from microsim.gender import NHANESGender
+from microsim.race_ethnicity import NHANESRaceEthnicity
+from microsim.education import Education
+from microsim.smoking_status import SmokingStatus
+from microsim.alcohol_category import AlcoholCategory
+from microsim.outcome import Outcome, OutcomeType
+
+
+def initializeAfib(person):
+    return False
+
+
+def build_population(people):
+    population = Population(people)
+    population._risk_model_repository = CohortRiskModelRepository()
+    population._outcome_model_repository = OutcomeModelRepository()
+    population.num_of_processes = 2
+    return population
+
+
+def build_people():
+    people = []
+    for index in range(60):
+        people.append(Person(
+            age=50 + index / 2, gender=NHANESGender(index % 2 + 1),
+            raceEthnicity=NHANESRaceEthnicity.NON_HISPANIC_BLACK,
+            sbp=130 + index, dbp=80, a1c=6, hdl=40, totChol=213, ldl=90, trig=150,
+            bmi=30, waist=100, anyPhysicalActivity=0, education=Education.HIGHSCHOOLGRADUATE,
+            smokingStatus=SmokingStatus.CURRENT, alcohol=AlcoholCategory.NONE,
+            antiHypertensiveCount=0, statin=0, otherLipidLoweringMedicationCount=0,
+            initializeAfib=initializeAfib))
+    return people
+
+
+class TestSharedMemoryWorkerPool(unittest.TestCase):
+    def setUp(self):
+        people = build_people()
+        self._pooled = build_population(people)
+        self._pooled.set_random_seed(99)
+        self._vectorized = build_population([copy.deepcopy(person) for person in people])
+
+    def tearDown(self):
+        self._pooled.close_worker_pool()
+
+    def assert_populations_equal(self, population, other):
+        for name in population._state.historyAttributes:
+            np.testing.assert_array_equal(population._state.history(name),
+                                          other._state.history(name), err_msg=name)
+        for person, otherPerson in zip(population._people, other._people):
+            self.assertEqual(person._outcomes, otherPerson._outcomes)
+
+    def testPoolGivesTheSameResultsAsASingleProcess(self):
+        self._pooled.advance_multi_process(1, vectorized=True)
+        self._pooled.advance_multi_process(1, vectorized=True)
+        pool = self._pooled._workerPool
+        self._pooled.advance_multi_process(1, vectorized=True)
+        self._pooled.advance_multi_process(2, vectorized=True)
+        # the workers are kept between calls while the state has room for the waves
+        self.assertIs(pool, self._pooled._workerPool)
+
+        self._vectorized.advance_vectorized(5)
+        self.assert_populations_equal(self._vectorized, self._pooled)
+        self.assertEqual(self._vectorized._state.outcome_count('mi').tolist(),
+                         self._pooled._state.outcome_count('mi').tolist())
+
+    def testClosingThePoolKeepsTheState(self):
+        self._pooled.advance_multi_process(2, vectorized=True)
+        self._vectorized.advance_vectorized(2)
+        self._pooled.close_worker_pool()
+        self.assertIsNone(self._pooled._workerPool)
+
+        # the state can grow again once it is back in the parent's memory
+        self._pooled.advance_vectorized(3)
+        self._vectorized.advance_vectorized(3)
+        self.assert_populations_equal(self._vectorized, self._pooled)
+
+    def testPeopleWorkersGiveTheSameResultsAsASingleProcess(self):
+        serial = build_population([copy.deepcopy(person) for person in self._pooled._people])
+        self._pooled.advance_multi_process(2)
+        self._pooled.advance_multi_process(2)
+        serial.advance(4)
+        self.assert_populations_equal(serial, self._pooled)
+        np.testing.assert_array_equal(serial._state.random_effect('gcp'),
+                                      self._pooled._state.random_effect('gcp'))
+
+    def testPeopleChangedInTheParentAreSentToTheirWorker(self):
+        self._pooled.advance_multi_process(1)
+        person = self._pooled._people[40]
+        person.add_outcome_event(Outcome(OutcomeType.STROKE, True))
+        self._pooled._workerPool.update_people(np.array([40]))
+
+        self._pooled.advance_multi_process(1)
+        self.assertEqual(2, len(person._age))
+        self.assertEqual([True, True, False], list(person._alive))
+        self.assertEqual(1, self._pooled._state.outcome_count('stroke')[40])
+
+    def testFractionalTreatmentsAreKeptInSharedMemory(self):
+        def halfAMedication(person):
+            return {'_antiHypertensiveCount': 0.5}, {}, None
+        self._pooled.set_bp_treatment_strategy(halfAMedication)
+        self._vectorized.set_random_seed(99)
+        self._vectorized.set_bp_treatment_strategy(halfAMedication)
+        with warnings.catch_warnings():
+            warnings.simplefilter("error")
+            self._pooled.advance_multi_process(2, vectorized=True)
+        self._vectorized.advance_vectorized(2)
+        self.assert_populations_equal(self._vectorized, self._pooled)
+        self.assertEqual(0.5, self._pooled._state.history('antiHypertensiveCount')[0, 1])
+
+    def testPeopleThatArentBuiltStayUnbuilt(self):
+        people = build_people_using_nhanes_for_sampling(fixture_nhanes(100, 3), 40,
+                                                        random_seed=3)
+        population = build_population(people)
+        population.set_random_seed(5)
+        population.advance_multi_process(2, vectorized=True)
+        population.close_worker_pool()
+        self.assertEqual([], population.built_people(np.arange(40)))
+        self.assertEqual(3, population._state.lengths('age').max())
+
+    def testUnseededResultsDontDependOnTheNumberOfWorkers(self):
+        for vectorized in [True, False]:
+            populations = []
+            for numberOfProcesses in [2, 3]:
+                population = build_population(build_people())
+                self.assertIsNone(population._state.randomStreams)
+                population.num_of_processes = numberOfProcesses
+                np.random.seed(7)
+                population.advance_multi_process(3, vectorized=vectorized)
+                population.close_worker_pool()
+                populations.append(population)
+            self.assert_populations_equal(*populations)
+
+    def testClonesContinueLikeThePopulationTheyWereClonedFrom(self):
+        self._pooled.advance_vectorized(2)
+        self._vectorized.set_random_seed(99)
+        self._vectorized.advance_vectorized(5)
+        clone = self._pooled.clone()
+        self.assertEqual(2, clone._totalWavesAdvanced)
+
+        clone.advance_vectorized(3)
+        self.assert_populations_equal(self._vectorized, clone)
+        # the population it was cloned from didn't move, and can still use the worker pool
+        self.assertEqual(3, self._pooled._state.lengths('age').max())
+        self._pooled.advance_multi_process(3, vectorized=True)
+        self.assert_populations_equal(self._vectorized, self._pooled)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -10,6 +10,7 @@ from microsim.alcohol_category import AlcoholCategory
 from microsim.person import Person
 
 import unittest
+import pickle
 import pandas as pd
 import numpy as np
 import statsmodels.formula.api as statsmodel
@@ -176,6 +177,31 @@ class TestStatsModelLinearRiskFactorModel(unittest.TestCase):
             StatsModelLinearRiskFactorModel(
             self.interactionModel).estimate_next_risk(testPerson), 5)
 
+    def testCompiledPredictorMatchesInterpreter(self):
+        for regressionModel in [self.simpleModelResult, self.meanModelResult,
+                                self.logMeanModelResult, self.raceModelResult,
+                                self.meanLagModelResult, self.interactionModel]:
+            model = StatsModelLinearRiskFactorModel(regressionModel)
+            for testPerson in self.people[:10]:
+                self.assertEqual(model.linear_predictor_interpreted(testPerson),
+                                 model.get_compiled_linear_predictor()(testPerson))
+
+    def testCompiledPredictorIsRegeneratedWhenInvalidated(self):
+        model = StatsModelLinearRiskFactorModel(self.simpleModelResult)
+        predictor = model.get_compiled_linear_predictor()
+        self.assertIs(predictor, model.get_compiled_linear_predictor())
+
+        model.non_intercept_params['age'] = 0
+        model.invalidate_compiled_linear_predictor()
+        self.assertEqual(self.simpleModelResultSM.params['Intercept'],
+                         model.estimate_next_risk(self.person))
+
+    def testModelWithCompiledPredictorCanBePickled(self):
+        model = StatsModelLinearRiskFactorModel(self.meanModelResult)
+        expected = model.estimate_next_risk(self.people[5])
+        unpickled = pickle.loads(pickle.dumps(model))
+        self.assertEqual(expected, unpickled.estimate_next_risk(self.people[5]))
+
 if __name__ == "__main__":
     unittest.main()
     
\ No newline at end of file
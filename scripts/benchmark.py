@@ -0,0 +1,31 @@
+import argparse
+import tempfile
+
+from microsim.benchmark import (BenchmarkFixtures, compare_results, format_results,
+                                load_results, run_benchmarks, save_results)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="times the simulation's hot paths")
+    parser.add_argument("--people", type=int, default=1000)
+    parser.add_argument("--years", type=int, default=3)
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--cases", nargs="*", help="only run cases whose names start with these")
+    parser.add_argument("--save", help="save the results, e.g. as a baseline, to this file")
+    parser.add_argument("--compare", help="compare the results with a saved baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="fraction by which a case can be slower than the baseline")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        fixtures = BenchmarkFixtures(directory, args.people, args.years, args.processes)
+        results = run_benchmarks(fixtures, args.repeats, args.cases)
+    print(format_results(results))
+    if args.save is not None:
+        save_results(results, args.save)
+    if args.compare is not None:
+        comparison = compare_results(results, load_results(args.compare), args.tolerance)
+        print(comparison.to_string())
+        # so that regressions fail a build
+        exit(1 if comparison.regressed.any() else 0)
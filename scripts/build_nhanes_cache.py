@@ -0,0 +1,7 @@
+from microsim.nhanes_cache import build_nhanes_cache
+
+
+def main():
+    # splits microsim/data/fullyImputedDataset.dta into nhanesCache in the cache
+    # directory, see get_cache_path
+    build_nhanes_cache()
@@ -0,0 +1,7 @@
+from microsim.age_standard import build_standard_population_table, save_standard_population_table
+
+
+def main():
+    # reduces microsim/data/us.1969_2017.19ages.adjusted.txt to the table of standard
+    # populations, standardPopulation.npz in the cache directory
+    save_standard_population_table(build_standard_population_table())